@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+STANCE_DTYPE = pd.CategoricalDtype(["Pro", "Con", "Und"])
+
 
 def create_demographics_df(
     df: pd.DataFrame, demographic_columns: list[str]
@@ -42,6 +44,39 @@ def create_user_activity_df(
     return activity_df
 
 
+def compact_users_df(
+    users_df: pd.DataFrame,
+    demographic_columns: list[str],
+    activity_columns: list[str],
+    big_issue_columns: list[str],
+) -> pd.DataFrame:
+    """Return `users_df` with memory-compact dtypes.
+
+    Big issue stances are stored with the shared `STANCE_DTYPE` categories, the
+    demographic columns as categoricals and all counts as the smallest integer type
+    that holds them.
+    """
+    users_df = users_df.copy()
+    for column in big_issue_columns:
+        if users_df[column].dropna().isin(STANCE_DTYPE.categories).all():
+            users_df[column] = users_df[column].astype(STANCE_DTYPE)
+        else:
+            users_df[column] = users_df[column].astype("category")
+
+    for column in demographic_columns:
+        users_df[column] = users_df[column].astype("category")
+
+    count_columns = activity_columns + [
+        "number_participated",
+        "num_demographics",
+        "num_big_issues",
+    ]
+    for column in count_columns:
+        users_df[column] = pd.to_numeric(users_df[column], downcast="integer")
+
+    return users_df
+
+
 def create_users_df(
     path_to_data: str, demographic_columns: list[str], activity_columns: list[str]
 ) -> pd.DataFrame:
@@ -53,4 +88,9 @@ def create_users_df(
     big_issues_df = create_big_issues_df(df)
     activity_df = create_user_activity_df(df, activity_columns)
     users_df = pd.concat([demographics_df, activity_df, big_issues_df], axis=1)
-    return users_df
+    big_issue_columns = [
+        column for column in big_issues_df.columns if column != "num_big_issues"
+    ]
+    return compact_users_df(
+        users_df, demographic_columns, activity_columns, big_issue_columns
+    )
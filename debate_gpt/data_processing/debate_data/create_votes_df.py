@@ -1,5 +1,19 @@
+from typing import Optional
+
 import pandas as pd
 
+from debate_gpt.data_processing.storage import VOTE_DTYPE
+
+USER_ID_COLUMNS = ["pro_user_id", "con_user_id", "voter_id"]
+VOTE_COLUMNS = [
+    "agreed_before",
+    "agreed_after",
+    "better_conduct",
+    "better_spelling_and_grammar",
+    "more_convincing_arguments",
+    "most_reliable_sources",
+]
+
 
 def extract_votes(debates_df: pd.DataFrame) -> pd.DataFrame:
     """Return a pandas dataframe with each row containing a vote for a debate in the
@@ -131,12 +145,49 @@ def preprocess_votes_df(votes_df: pd.DataFrame) -> pd.DataFrame:
     return votes_df
 
 
-def create_votes_df(debates_df: pd.DataFrame) -> pd.DataFrame:
-    """Create the votes dataframe from `debate_df`."""
+def create_user_id_dtype(
+    votes_df: pd.DataFrame, user_ids: Optional[pd.Index] = None
+) -> pd.CategoricalDtype:
+    """Return the categorical dtype shared by all user id columns of `votes_df`.
+
+    The categories are all user ids in `votes_df` and `user_ids` (e.g. the index of
+    `users_df`), so each user id is interned to the same integer code in every column.
+    """
+    ids = pd.concat([votes_df[column] for column in USER_ID_COLUMNS])
+    if user_ids is not None:
+        ids = pd.concat([ids, pd.Series(user_ids)])
+    return pd.CategoricalDtype(sorted(ids.dropna().unique()))
+
+
+def compact_votes_df(
+    votes_df: pd.DataFrame, user_ids: Optional[pd.Index] = None
+) -> pd.DataFrame:
+    """Return `votes_df` with memory-compact dtypes: user ids as categoricals sharing a
+    single dictionary (see `create_user_id_dtype`), votes as categoricals and the
+    debate id as the smallest integer type that holds it.
+    """
+    votes_df = votes_df.copy()
+    user_id_dtype = create_user_id_dtype(votes_df, user_ids)
+    for column in USER_ID_COLUMNS:
+        votes_df[column] = votes_df[column].astype(user_id_dtype)
+    for column in VOTE_COLUMNS:
+        votes_df[column] = votes_df[column].astype(VOTE_DTYPE)
+    votes_df["debate_id"] = pd.to_numeric(votes_df.debate_id, downcast="integer")
+    return votes_df
+
+
+def create_votes_df(
+    debates_df: pd.DataFrame, user_ids: Optional[pd.Index] = None
+) -> pd.DataFrame:
+    """Create the votes dataframe from `debate_df`.
+
+    User ids are interned into a dictionary shared with `user_ids` if provided (see
+    `compact_votes_df`).
+    """
     votes_df = extract_votes(debates_df)
     votes_df = preprocess_votes_df(votes_df)
     votes_df = votes_df[
         (votes_df.pro_user_id != votes_df.voter_id)
         & (votes_df.con_user_id != votes_df.voter_id)
     ]
-    return votes_df
+    return compact_votes_df(votes_df, user_ids)
@@ -1,5 +1,8 @@
+import numpy as np
 import pandas as pd
 
+from debate_gpt.data_processing.storage import save_df
+
 
 def filter_by_rounds(
     rounds_df: pd.DataFrame,
@@ -15,7 +18,7 @@ def filter_by_rounds(
     """
     # get total number of tokens per debater in each debate
     debater_token_counts = (
-        rounds_df.groupby(["debate_id", "side"])["token_count"]
+        rounds_df.groupby(["debate_id", "side"], observed=True)["token_count"]
         .sum()
         .to_frame()
         .reset_index()
@@ -117,4 +120,122 @@ def filter_votes_by_users(
 def add_propositions(
     debates_df: pd.DataFrame, propositions_df: pd.DataFrame, path_to_file: str
 ) -> None:
-    propositions_df.merge(debates_df, on="debate_id").to_json(path_to_file)
+    save_df(propositions_df.merge(debates_df, on="debate_id"), path_to_file)
+
+
+def compute_filter_statistics(
+    rounds_df: pd.DataFrame,
+    votes_df: pd.DataFrame,
+    users_df: pd.DataFrame,
+    debates_df: pd.DataFrame,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Return the statistics of each debate in `debates_df` and of each vote in
+    `votes_df` that the filters in this module are based on.
+
+    The first dataframe is indexed by debate_id and contains the number of tokens of
+    each side (pro_tokens and con_tokens), the number of rounds, votes and flipped
+    votes. As in the filters, these are NaN for the debates without rounds of a side
+    or without votes, which no setting of `sweep_filters` keeps. The second
+    dataframe contains the debate_id, agreed_before, agreed_after and the number of
+    demographics of the voter of each vote.
+    """
+    token_counts = (
+        rounds_df.groupby(["debate_id", "side"], observed=True)["token_count"]
+        .sum()
+        .unstack()
+        .reindex(columns=["Pro", "Con"])
+    )
+    debate_stats = pd.DataFrame(index=debates_df.index)
+    debate_stats["pro_tokens"] = token_counts.Pro
+    debate_stats["con_tokens"] = token_counts.Con
+    debate_stats["num_rounds"] = rounds_df.groupby("debate_id").size()
+    debate_stats["num_votes"] = votes_df.groupby("debate_id").size()
+    debate_stats["num_flipped_votes"] = votes_df.groupby("debate_id").flipped.sum()
+
+    vote_stats = (
+        votes_df[["debate_id", "voter_id", "agreed_before", "agreed_after"]]
+        .merge(
+            users_df[["num_demographics"]],
+            how="left",
+            left_on="voter_id",
+            right_index=True,
+        )
+        .drop(columns="voter_id")
+    )
+
+    return debate_stats, vote_stats
+
+
+def sweep_filters(
+    debate_stats: pd.DataFrame,
+    vote_stats: pd.DataFrame,
+    percentages: list[float],
+    min_tokens: list[int],
+    min_num_votes: list[int],
+    min_num_flipped_votes: list[int],
+    min_num_demographics: list[int],
+) -> pd.DataFrame:
+    """Return the size of the filtered data for every combination of the thresholds
+    of `filter_by_rounds`, `filter_by_votes` and `filter_votes_by_users`.
+
+    `debate_stats` and `vote_stats` should be computed with
+    `compute_filter_statistics`. All settings are evaluated at once as boolean
+    (setting x debate) and (setting x vote) arrays. Each row of the result contains
+    one setting with the number of debates, the number of votes and the percentage
+    of Pro, Con and Tie votes before and after the debate.
+    """
+    grid = pd.MultiIndex.from_product(
+        [
+            percentages,
+            min_tokens,
+            min_num_votes,
+            min_num_flipped_votes,
+            min_num_demographics,
+        ],
+        names=[
+            "percentage",
+            "min_tokens",
+            "min_num_votes",
+            "min_num_flipped_votes",
+            "min_num_demographics",
+        ],
+    ).to_frame(index=False)
+
+    def column(name: str) -> np.ndarray:
+        return grid[name].to_numpy()[:, None]
+
+    pro = debate_stats.pro_tokens.to_numpy()[None, :]
+    con = debate_stats.con_tokens.to_numpy()[None, :]
+    balanced = (1 + column("percentage") / 100) * np.minimum(pro, con) >= np.maximum(
+        pro, con
+    )
+    debate_mask = (
+        balanced
+        & (pro + con >= column("min_tokens"))
+        & (debate_stats.num_rounds.to_numpy()[None, :] >= 4)
+        & (debate_stats.num_votes.to_numpy()[None, :] >= column("min_num_votes"))
+        & (
+            debate_stats.num_flipped_votes.to_numpy()[None, :]
+            >= column("min_num_flipped_votes")
+        )
+    )
+
+    # position of the debate of each vote in `debate_stats` (-1 if not in it)
+    vote_positions = debate_stats.index.get_indexer(vote_stats.debate_id)
+    in_debates = vote_positions >= 0
+    vote_mask = debate_mask[:, vote_positions] & in_debates[None, :]
+    num_demographics = vote_stats.num_demographics.to_numpy(dtype=float, na_value=-1)
+    vote_mask &= num_demographics[None, :] >= column("min_num_demographics")
+
+    results = grid.copy()
+    results["num_debates"] = debate_mask.sum(axis=1)
+    results["num_votes"] = vote_mask.sum(axis=1)
+    for vote_column in ["agreed_before", "agreed_after"]:
+        labels = vote_stats[vote_column].astype(str).to_numpy()
+        for label in ["Pro", "Con", "Tie"]:
+            counts = (vote_mask & (labels == label)[None, :]).sum(axis=1)
+            results[f"{label.lower()}_{vote_column}"] = (
+                100 * counts / np.maximum(results.num_votes, 1)
+            ).round(2)
+
+    return results
@@ -0,0 +1,155 @@
+import mmap
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from debate_gpt.data_processing.storage import load_df, resolve_path, save_df
+
+
+def write_rounds_store(
+    rounds_df: pd.DataFrame, path_to_text: str, path_to_index: str
+) -> None:
+    """Write the text of every round in `rounds_df` into a single UTF-8 file at
+    `path_to_text` and the position of each text into the index at `path_to_index`.
+
+    Each row of the index contains the debate_id, round, order and side of a round
+    together with the offset and length (in bytes) of its text in `path_to_text`.
+    Rounds without text have a length of -1.
+    """
+    rounds_df = rounds_df.sort_values(["debate_id", "order"])
+    offsets = []
+    lengths = []
+    offset = 0
+    with open(path_to_text, "wb") as f:
+        for text in rounds_df.text:
+            if pd.isna(text):
+                offsets.append(offset)
+                lengths.append(-1)
+                continue
+            encoded = text.encode("utf-8")
+            f.write(encoded)
+            offsets.append(offset)
+            lengths.append(len(encoded))
+            offset += len(encoded)
+
+    index_df = rounds_df[["debate_id", "round", "order", "side"]].reset_index(drop=True)
+    index_df["offset"] = np.array(offsets, dtype=np.int64)
+    index_df["length"] = np.array(lengths, dtype=np.int64)
+    save_df(index_df, path_to_index)
+
+
+class RoundsStore:
+    def __init__(self, path_to_text: str, path_to_index: str) -> None:
+        """Read-only access to the round texts written by `write_rounds_store`.
+
+        The text file is memory-mapped, so the texts are only read from disk when a
+        debate is requested and several processes opening the same store share a
+        single copy of it in the page cache.
+        """
+        self._path_to_text = path_to_text
+        self._path_to_index = path_to_index
+
+        index_df = load_df(path_to_index)
+        self._debate_ids = index_df.debate_id.to_numpy()
+        self._rounds = index_df["round"].to_numpy()
+        self._sides = index_df.side.astype(str).to_numpy()
+        self._offsets = index_df.offset.to_numpy()
+        self._lengths = index_df.length.to_numpy()
+
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self._path_to_text, "rb")
+        if os.path.getsize(self._path_to_text) == 0:
+            self._mmap = None
+            self._view = memoryview(b"")
+        else:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+
+    def close(self) -> None:
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "RoundsStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict:
+        # worker processes reopen the memory map instead of copying the texts
+        state = self.__dict__.copy()
+        del state["_file"], state["_mmap"], state["_view"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._open()
+
+    def _debate_slice(self, debate_id: int) -> slice:
+        start = np.searchsorted(self._debate_ids, debate_id, side="left")
+        end = np.searchsorted(self._debate_ids, debate_id, side="right")
+        return slice(start, end)
+
+    def _text(self, position: int) -> Optional[str]:
+        length = self._lengths[position]
+        if length < 0:
+            return None
+        start = self._offsets[position]
+        end = start + length
+        return str(self._view[start:end], "utf-8")
+
+    def get_debate_rounds(self, debate_id: int) -> list[tuple[int, str, str]]:
+        """Return a (round, side, text) tuple for every round of debate `debate_id` in
+        the order they were written.
+        """
+        debate_slice = self._debate_slice(debate_id)
+        return [
+            (int(self._rounds[i]), self._sides[i], self._text(i))
+            for i in range(debate_slice.start, debate_slice.stop)
+        ]
+
+    def get_text(self, debate_id: int, round: int, side: str) -> Optional[str]:
+        """Return the text of `side` in round `round` of debate `debate_id`."""
+        debate_slice = self._debate_slice(debate_id)
+        for i in range(debate_slice.start, debate_slice.stop):
+            if (self._rounds[i] == round) and (self._sides[i] == side):
+                return self._text(i)
+        raise KeyError(f"Round {round} of {side} not found in debate {debate_id}.")
+
+
+def is_store_stale(path_to_text: str, path_to_index: str, path_to_rounds: str) -> bool:
+    """Return whether the rounds store at `path_to_text` and `path_to_index` is
+    missing or older than the rounds dataframe stored at `path_to_rounds`.
+    """
+    if not (os.path.isfile(path_to_text) and os.path.isfile(path_to_index)):
+        return True
+    try:
+        rounds_mtime = os.path.getmtime(resolve_path(path_to_rounds))
+    except FileNotFoundError:
+        # a store distributed without its rounds dataframe is used as is
+        return False
+    store_mtime = min(os.path.getmtime(path_to_text), os.path.getmtime(path_to_index))
+    return rounds_mtime > store_mtime
+
+
+def open_rounds_store(
+    path_to_text: str, path_to_index: str, path_to_rounds: str
+) -> RoundsStore:
+    """Return the rounds store at `path_to_text` and `path_to_index`.
+
+    If the store does not exist yet or the rounds dataframe stored at
+    `path_to_rounds` was regenerated since it was written, it is first (re)created
+    from the rounds dataframe.
+    """
+    if is_store_stale(path_to_text, path_to_index, path_to_rounds):
+        rounds_df = load_df(
+            path_to_rounds, columns=["debate_id", "round", "order", "side", "text"]
+        )
+        write_rounds_store(rounds_df, path_to_text, path_to_index)
+    return RoundsStore(path_to_text, path_to_index)
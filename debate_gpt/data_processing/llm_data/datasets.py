@@ -0,0 +1,162 @@
+import json
+import os
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from debate_gpt.data_processing.llm_data.tidy_session import TidySession, get_files_key
+
+# increase when the definition of the datasets changes to regenerate datasets.json
+DATASETS_VERSION = 1
+
+QUESTIONS = ["q1", "q2", "q3"]
+KEY_COLUMNS = ["model", "question", "debate_length"]
+
+
+class CoverageMatrix:
+    def __init__(self, dfs: dict[str, pd.DataFrame]) -> None:
+        """Boolean matrix of the debates answered by each model for each question
+        (e.g. q1) and debate length, built from the LLM output dataframes `dfs` of
+        each question.
+
+        Each row of the matrix, packed into bits, is a (model, question, debate_length)
+        key and each column a debate id, so that the debates covered by any
+        combination of keys are found with bitwise operations on the rows.
+        """
+        df = pd.concat(
+            [
+                df[["model", "debate_length", "debate_id"]].assign(question=question)
+                for question, df in dfs.items()
+            ]
+        )
+
+        self._debate_ids = np.unique(df.debate_id.to_numpy())
+        self._keys = df[KEY_COLUMNS].drop_duplicates().reset_index(drop=True)
+
+        rows = df.groupby(KEY_COLUMNS, sort=False, dropna=False).ngroup().to_numpy()
+        columns = np.searchsorted(self._debate_ids, df.debate_id.to_numpy())
+        matrix = np.zeros((len(self._keys), len(self._debate_ids)), dtype=bool)
+        matrix[rows, columns] = True
+        self._bits = np.packbits(matrix, axis=1)
+
+    @property
+    def keys(self) -> pd.DataFrame:
+        return self._keys
+
+    @property
+    def debate_ids(self) -> np.ndarray:
+        return self._debate_ids
+
+    def get_lengths(self, question: str) -> list[str]:
+        """Return the debate lengths answered for `question`, in order of appearance."""
+        return list(self._keys[self._keys.question == question].debate_length.unique())
+
+    def get_debate_ids(
+        self,
+        models: Optional[list[str]] = None,
+        questions: Optional[list[str]] = None,
+        lengths: Optional[list[str]] = None,
+    ) -> list[int]:
+        """Return the debates answered by every model in `models` for every question
+        in `questions`, restricted to the debates of `lengths` (all if None).
+
+        A model only restricts the debates of a question if it answered at least one
+        debate of `lengths` for that question.
+        """
+        mask = pd.Series(True, index=self._keys.index)
+        for column, values in zip(KEY_COLUMNS, [models, questions, lengths]):
+            if values is not None:
+                mask &= self._keys[column].isin(values)
+        keys = self._keys[mask]
+        if len(keys) == 0:
+            return []
+
+        # debates of each (model, question) over the selected lengths
+        covered = [
+            np.bitwise_or.reduce(self._bits[group.index], axis=0)
+            for _, group in keys.groupby(["model", "question"], sort=False)
+        ]
+        bits = np.bitwise_and.reduce(covered, axis=0)
+        debates = np.unpackbits(bits, count=len(self._debate_ids)).astype(bool)
+        return list(map(int, self._debate_ids[debates]))
+
+
+def get_issue_datasets(issues_files: list[str]) -> dict[str, list[int]]:
+    """Return the debate ids of the propositions in each of the `issues_files`, by
+    issue name (e.g. Abortion).
+    """
+    datasets = {}
+    for file in issues_files:
+        props = pd.read_json(file)
+        debate_ids = list(props.debate_id.unique())
+        name = file.split("/")[-1].split("_props")[0]
+        if "_" in name:
+            name = name.replace("_", " ")
+        name = name.title()
+        datasets[name] = list(map(int, debate_ids))
+    return datasets
+
+
+def create_datasets(
+    coverage: CoverageMatrix, issues_files: list[str]
+) -> dict[str, list[int]]:
+    """Return the debate ids of each dataset: the debates answered by every model for
+    q1, q2 and q3 for each debate length of q1 and for all lengths, and the debates
+    of each issue.
+    """
+    datasets = {}
+    for debate_length in coverage.get_lengths("q1"):
+        datasets[debate_length.title()] = coverage.get_debate_ids(
+            questions=QUESTIONS, lengths=[debate_length]
+        )
+    datasets["All"] = coverage.get_debate_ids(questions=QUESTIONS)
+    datasets.update(get_issue_datasets(issues_files))
+    return datasets
+
+
+def write_datasets(
+    session: TidySession,
+    issues_files: list[str],
+    path_to_file: str,
+    force: bool = False,
+) -> dict[str, Any]:
+    """Write the datasets of `create_datasets` into `path_to_file` and return them.
+
+    A sidecar file (e.g. datasets.meta.json) records the version of the datasets
+    and a key of the output and issues files they were created from. If neither
+    changed, the datasets are read from `path_to_file` instead of being created again,
+    unless `force` is True.
+    """
+    files = [file for q in QUESTIONS for file in session.get_output_files(q)]
+    key = get_files_key(files + issues_files, DATASETS_VERSION)
+    path_to_meta = os.path.splitext(path_to_file)[0] + ".meta.json"
+
+    if (not force) and os.path.isfile(path_to_file) and os.path.isfile(path_to_meta):
+        with open(path_to_meta) as f:
+            meta = json.load(f)
+        if meta.get("key") == key:
+            with open(path_to_file) as f:
+                return json.load(f)
+
+    coverage = CoverageMatrix(
+        {
+            q: session.get_outputs(q, columns=["model", "debate_length", "debate_id"])
+            for q in QUESTIONS
+        }
+    )
+    datasets = create_datasets(coverage, issues_files)
+
+    with open(path_to_file, "w") as f:
+        json.dump(datasets, f)
+    with open(path_to_meta, "w") as f:
+        json.dump(
+            {
+                "version": DATASETS_VERSION,
+                "key": key,
+                "num_debates": {name: len(ids) for name, ids in datasets.items()},
+            },
+            f,
+            indent=2,
+        )
+    return datasets
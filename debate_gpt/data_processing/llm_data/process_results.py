@@ -1,159 +1,307 @@
 import json
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, Optional
 
+import numpy as np
 import pandas as pd
 
+from debate_gpt.data_processing.storage import VOTE_DTYPE
 
-def majority_vote(row, column):
-    num_pro = (row[column] == "Pro").sum()
-    num_con = (row[column] == "Con").sum()
-    num_tie = (row[column] == "Tie").sum()
 
-    if (num_tie > num_pro) & (num_tie > num_con):
-        return "Tie"
-    elif num_pro > num_con:
-        return "Pro"
-    elif num_con > num_pro:
-        return "Con"
-    elif num_pro == num_con:
-        return "Tie"
+def aggregate_labels(
+    df: pd.DataFrame, columns: list[str], by: str = "debate_id"
+) -> pd.DataFrame:
+    """Return the majority Pro, Con or Tie label of each of `columns` for every
+    group of `by`. Tie wins if it has strictly more votes than both Pro and Con,
+    otherwise the larger of Pro and Con wins, and an equal count is a Tie.
+
+    The labels of all `columns` are counted at once with a single `bincount` over
+    the group and label codes, so several label columns (e.g. agreed_after and
+    more_convincing_arguments) can be aggregated in one pass.
+    """
+    group_codes, groups = pd.factorize(df[by], sort=True)
+    num_groups = len(groups)
+    num_labels = len(VOTE_DTYPE.categories)
+    pro, con, tie = (list(VOTE_DTYPE.categories).index(x) for x in LABELS)
+
+    aggregated = pd.DataFrame({by: groups})
+    for column in columns:
+        # labels outside of Pro, Con and Tie (e.g. NaN) have code -1 and are ignored
+        label_codes = df[column].astype(VOTE_DTYPE).cat.codes.to_numpy()
+        valid = label_codes >= 0
+        counts = np.bincount(
+            group_codes[valid] * num_labels + label_codes[valid],
+            minlength=num_groups * num_labels,
+        ).reshape(num_groups, num_labels)
+
+        num_pro, num_con, num_tie = counts[:, pro], counts[:, con], counts[:, tie]
+        codes = np.select(
+            [(num_tie > num_pro) & (num_tie > num_con), num_pro > num_con],
+            [tie, pro],
+            default=np.where(num_con > num_pro, con, tie),
+        )
+        aggregated[column] = pd.Categorical.from_codes(codes, dtype=VOTE_DTYPE)
+
+    return aggregated
+
+
+OUTPUT_COLUMNS = ["debate_id", "voter_id", "debate_length", "gpt_response"]
+
+
+def read_output_file(
+    file: str,
+    issues: bool = False,
+    columns: Optional[list[str]] = OUTPUT_COLUMNS,
+    extract: bool = False,
+) -> pd.DataFrame:
+    """Return the LLM outputs stored in `file` as a dataframe with the model (and, if
+    `issues` is True, whether big issues and reasoning were used) parsed from the
+    name of the file.
+
+    Only the `columns` present in any record of the file are kept (all columns if
+    None), so large fields such as the prompt message are dropped while parsing. An
+    empty file gives an empty dataframe with the `columns` (`OUTPUT_COLUMNS` if
+    None). If `extract` is True, the answers are extracted with `extract_answers`.
+    """
+    filename = file.split("/")[-1].split(".json")[0]
+    model = filename.split("-q")[0]
+
+    with open(file) as f:
+        records = json.load(f)
+    if len(records) == 0:
+        df = pd.DataFrame(columns=OUTPUT_COLUMNS if columns is None else columns)
+    elif columns is None:
+        df = pd.DataFrame.from_records(records)
     else:
-        return "else"
-
-
-def create_df(files: list[str], issues: bool = False) -> pd.DataFrame:
-    dfs = []
-    for file in files:
-        filename = file.split("/")[-1].split(".json")[0]
-        model = filename.split("-q")[0]
-        df = pd.read_json(file)
-        if "r" in filename:
-            df["gpt_response"] = df.gpt_response.apply(
-                lambda x: x.title().split("Answer: ")[-1]
+        present = set().union(*records)
+        keys = [column for column in columns if column in present]
+        df = pd.DataFrame.from_records(
+            [[record.get(key) for key in keys] for record in records], columns=keys
+        )
+    if (columns is not None or len(records) == 0) and ("debate_id" in df.columns):
+        df["debate_id"] = df.debate_id.astype(int)
+
+    if "r" in filename:
+        df["gpt_response"] = (
+            df.gpt_response.astype(str).str.title().str.split("Answer: ").str[-1]
+        )
+    df["model"] = model
+    if issues:
+        if "-bi" in filename:
+            df["big_issues"] = True
+        else:
+            df["big_issues"] = False
+
+        if "-r" in filename:
+            df["reasoning"] = True
+        else:
+            df["reasoning"] = False
+
+    if extract:
+        answers = extract_answers(df.gpt_response)
+        df["processed_gpt_response"] = answers.processed_gpt_response
+        df["ambiguous"] = answers.ambiguous
+
+    return df
+
+
+def iter_output_dfs(
+    files: list[str],
+    issues: bool = False,
+    columns: Optional[list[str]] = OUTPUT_COLUMNS,
+    extract: bool = False,
+    num_workers: int = 1,
+) -> Iterator[pd.DataFrame]:
+    """Yield the dataframe of each file in `files` read with `read_output_file`.
+
+    The files are read by `num_workers` processes, with at most `num_workers` files
+    read ahead, so that outputs larger than memory can be processed one file at a
+    time.
+    """
+    if num_workers <= 1:
+        for file in files:
+            yield read_output_file(file, issues, columns, extract)
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = deque()
+        for file in files:
+            futures.append(
+                executor.submit(read_output_file, file, issues, columns, extract)
             )
-        df["model"] = model
-        if issues:
-            if "-bi" in filename:
-                df["big_issues"] = True
-            else:
-                df["big_issues"] = False
-
-            if "-r" in filename:
-                df["reasoning"] = True
-            else:
-                df["reasoning"] = False
-
-        dfs.append(df)
-
-    return pd.concat(dfs).reset_index(drop=True)
-
-
-def extract_answer(x):
-
-    response = x.gpt_response.lower()
-    if response == "pro":
-        return "Pro"
-    if response == "con":
-        return "Con"
-    if response == "tie":
-        return "Tie"
-
-    regexp_pro = r"\bpro\b"
-    regexp_con = r"\bcon\b"
-    regexp_tie = r"\btie\b"
-
-    if re.search(regexp_pro, response):
-        if not re.search(regexp_con, response):
-            if not re.search(regexp_tie, response):
-                return "Pro"
-
-    elif re.search(regexp_con, response):
-        if not re.search(regexp_pro, response):
-            if not re.search(regexp_tie, response):
-                return "Con"
-
-    elif re.search(regexp_tie, response):
-        if not re.search(regexp_con, response):
-            if not re.search(regexp_pro, response):
-                return "Tie"
-
-    if (
-        (re.search(regexp_pro, response) is None)
-        & (re.search(regexp_con, response) is None)
-        & (re.search(regexp_tie, response) is None)
-    ):
-        return "Other"
-
-    if ("agree with the ") in response:
-        stance = response.split("agree with the ")[1].split("side")[0]
-        if "pro" in stance:
-            return "Pro"
-        elif "con" in stance:
-            return "Con"
-        elif "tie" in stance:
-            return "Tie"
-
-    if "my answer is " in response:
-        stance = response.split("my answer is ")[1]
-        if "pro" in stance:
-            return "Pro"
-        elif "con" in stance:
-            return "Con"
-        elif "tie" in stance:
-            return "Tie"
-
-    print("\n\n", x.debate_id, "\n\n", response)
-    replacement = input()
-    print("got")
-    if replacement in ["Pro", "Con", "Tie"]:
-        return replacement
-    else:
-        return "Other"
+            if len(futures) >= num_workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
 
 
-def get_crowd_answer(x):
-    if x["Pro"]:
-        return "Pro"
-    elif x["Con"]:
-        return "Con"
-    else:
-        return "Tie"
+LABELS = ["Pro", "Con", "Tie"]
+LABEL_PATTERNS = {label: re.compile(rf"\b{label.lower()}\b") for label in LABELS}
+ANSWER_PHRASES = ["agree with the ", "my answer is "]
 
 
-def process_crowdsourcing_data(crowd: pd.DataFrame):
-    crowd["q1"] = crowd.apply(
-        lambda x: json.loads(x["Answer.taskAnswers"])[0]["q3"], axis=1
+def _select_label(stances: pd.Series) -> pd.Series:
+    """Return the first label contained in each of the `stances` (NaN if none)."""
+    stances = stances.fillna("")
+    conditions = [stances.str.contains(label.lower(), regex=False) for label in LABELS]
+    return pd.Series(
+        np.select(conditions, LABELS, default=None), index=stances.index, dtype=object
     )
-    crowd["q2"] = crowd.apply(
-        lambda x: json.loads(x["Answer.taskAnswers"])[0]["q1"], axis=1
+
+
+def _extract_answers(responses: pd.Series) -> pd.DataFrame:
+    response = responses.fillna("").astype(str).str.lower()
+
+    found = pd.DataFrame(
+        {label: response.str.contains(LABEL_PATTERNS[label]) for label in LABELS}
     )
-    crowd["q3"] = crowd.apply(
-        lambda x: json.loads(x["Answer.taskAnswers"])[0]["q2"], axis=1
+    num_found = found.sum(axis=1)
+
+    answers = pd.Series("Other", index=response.index, dtype=object)
+    single = num_found == 1
+    answers[single] = found[single].idxmax(axis=1)
+
+    # when several labels are mentioned, look for the stance following a phrase
+    unresolved = num_found > 1
+    for phrase in ANSWER_PHRASES:
+        # responses without the phrase have no stance (an empty string)
+        stances = response[unresolved].str.split(phrase, regex=False).str[1].fillna("")
+        if phrase == "agree with the ":
+            stances = stances.str.split("side", regex=False).str[0]
+        labels = _select_label(stances)
+        resolved = labels.notna()
+        answers[labels[resolved].index] = labels[resolved]
+        unresolved[labels[resolved].index] = False
+
+    return pd.DataFrame({"processed_gpt_response": answers, "ambiguous": unresolved})
+
+
+def extract_answers(responses: pd.Series, num_workers: int = 1) -> pd.DataFrame:
+    """Return the answer ("Pro", "Con", "Tie" or "Other") contained in each of the LLM
+    `responses`.
+
+    A response is answered with a label if it is the only label mentioned in the
+    response as a word or, if several labels are mentioned, the label following
+    "agree with the" or "my answer is". Responses mentioning several labels with none
+    of these phrases are answered with "Other" and flagged in the `ambiguous` column
+    so that they can be reviewed (see `write_review_queue`). The responses are split
+    in chunks processed by `num_workers` processes.
+
+    :returns: a dataframe with the columns processed_gpt_response and ambiguous
+    """
+    if (num_workers <= 1) or (len(responses) < num_workers):
+        return _extract_answers(responses)
+
+    chunks = np.array_split(np.arange(len(responses)), num_workers)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(
+            _extract_answers, [responses.iloc[chunk] for chunk in chunks]
+        )
+        return pd.concat(list(results))
+
+
+def get_review_keys(df: pd.DataFrame) -> list[str]:
+    """Return the columns of `df` identifying a response in the review queue."""
+    return [
+        column
+        for column in ["model", "debate_id", "voter_id", "gpt_response"]
+        if column in df.columns
+    ]
+
+
+def write_review_queue(df: pd.DataFrame, path_to_file: str) -> None:
+    """Add the responses in `df` to the review queue CSV file at `path_to_file`.
+
+    A reviewer fills the answer column of the file with "Pro", "Con" or "Tie", which
+    `apply_review_queue` merges into the processed responses. Responses already in
+    the file keep their answer.
+    """
+    queue_df = df[get_review_keys(df)].drop_duplicates()
+    queue_df["answer"] = ""
+    if os.path.isfile(path_to_file):
+        old_queue_df = pd.read_csv(path_to_file, keep_default_na=False)
+        queue_df = pd.concat([old_queue_df, queue_df.astype(old_queue_df.dtypes)])
+        queue_df = queue_df.drop_duplicates(get_review_keys(df), keep="first")
+    queue_df.to_csv(path_to_file, index=False)
+
+
+def apply_review_queue(df: pd.DataFrame, path_to_file: str) -> pd.DataFrame:
+    """Return `df` with the processed_gpt_response of every response answered in the
+    review queue at `path_to_file` replaced by its answer.
+    """
+    if not os.path.isfile(path_to_file):
+        return df
+
+    keys = get_review_keys(df)
+    queue_df = pd.read_csv(path_to_file, keep_default_na=False)
+    queue_df = queue_df[queue_df.answer.isin(LABELS)]
+    queue_df = queue_df[keys + ["answer"]].astype(df[keys].dtypes)
+
+    df = df.merge(queue_df, on=keys, how="left")
+    reviewed = df.answer.notna()
+    df.loc[reviewed, "processed_gpt_response"] = df.answer[reviewed]
+    return df.drop(columns="answer")
+
+
+# the questions of the crowdsourcing task are ordered differently than q1, q2 and q3
+CROWD_QUESTIONS = {"q1": "q3", "q2": "q1", "q3": "q2"}
+CROWD_COLUMNS = ["Input.debate_id", "Input.voter_id", "Answer.taskAnswers"]
+
+
+def process_crowdsourcing_data(crowd: pd.DataFrame):
+    """Return the q1, q2 and q3 answers of each MTurk assignment in `crowd`.
+
+    The JSON payload of each assignment is parsed once and flattened into one boolean
+    column per question and label, from which the answer is Pro if Pro was checked,
+    otherwise Con if Con was checked, and Tie otherwise.
+    """
+    answers = pd.json_normalize(
+        [json.loads(payload)[0] for payload in crowd["Answer.taskAnswers"]]
     )
-    crowd["q1"] = crowd.q1.apply(lambda x: get_crowd_answer(x))
-    crowd["q2"] = crowd.q2.apply(lambda x: get_crowd_answer(x))
-    crowd["q3"] = crowd.q3.apply(lambda x: get_crowd_answer(x))
 
-    crowd = crowd[["Input.debate_id", "Input.voter_id", "q1", "q2", "q3"]]
-    crowd = crowd.rename(
-        columns={"Input.debate_id": "debate_id", "Input.voter_id": "voter_id"}
+    df = pd.DataFrame(
+        {
+            "debate_id": crowd["Input.debate_id"].to_numpy(),
+            "voter_id": crowd["Input.voter_id"].to_numpy(),
+        }
     )
-    return crowd
+    for question, crowd_question in CROWD_QUESTIONS.items():
+        pro, con = (
+            answers.get(f"{crowd_question}.{label}", pd.Series(False, answers.index))
+            .fillna(False)
+            .astype(bool)
+            .to_numpy()
+            for label in ["Pro", "Con"]
+        )
+        df[question] = np.select([pro, con], ["Pro", "Con"], default="Tie")
+    return df
 
 
-def get_overlap_sets(dfs):
-    dfs = [df.groupby(["model"]).debate_id.unique() for df in dfs]
-    sets = [el for ls in [[set(sds) for sds in df] for df in dfs] for el in ls]
-    debate_set = sets[0]
-    for sds in sets:
-        debate_set = debate_set.intersection(sds)
-    return list(map(int, debate_set))
+def prepare_crowd(files: list[str], num_workers: int = 1) -> pd.DataFrame:
+    """Return the crowdsourcing answers in the MTurk batch `files`, with one answer
+    sampled per voter of each debate. The batches are read by `num_workers` threads.
+    """
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+        dfs = list(
+            executor.map(lambda file: pd.read_csv(file, usecols=CROWD_COLUMNS), files)
+        )
+    df = pd.concat(dfs).reset_index(drop=True)
+    df = process_crowdsourcing_data(df)
+    df = df.groupby(["debate_id", "voter_id"]).sample(1).reset_index(drop=True)
+    df["model"] = "MTurk"
 
+    return df
 
-def to_stance(row, column):
-    if row[column] == "Pro":
-        return 1
-    elif row[column] == "Con":
-        return -1
-    else:
-        return 0
+
+# stance of the Pro, Con and Tie codes of VOTE_DTYPE, with other labels (code -1) as 0
+STANCE_VALUES = np.array([1, -1, 0, 0])
+
+
+def to_stances(labels: pd.Series) -> np.ndarray:
+    """Return the stance (1 for Pro, -1 for Con and 0 otherwise) of every label in
+    `labels`.
+    """
+    return STANCE_VALUES[labels.astype(VOTE_DTYPE).cat.codes.to_numpy()]
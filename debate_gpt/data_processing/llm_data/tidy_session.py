@@ -0,0 +1,150 @@
+import glob
+import hashlib
+import os
+from typing import Iterator, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from debate_gpt.data_processing.llm_data.process_results import (
+    iter_output_dfs,
+    prepare_crowd,
+)
+from debate_gpt.data_processing.storage import load_df
+
+# increase when the parsing of the outputs changes to invalidate the cache
+CACHE_VERSION = 1
+
+
+def get_files_key(files: list[str], *args) -> str:
+    """Return a key identifying the current version of `files` based on their size
+    and modification time, and on `args`.
+    """
+    sha = hashlib.sha256(str(CACHE_VERSION).encode())
+    for file in sorted(files):
+        stat = os.stat(file)
+        sha.update(f"{file}-{stat.st_size}-{stat.st_mtime_ns}".encode())
+    for arg in args:
+        sha.update(str(arg).encode())
+    return sha.hexdigest()[:16]
+
+
+def read_cache(path_to_file: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """Return the `columns` of the Parquet file `path_to_file` that it contains (all
+    columns if None).
+    """
+    if columns is not None:
+        names = pq.read_schema(path_to_file).names
+        columns = [column for column in columns if column in names]
+    return pd.read_parquet(path_to_file, columns=columns)
+
+
+class TidySession:
+    def __init__(
+        self,
+        path_to_outputs: str = "data/processing/llm_outputs",
+        path_to_crowd: str = "data/processing/crowdsourcing/output",
+        path_to_votes: str = "data/processing/processed_data/votes_df.parquet",
+        path_to_cache: str = "data/processing/cache",
+        num_workers: int = 1,
+    ) -> None:
+        """Loads the data needed to prepare the tidy results at most once.
+
+        The LLM outputs in each folder of `path_to_outputs` (e.g. q1) are parsed with
+        their answers extracted and cached as Parquet files in `path_to_cache`, one
+        per output file, keyed by the size and modification time of the file. The
+        crowdsourcing results in `path_to_crowd` are cached in the same way. Only new
+        or modified files are parsed again, by `num_workers` processes. The outputs
+        are read one file at a time and only the columns asked for, so they are never
+        all held in memory. The votes and crowdsourcing results are kept in memory
+        once loaded, so preparing several tidy files in one session reads them once.
+        """
+        self._path_to_outputs = path_to_outputs
+        self._path_to_crowd = path_to_crowd
+        self._path_to_votes = path_to_votes
+        self._path_to_cache = path_to_cache
+        self._num_workers = num_workers
+
+        self._votes_df = None
+        self._crowd_df = None
+
+    @property
+    def votes_df(self) -> pd.DataFrame:
+        if self._votes_df is None:
+            self._votes_df = load_df(self._path_to_votes)
+        return self._votes_df
+
+    @property
+    def crowd_df(self) -> pd.DataFrame:
+        if self._crowd_df is None:
+            files = glob.glob(os.path.join(self._path_to_crowd, "*.csv"))
+            path_to_file = os.path.join(
+                self._path_to_cache, f"crowd.{get_files_key(files)}.parquet"
+            )
+            if os.path.isfile(path_to_file):
+                self._crowd_df = pd.read_parquet(path_to_file)
+            else:
+                self._crowd_df = prepare_crowd(files, self._num_workers)
+                self._save_cache(self._crowd_df, path_to_file, "crowd")
+        return self._crowd_df
+
+    def _save_cache(self, df: pd.DataFrame, path_to_file: str, name: str) -> None:
+        """Save `df` into `path_to_file` and remove older versions of `name`."""
+        directory = os.path.dirname(path_to_file)
+        os.makedirs(directory, exist_ok=True)
+        for old_file in glob.glob(os.path.join(directory, f"{name}.*.parquet")):
+            os.remove(old_file)
+        df.to_parquet(path_to_file)
+
+    def get_output_files(self, folder: str) -> list[str]:
+        """Return the LLM output files in `folder` of `path_to_outputs`."""
+        return sorted(glob.glob(os.path.join(self._path_to_outputs, folder, "*.json")))
+
+    def iter_outputs(
+        self, folder: str, issues: bool = False, columns: Optional[list[str]] = None
+    ) -> Iterator[pd.DataFrame]:
+        """Yield the LLM outputs of each file in `folder` of `path_to_outputs`, with
+        the answers extracted (see `read_output_file`).
+
+        Only the `columns` present in the outputs are read (all columns if None).
+        """
+        paths = {}
+        for file in self.get_output_files(folder):
+            name = os.path.basename(file).split(".json")[0]
+            paths[file] = (
+                name,
+                os.path.join(
+                    self._path_to_cache,
+                    folder,
+                    f"{name}.{get_files_key([file], issues)}.parquet",
+                ),
+            )
+
+        uncached = [
+            file for file, (_, path) in paths.items() if not os.path.isfile(path)
+        ]
+        parsed = iter_output_dfs(
+            uncached, issues, extract=True, num_workers=self._num_workers
+        )
+        # the files are yielded in order, whether they are read from the cache or
+        # parsed again
+        for file, (name, path_to_file) in paths.items():
+            if file not in uncached:
+                yield read_cache(path_to_file, columns)
+                continue
+            df = next(parsed)
+            self._save_cache(df, path_to_file, name)
+            if columns is not None:
+                df = df[[column for column in columns if column in df.columns]]
+            yield df
+
+    def get_outputs(
+        self, folder: str, issues: bool = False, columns: Optional[list[str]] = None
+    ) -> pd.DataFrame:
+        """Return the `columns` (all if None) of the LLM outputs of all the files in
+        `folder` of `path_to_outputs` (see `iter_outputs`).
+        """
+        dfs = list(self.iter_outputs(folder, issues, columns))
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(dfs).reset_index(drop=True)
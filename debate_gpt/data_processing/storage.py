@@ -0,0 +1,139 @@
+import operator
+import os
+from typing import Any, Optional
+
+import pandas as pd
+
+SUFFIXES = [".parquet", ".json"]
+
+SIDE_DTYPE = pd.CategoricalDtype(["Pro", "Con"])
+VOTE_DTYPE = pd.CategoricalDtype(["Pro", "Con", "Tie"])
+
+LABEL_DTYPES = {
+    "side": SIDE_DTYPE,
+    "agreed_before": VOTE_DTYPE,
+    "agreed_after": VOTE_DTYPE,
+    "better_conduct": VOTE_DTYPE,
+    "better_spelling_and_grammar": VOTE_DTYPE,
+    "more_convincing_arguments": VOTE_DTYPE,
+    "most_reliable_sources": VOTE_DTYPE,
+}
+
+FILTER_OPERATORS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda column, value: column.isin(value),
+    "not in": lambda column, value: ~column.isin(value),
+}
+
+
+def categorize_labels(df: pd.DataFrame) -> pd.DataFrame:
+    """Return `df` with every side and vote label column (e.g. agreed_before) stored
+    as a categorical with a fixed set of categories.
+
+    Columns containing values outside of the categories are left unchanged, since
+    converting them would silently replace those values with NaN.
+    """
+    df = df.copy(deep=False)
+    for column, dtype in LABEL_DTYPES.items():
+        if (column not in df.columns) or isinstance(
+            df[column].dtype, pd.CategoricalDtype
+        ):
+            continue
+        values = df[column].dropna()
+        if values.isin(dtype.categories).all():
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _apply_filters(
+    df: pd.DataFrame, filters: list[tuple[str, str, Any]]
+) -> pd.DataFrame:
+    """Return the rows of `df` that satisfy every (column, operator, value) tuple in
+    `filters`. This mirrors the predicates pushed down to the Parquet reader for JSON
+    files, which do not support predicate pushdown.
+    """
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if op not in FILTER_OPERATORS:
+            raise ValueError(f"Filter operator {op} unknown.")
+        mask &= FILTER_OPERATORS[op](df[column], value)
+    return df[mask]
+
+
+def resolve_path(path_to_file: str) -> str:
+    """Return the file that should be read for `path_to_file`.
+
+    If `path_to_file` does not exist, the same table stored in another supported
+    format (e.g. `votes_df.json` for `votes_df.parquet`) is used instead. This keeps
+    the JSON files distributed on Zenodo usable with paths to Parquet files.
+    """
+    if os.path.isfile(path_to_file):
+        return path_to_file
+
+    root, _ = os.path.splitext(path_to_file)
+    for suffix in SUFFIXES:
+        if os.path.isfile(root + suffix):
+            return root + suffix
+
+    raise FileNotFoundError(f"No table found at {path_to_file}.")
+
+
+def load_df(
+    path_to_file: str,
+    columns: Optional[list[str]] = None,
+    filters: Optional[list[tuple[str, str, Any]]] = None,
+) -> pd.DataFrame:
+    """Return the table stored at `path_to_file` as a pandas dataframe.
+
+    Only `columns` are read (all columns if None) and only rows satisfying `filters`
+    are kept. `filters` is a list of (column, operator, value) tuples, e.g.
+    [("agreed_before", "!=", "Tie")], which is pushed down to the reader for Parquet
+    files. Side and vote labels are returned as categoricals.
+    """
+    path_to_file = resolve_path(path_to_file)
+    suffix = os.path.splitext(path_to_file)[1]
+
+    if suffix == ".parquet":
+        df = pd.read_parquet(path_to_file, columns=columns, filters=filters)
+    elif suffix == ".json":
+        df = pd.read_json(path_to_file)
+        if filters:
+            df = _apply_filters(df, filters)
+        if columns is not None:
+            df = df[columns]
+    else:
+        raise ValueError(f"File format {suffix} unknown.")
+
+    return categorize_labels(df)
+
+
+def save_df(
+    df: pd.DataFrame,
+    path_to_file: str,
+    json_export: bool = False,
+    json_orient: Optional[str] = None,
+) -> None:
+    """Save `df` into `path_to_file` in the format given by its extension (.parquet
+    or .json).
+
+    Side and vote labels are stored as categoricals in Parquet files. If
+    `json_export` is True, a JSON copy in `json_orient` orientation is also written
+    next to the Parquet file for compatibility with the data on Zenodo.
+    """
+    root, suffix = os.path.splitext(path_to_file)
+
+    if suffix == ".parquet":
+        categorize_labels(df).to_parquet(path_to_file)
+    elif suffix == ".json":
+        df.to_json(path_to_file, orient=json_orient)
+    else:
+        raise ValueError(f"File format {suffix} unknown.")
+
+    if json_export and (suffix != ".json"):
+        df.to_json(root + ".json", orient=json_orient)
@@ -0,0 +1,221 @@
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Optional
+
+
+def hash_file(path_to_file: str) -> str:
+    """Return the SHA-256 hash of the contents of `path_to_file`."""
+    sha = hashlib.sha256()
+    with open(path_to_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def expand_paths(patterns: list[str]) -> list[str]:
+    """Return the sorted list of files matching the glob `patterns`. Directories are
+    expanded to all the files they contain.
+    """
+    paths = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            if os.path.isdir(path):
+                paths.update(
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(path)
+                    for name in names
+                )
+            else:
+                paths.add(path)
+    return sorted(paths)
+
+
+class PipelineRunner:
+    def __init__(self, pipeline_config: dict[str, Any]) -> None:
+        """Run the stages of the data pipeline defined in `pipeline_config`, only
+        rerunning the stages that are out of date.
+
+        Each stage is a script with the glob patterns of its `inputs`, `outputs` and
+        `code`, and the `params` passed to the script as command line arguments. A
+        stage is out of date if one of its outputs is missing or if the hash of its
+        inputs, code or params differs from the last successful run, which are stored
+        in the state file at `path_to_state`. Stages are ordered so that stages
+        producing the inputs of another stage run first. A stage marked `manual`
+        (e.g. prompting a paid API) only runs when it is named explicitly, never as a
+        dependency of another stage.
+        """
+        self._stages = pipeline_config["stages"]
+        self._path_to_state = pipeline_config["path_to_state"]
+        self._state = self.load_state()
+
+    @property
+    def stages(self):
+        return self._stages
+
+    def load_state(self) -> dict[str, Any]:
+        if os.path.isfile(self._path_to_state):
+            with open(self._path_to_state) as f:
+                return json.load(f)
+        return {"stages": {}, "hashes": {}}
+
+    def save_state(self) -> None:
+        os.makedirs(os.path.dirname(self._path_to_state) or ".", exist_ok=True)
+        with open(self._path_to_state, "w") as f:
+            json.dump(self._state, f, indent=2)
+
+    def get_file_hash(self, path_to_file: str) -> str:
+        """Return the hash of `path_to_file`, reusing the hash from the state file if
+        the size and modification time of the file did not change.
+        """
+        stat = os.stat(path_to_file)
+        key = f"{stat.st_size}-{stat.st_mtime_ns}"
+        cached = self._state["hashes"].get(path_to_file)
+        if (cached is not None) and (cached["key"] == key):
+            return cached["hash"]
+
+        file_hash = hash_file(path_to_file)
+        self._state["hashes"][path_to_file] = {"key": key, "hash": file_hash}
+        return file_hash
+
+    def get_dependencies(self, stage: str) -> list[str]:
+        """Return the stages producing an input of `stage`."""
+        dependencies = []
+        for other, config in self.stages.items():
+            if other == stage:
+                continue
+            if any(
+                fnmatch.fnmatch(output, pattern) or fnmatch.fnmatch(pattern, output)
+                for output in config.get("outputs", [])
+                for pattern in self.stages[stage].get("inputs", [])
+            ):
+                dependencies.append(other)
+        return dependencies
+
+    def is_manual(self, stage: str) -> bool:
+        return self.stages[stage].get("manual", False)
+
+    def get_stage_order(self, stages: Optional[list[str]] = None) -> list[str]:
+        """Return `stages` (all stages that are not manual if None) and the stages
+        they depend on, ordered so that every stage comes after its dependencies.
+        Manual stages are only included if they are in `stages`.
+        """
+        if stages is None:
+            stages = [stage for stage in self.stages if not self.is_manual(stage)]
+        for stage in stages:
+            if stage not in self.stages:
+                raise ValueError(f"Stage {stage} unknown.")
+
+        order = []
+        visiting = set()
+
+        def visit(stage: str) -> None:
+            if stage in order:
+                return
+            if stage in visiting:
+                raise ValueError(f"Stage {stage} depends on itself.")
+            visiting.add(stage)
+            for dependency in self.get_dependencies(stage):
+                if (not self.is_manual(dependency)) or (dependency in stages):
+                    visit(dependency)
+            visiting.remove(stage)
+            order.append(stage)
+
+        for stage in stages:
+            visit(stage)
+        return order
+
+    def get_fingerprint(self, stage: str) -> dict[str, Any]:
+        """Return the hashes of the inputs and code of `stage` along with its script
+        and params.
+        """
+        config = self.stages[stage]
+        code = expand_paths([config["script"]] + config.get("code", []))
+        return {
+            "script": config["script"],
+            "params": config.get("params", {}),
+            "inputs": {
+                path: self.get_file_hash(path)
+                for path in expand_paths(config.get("inputs", []))
+            },
+            "code": {path: self.get_file_hash(path) for path in code},
+        }
+
+    def get_changes(self, stage: str) -> list[str]:
+        """Return the reasons why `stage` is out of date (empty if it is not)."""
+        config = self.stages[stage]
+        previous = self._state["stages"].get(stage)
+        if previous is None:
+            return ["never run"]
+
+        changes = [
+            f"missing output {pattern}"
+            for pattern in config.get("outputs", [])
+            if len(glob.glob(pattern)) == 0
+        ]
+
+        fingerprint = self.get_fingerprint(stage)
+        for key in ["script", "params"]:
+            if fingerprint[key] != previous[key]:
+                changes.append(f"{key} changed")
+        for key in ["inputs", "code"]:
+            for path in set(fingerprint[key]) | set(previous[key]):
+                if fingerprint[key].get(path) != previous[key].get(path):
+                    changes.append(f"{path} changed")
+        return changes
+
+    def run_stage(self, stage: str) -> None:
+        """Run the script of `stage` with its params as command line arguments."""
+        config = self.stages[stage]
+        command = [sys.executable, config["script"]]
+        for param, value in config.get("params", {}).items():
+            if isinstance(value, bool):
+                value = str(value).lower()
+            command += [f"--{param}", str(value)]
+
+        print(" ".join(command))
+        subprocess.run(command, check=True)
+
+        self._state["stages"][stage] = self.get_fingerprint(stage)
+        self.save_state()
+
+    def run(
+        self,
+        stages: Optional[list[str]] = None,
+        force: Optional[list[str]] = None,
+        dry_run: bool = False,
+    ) -> list[str]:
+        """Run every stage in `stages` (all stages if None) and their dependencies that
+        is out of date or in `force`. If `dry_run` is True, only report the stages that
+        would be run.
+
+        :returns: a list of the stages that were (or would be) run
+        """
+        force = force if force is not None else []
+        run_stages = []
+        for stage in self.get_stage_order(stages):
+            changes = self.get_changes(stage)
+            if stage in force:
+                changes.append("forced")
+            # a dependency that reruns changes the inputs of this stage, which is only
+            # visible once it finished, so a dry run assumes this stage reruns too
+            if dry_run and any(
+                dependency in run_stages for dependency in self.get_dependencies(stage)
+            ):
+                changes.append("dependency out of date")
+
+            if len(changes) == 0:
+                print(f"{stage}: up to date")
+                continue
+
+            print(f"{stage}: {', '.join(changes)}")
+            run_stages.append(stage)
+            if not dry_run:
+                self.run_stage(stage)
+
+        self.save_state()
+        return run_stages
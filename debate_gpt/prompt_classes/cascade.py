@@ -0,0 +1,191 @@
+import math
+import re
+from collections import Counter
+from typing import Any, Optional
+
+from debate_gpt.prompt_classes import pricing
+from debate_gpt.prompt_classes.key_pool import KeyPool
+from debate_gpt.prompt_classes.local_model import LABELS, get_local_model
+from debate_gpt.prompt_classes.streaming import ANSWER_PATTERN, END_OF_RESPONSE
+from debate_gpt.prompt_classes.tokenizer import count_message_tokens
+
+LABEL_PATTERN = re.compile(r"\b(pro|con|tie)\b", re.IGNORECASE)
+
+# number of alternatives returned by the OpenAI API for each token of the answer
+TOP_LOGPROBS = 5
+
+
+def extract_label(response: Optional[str]) -> Optional[str]:
+    """Return the label ("Pro", "Con" or "Tie") answered in `response`: the final
+    answer in the reasoning formats (see `ANSWER_PATTERN`) if any, otherwise the only
+    label mentioned (None if there is none or several).
+    """
+    if not response:
+        return None
+    answers = ANSWER_PATTERN.findall(response + END_OF_RESPONSE)
+    if len(answers) > 0:
+        return answers[-1].title()
+    labels = {label.title() for label in LABEL_PATTERN.findall(response)}
+    if len(labels) == 1:
+        return labels.pop()
+    return None
+
+
+def get_label_probabilities(logprobs: dict[str, float]) -> dict[str, float]:
+    """Return the probabilities of the labels of `logprobs`, normalized over them."""
+    if len(logprobs) == 0:
+        return {}
+    top = max(logprobs.values())
+    weights = {label: math.exp(logprob - top) for label, logprob in logprobs.items()}
+    total = sum(weights.values())
+    return {label: weight / total for label, weight in weights.items()}
+
+
+def get_token_label_logprobs(top_logprobs: list[Any]) -> dict[str, float]:
+    """Return the log-probability of each label among the alternatives
+    `top_logprobs` of one token of an OpenAI response (e.g. " Pro" and "pro" both
+    count towards "Pro").
+    """
+    probabilities = {}
+    for alternative in top_logprobs:
+        token = alternative.token.strip().strip("'\"").lower()
+        for label in LABELS:
+            if (len(token) > 0) and label.lower().startswith(token):
+                probabilities[label] = probabilities.get(label, 0) + math.exp(
+                    alternative.logprob
+                )
+    return {label: math.log(p) for label, p in probabilities.items()}
+
+
+def get_answer_logprobs(content: list[Any]) -> dict[str, float]:
+    """Return the label log-probabilities of the answer token of an OpenAI response
+    with the log-probabilities `content`: the last token that is a label.
+    """
+    for token in reversed(content):
+        if LABEL_PATTERN.fullmatch(token.token.strip().strip("'\"")):
+            return get_token_label_logprobs(token.top_logprobs)
+    return {}
+
+
+class Cascade:
+    def __init__(
+        self,
+        model: str,
+        source: str = "openai",
+        threshold: float = 0.9,
+        num_samples: int = 1,
+        key_pool: Optional[KeyPool] = None,
+    ) -> None:
+        """A cheap model answering each prompt first, so that the task's model is
+        only prompted for the items the cheap model is unsure about (see
+        `PromptBase.get_response`).
+
+        The confidence of the cheap model in its answer is the probability of the
+        answered label normalized over "Pro", "Con" and "Tie": from the scores of a
+        local model (`source` "local"), or from the log-probabilities of the answer
+        token returned by the OpenAI API. If `num_samples` is more than 1, the model
+        is instead sampled `num_samples` times and the confidence is the share of
+        samples agreeing with the most common answer, whose response is one of the
+        samples with that answer. Items with a confidence below `threshold` are
+        escalated. The OpenAI requests are sent with `key_pool` (the keys of the
+        environment if None, see `KeyPool.from_env`).
+        """
+        if source not in ["openai", "local"]:
+            raise ValueError(f"Source {source} unknown for the cascade.")
+
+        self._model = model
+        self._source = source
+        self._threshold = threshold
+        self._num_samples = num_samples
+
+        self._key_pool = None
+        if source == "openai":
+            self._key_pool = key_pool if key_pool is not None else KeyPool.from_env()
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def source(self) -> str:
+        return self._source
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    @property
+    def num_samples(self) -> int:
+        return self._num_samples
+
+    def get_response(
+        self, messages: list[dict[str, str]], max_tokens: Optional[int] = 5
+    ) -> dict[str, Any]:
+        """Prompt the cheap model with `messages` and return its response, answer and
+        confidence in the answer.
+        """
+        if self._source == "local":
+            probabilities = get_label_probabilities(
+                get_local_model(self._model).score([messages])[0]
+            )
+            answer = max(probabilities, key=probabilities.get)
+            return self.create_response(answer, answer, probabilities[answer])
+
+        if self._num_samples > 1:
+            response = self.create_completion(
+                messages, max_tokens, n=self._num_samples, temperature=1
+            )
+            texts = [choice.message.content for choice in response.choices]
+            labels = [extract_label(text) for text in texts]
+            # samples without a label count against the confidence but never win
+            answers = Counter(label for label in labels if label is not None)
+            if len(answers) == 0:
+                return self.create_response(texts[0], None, 0.0)
+            answer, count = answers.most_common(1)[0]
+            return self.create_response(
+                texts[labels.index(answer)], answer, count / len(texts)
+            )
+
+        response = self.create_completion(
+            messages, max_tokens, logprobs=True, top_logprobs=TOP_LOGPROBS
+        )
+        choice = response.choices[0]
+        answer = extract_label(choice.message.content)
+        probabilities = {}
+        if choice.logprobs is not None:
+            probabilities = get_label_probabilities(
+                get_answer_logprobs(choice.logprobs.content)
+            )
+        return self.create_response(
+            choice.message.content, answer, probabilities.get(answer, 0.0)
+        )
+
+    def create_completion(
+        self, messages: list[dict[str, str]], max_tokens: Optional[int], **kwargs
+    ):
+        """Create a chat completion of `messages` by the cheap model with the key
+        pool, counting the message and the `max_tokens` of each of the `n` responses
+        against the limits of the key and the cost of the cheap model against its
+        spend.
+        """
+        return self._key_pool.create(
+            tokens=count_message_tokens(messages, self._model)
+            + (max_tokens or 0) * kwargs.get("n", 1),
+            cost=lambda usage: pricing.calculate_cost_usage(self._model, usage),
+            model=self._model,
+            messages=messages,
+            max_tokens=max_tokens,
+            **kwargs,
+        )
+
+    def create_response(
+        self, response: str, answer: Optional[str], confidence: float
+    ) -> dict[str, Any]:
+        if answer is None:
+            confidence = 0.0
+        return {
+            "cascade_model": self._model,
+            "cascade_response": response,
+            "cascade_answer": answer,
+            "cascade_confidence": confidence,
+        }
@@ -0,0 +1,214 @@
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from debate_gpt.data_processing.debate_data.rounds_store import (
+    RoundsStore,
+    open_rounds_store,
+)
+from debate_gpt.data_processing.storage import load_df
+from debate_gpt.prompt_classes.personas import Personas
+
+
+class DataContext:
+    def __init__(
+        self,
+        propositions_df: Optional[pd.DataFrame],
+        debates_df: Optional[pd.DataFrame],
+        votes_df: Optional[pd.DataFrame],
+        users_df: Optional[pd.DataFrame],
+        rounds_df: Optional[pd.DataFrame] = None,
+        rounds_store: Optional[RoundsStore] = None,
+        path_to_personas: Optional[str] = None,
+        rounds_store_paths: Optional[tuple[str, str, str]] = None,
+    ) -> None:
+        """The data used to prompt the models, loaded once and shared read-only by
+        every task (see `PromptBase`).
+
+        The lookups used for each prompt (the voters and votes of a debate, its
+        proposition and start date, and the persona texts of each configuration of
+        user columns) are indexed the first time they are needed and reused by every
+        task sharing the context. Calling `build_indexes` before forking worker
+        processes lets the workers share the indexes through copy-on-write instead of
+        rebuilding them. Persona texts are cached in `path_to_personas` if given.
+
+        If `rounds_store_paths` is given, the rounds store is only opened (see
+        `open_rounds_store`) with these paths the first time a debate is read, so
+        tasks that never send a debate do not load the rounds. A store opened by the
+        context is closed with it (see `close`).
+        """
+        self._propositions_df = propositions_df
+        self._debates_df = debates_df
+        self._votes_df = votes_df
+        self._users_df = users_df
+        self._rounds_df = rounds_df
+        self._rounds_store = rounds_store
+        self._rounds_store_paths = rounds_store_paths
+        self._owns_rounds_store = False
+        self._path_to_personas = path_to_personas
+
+        self._voter_ids = None
+        self._vote_positions = None
+        self._propositions = None
+        self._start_dates = None
+        self._personas = {}
+
+    @property
+    def propositions_df(self):
+        return self._propositions_df
+
+    @property
+    def debates_df(self):
+        return self._debates_df
+
+    @property
+    def votes_df(self):
+        return self._votes_df
+
+    @property
+    def users_df(self):
+        return self._users_df
+
+    @property
+    def rounds_df(self):
+        return self._rounds_df
+
+    @property
+    def rounds_store(self):
+        if (self._rounds_store is None) and (self._rounds_store_paths is not None):
+            self._rounds_store = open_rounds_store(*self._rounds_store_paths)
+            self._owns_rounds_store = True
+        return self._rounds_store
+
+    def close(self) -> None:
+        """Close the rounds store if it was opened by the context."""
+        if self._owns_rounds_store:
+            self._rounds_store.close()
+            self._rounds_store = None
+            self._owns_rounds_store = False
+
+    def __enter__(self) -> "DataContext":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def build_indexes(self) -> None:
+        """Build every index of the available dataframes."""
+        if self.votes_df is not None:
+            self._index_votes()
+        if self.propositions_df is not None:
+            self._index_propositions()
+        if self.debates_df is not None:
+            self._index_start_dates()
+
+    def _index_votes(self) -> None:
+        if self._voter_ids is not None:
+            return
+        debate_ids = self.votes_df.debate_id.to_numpy()
+        voter_ids = self.votes_df.voter_id.to_numpy()
+        positions = pd.Series(np.arange(len(debate_ids))).groupby(debate_ids).indices
+        self._voter_ids = {
+            debate_id: list(voter_ids[rows]) for debate_id, rows in positions.items()
+        }
+        # reversed so that the first vote of a voter in a debate is kept
+        self._vote_positions = {
+            key: position
+            for position, key in reversed(
+                list(enumerate(zip(debate_ids.tolist(), voter_ids.tolist())))
+            )
+        }
+
+    def _index_propositions(self) -> None:
+        if self._propositions is not None:
+            return
+        propositions = self.propositions_df.drop_duplicates("debate_id")
+        self._propositions = dict(
+            zip(propositions.debate_id, propositions.proposition.str.capitalize())
+        )
+
+    def _index_start_dates(self) -> None:
+        if self._start_dates is not None:
+            return
+        debates = self.debates_df.drop_duplicates("debate_id")
+        self._start_dates = dict(zip(debates.debate_id, debates.start_date))
+
+    def get_voter_ids(self, debate_id: int) -> list[str]:
+        """Return the ids of the voters of debate `debate_id` in the order of
+        `votes_df`.
+        """
+        self._index_votes()
+        return list(self._voter_ids.get(debate_id, []))
+
+    def get_vote(self, voter_id: str, debate_id: int, column: str) -> Any:
+        """Return how user `voter_id` voted on debate `debate_id` for `column`."""
+        self._index_votes()
+        position = self._vote_positions[(debate_id, voter_id)]
+        return self.votes_df[column].iat[position]
+
+    def get_proposition(self, debate_id: int) -> str:
+        """Return the capitalized proposition of debate `debate_id`."""
+        self._index_propositions()
+        return self._propositions[debate_id]
+
+    def get_start_date(self, debate_id: int) -> str:
+        """Return the start date of debate `debate_id`."""
+        self._index_start_dates()
+        return self._start_dates[debate_id]
+
+    def get_personas(
+        self,
+        demographic_columns: Optional[list[str]],
+        big_issue_columns: Optional[list[str]],
+        demographic_map: Optional[dict[str, str]],
+    ) -> Personas:
+        """Return the persona texts of the users for this configuration of user
+        columns, rendering them only once per configuration.
+        """
+        key = (
+            tuple(demographic_columns or []),
+            tuple(big_issue_columns or []),
+            tuple(sorted((demographic_map or {}).items())),
+            demographic_columns is None,
+            big_issue_columns is None,
+            demographic_map is None,
+        )
+        if key not in self._personas:
+            self._personas[key] = Personas(
+                self.users_df,
+                demographic_columns,
+                big_issue_columns,
+                demographic_map,
+                path_to_cache=self._path_to_personas,
+            )
+        return self._personas[key]
+
+
+def load_data_context(
+    task_config: dict[str, Any],
+    path_to_propositions: str,
+    votes_filters: Optional[list[tuple[str, str, Any]]] = None,
+) -> DataContext:
+    """Return the data context with the data at the paths of `task_config` and the
+    propositions at `path_to_propositions`. Only the votes satisfying `votes_filters`
+    (see `load_df`) are loaded.
+    """
+    return DataContext(
+        propositions_df=load_df(path_to_propositions),
+        debates_df=load_df(
+            task_config["path_to_debates"], columns=["debate_id", "start_date"]
+        ),
+        votes_df=load_df(
+            task_config["path_to_votes"],
+            columns=["debate_id", "voter_id", "agreed_before", "agreed_after"],
+            filters=votes_filters,
+        ),
+        users_df=load_df(task_config["path_to_users"]),
+        path_to_personas=task_config["path_to_personas"],
+        rounds_store_paths=(
+            task_config["path_to_rounds_text"],
+            task_config["path_to_rounds_index"],
+            task_config["path_to_rounds"],
+        ),
+    )
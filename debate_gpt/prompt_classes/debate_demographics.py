@@ -2,6 +2,11 @@ from typing import Optional
 
 import pandas as pd
 
+from debate_gpt.data_processing.debate_data.rounds_store import RoundsStore
+from debate_gpt.prompt_classes.cascade import Cascade
+from debate_gpt.prompt_classes.data_context import DataContext
+from debate_gpt.prompt_classes.key_pool import KeyPool
+from debate_gpt.prompt_classes.personas import Personas
 from debate_gpt.prompt_classes.prompt_base import PromptBase
 
 
@@ -20,12 +25,21 @@ class DebateDemographics(PromptBase):
         timeout: int = 120,
         source: str = "openai",
         model: str = "gpt-3.5-turbo-1106",
+        rounds_store: Optional[RoundsStore] = None,
+        personas: Optional[Personas] = None,
+        data_context: Optional[DataContext] = None,
+        propositions_df: Optional[pd.DataFrame] = None,
+        scoring: bool = False,
+        streaming: bool = False,
+        cascade: Optional[Cascade] = None,
+        key_pool: Optional[KeyPool] = None,
     ) -> None:
         """This class is responsible for holding all the methods related to prompting
         ChatGPT for the following task: Given a debate and a user's demographic data,
         which side of the debate is the user most likely to agree with?
         """
         super().__init__(
+            propositions_df=propositions_df,
             debates_df=debates_df,
             rounds_df=rounds_df,
             votes_df=votes_df,
@@ -38,6 +52,13 @@ class DebateDemographics(PromptBase):
             timeout=timeout,
             source=source,
             model=model,
+            rounds_store=rounds_store,
+            personas=personas,
+            data_context=data_context,
+            scoring=scoring,
+            streaming=streaming,
+            cascade=cascade,
+            key_pool=key_pool,
         )
 
         self._task_config = task_config
@@ -0,0 +1,318 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from debate_gpt.prompt_classes.rate_limits import TokenBucket
+
+# seconds a key is left aside after a rate limit error without a retry-after header
+DEFAULT_COOLDOWN = 5
+
+LIMIT_HEADERS = {
+    "requests": ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests"),
+    "tokens": ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens"),
+}
+
+
+def get_retry_after(headers: Any) -> float:
+    """Return the seconds to wait before retrying given the `headers` of a rate
+    limit error.
+    """
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return DEFAULT_COOLDOWN
+
+
+class ApiKey:
+    def __init__(
+        self,
+        api_key: str,
+        organization: Optional[str] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        budget: Optional[float] = None,
+        name: Optional[str] = None,
+    ) -> None:
+        """An OpenAI API key (and organization) with its own client, rate limit state
+        and spend counters.
+
+        The headroom of the key (see `get_headroom`) is estimated from its `rpm` and
+        `tpm` limits if given, and from the rate limit headers of its last response.
+        Once its spend reaches `budget` (in USD), the key is no longer used.
+        """
+        import openai
+
+        self._client = openai.OpenAI(api_key=api_key, organization=organization)
+        self._name = name or f"...{api_key[-4:]}"
+        self._budget = budget
+
+        self._buckets = {}
+        if rpm is not None:
+            self._buckets["requests"] = TokenBucket(rpm)
+        if tpm is not None:
+            self._buckets["tokens"] = TokenBucket(tpm)
+        self._remaining = {}
+
+        self._num_requests = 0
+        self._num_tokens = 0
+        self._spend = 0.0
+        self._cooldown_until = 0.0
+        self._disabled_reason = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def cooldown_until(self) -> float:
+        return self._cooldown_until
+
+    @property
+    def disabled_reason(self) -> Optional[str]:
+        if (
+            (self._disabled_reason is None)
+            and (self._budget is not None)
+            and (self._spend >= self._budget)
+        ):
+            return "budget spent"
+        return self._disabled_reason
+
+    def is_available(self) -> bool:
+        return (self.disabled_reason is None) and (
+            time.monotonic() >= self._cooldown_until
+        )
+
+    def get_headroom(self, tokens: int) -> float:
+        """Return the smallest share left of the key's limits after a request of
+        `tokens` tokens.
+        """
+        amounts = {"requests": 1, "tokens": tokens}
+        headroom = [
+            bucket.get_headroom(amounts[limit])
+            for limit, bucket in self._buckets.items()
+        ]
+        headroom += [
+            (remaining - amounts[limit]) / limit_value
+            for limit, (limit_value, remaining) in self._remaining.items()
+            if limit_value > 0
+        ]
+        if self._budget is not None:
+            headroom.append((self._budget - self._spend) / self._budget)
+        return min(headroom, default=1.0)
+
+    def consume(self, tokens: int) -> None:
+        amounts = {"requests": 1, "tokens": tokens}
+        for limit, bucket in self._buckets.items():
+            bucket.consume(amounts[limit])
+
+    def update_limits(self, headers: Any) -> None:
+        """Update the rate limit state of the key from the `headers` of a response."""
+        for limit, (limit_header, remaining_header) in LIMIT_HEADERS.items():
+            try:
+                self._remaining[limit] = (
+                    int(headers[limit_header]),
+                    int(headers[remaining_header]),
+                )
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    def record(self, tokens: int, cost: float) -> None:
+        self._num_requests += 1
+        self._num_tokens += tokens
+        self._spend += cost
+
+    def cool_down(self, seconds: float) -> None:
+        self._cooldown_until = time.monotonic() + seconds
+
+    def disable(self, reason: str) -> None:
+        self._disabled_reason = reason
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "key": self._name,
+            "requests": self._num_requests,
+            "tokens": self._num_tokens,
+            "spend": round(self._spend, 6),
+            "disabled": self.disabled_reason,
+        }
+
+
+class KeyPool:
+    def __init__(self, keys: list[ApiKey]) -> None:
+        """A pool of API keys, each request being sent with the key with the most
+        headroom (see `ApiKey.get_headroom`).
+
+        A key failing with an authentication, permission or quota error is disabled
+        and a key hitting its rate limit is left aside until it may be retried, and
+        the request is sent again with another key. The pool is shared by the
+        threads sending requests.
+        """
+        if len(keys) == 0:
+            raise ValueError("The key pool needs at least one key.")
+        self._keys = keys
+        self._lock = threading.Lock()
+
+    @property
+    def keys(self) -> list[ApiKey]:
+        return self._keys
+
+    @classmethod
+    def from_configs(cls, configs: list[dict[str, Any]]) -> "KeyPool":
+        """Return the pool of the keys of `configs`, each with the arguments of
+        `ApiKey`, where the key may instead be given by the name of the environment
+        variable holding it (api_key_env).
+        """
+        keys = []
+        for config in configs:
+            config = dict(config)
+            if "api_key_env" in config:
+                config["api_key"] = os.environ[config.pop("api_key_env")]
+            keys.append(ApiKey(**config))
+        return cls(keys)
+
+    @classmethod
+    def from_file(cls, path_to_file: str) -> "KeyPool":
+        """Return the pool of the keys listed in the JSON file `path_to_file` (see
+        `from_configs`).
+        """
+        with open(path_to_file) as f:
+            return cls.from_configs(json.load(f))
+
+    @classmethod
+    def from_env(cls) -> "KeyPool":
+        """Return the pool of the comma-separated keys of the OPENAI_API_KEYS
+        environment variable, or of the key OPENAI_API_KEY.
+        """
+        api_keys = os.environ.get("OPENAI_API_KEYS", "").split(",")
+        api_keys = [api_key.strip() for api_key in api_keys if api_key.strip()]
+        if len(api_keys) == 0:
+            api_keys = [os.environ["OPENAI_API_KEY"]]
+        return cls([ApiKey(api_key) for api_key in api_keys])
+
+    def select(self, tokens: int) -> ApiKey:
+        """Return the available key with the most headroom for a request of `tokens`
+        tokens, waiting for a key if they are all cooling down.
+        """
+        while True:
+            with self._lock:
+                keys = [key for key in self._keys if key.is_available()]
+                if len(keys) > 0:
+                    key = max(keys, key=lambda key: key.get_headroom(tokens))
+                    key.consume(tokens)
+                    return key
+
+                waiting = [key for key in self._keys if key.disabled_reason is None]
+                if len(waiting) == 0:
+                    reasons = "; ".join(
+                        f"{key.name}: {key.disabled_reason}" for key in self._keys
+                    )
+                    raise RuntimeError(f"Every API key is disabled ({reasons}).")
+                wait = min(key.cooldown_until for key in waiting) - time.monotonic()
+            time.sleep(max(wait, 0))
+
+    def create(
+        self,
+        tokens: int = 0,
+        cost: Optional[Callable[[Any], float]] = None,
+        estimate_usage: Optional[Callable[[str], Any]] = None,
+        **kwargs,
+    ):
+        """Create a chat completion with `kwargs` (see
+        `openai.chat.completions.create`) with the key with the most headroom, and
+        fail over to the other keys on authentication, permission or quota errors.
+
+        `tokens` is the estimated size of the request and `cost` returns the cost of
+        the usage of a response, which are counted against the limits and budget of
+        the key. A streamed response is returned as a `RecordedStream`, counted once
+        it is closed with the usage of its last chunk, or if it was cancelled before,
+        with the usage `estimate_usage` returns for the text received.
+        """
+        import openai
+
+        while True:
+            key = self.select(tokens)
+            try:
+                raw_response = key.client.chat.completions.with_raw_response.create(
+                    **kwargs
+                )
+            except (openai.AuthenticationError, openai.PermissionDeniedError) as e:
+                key.disable(f"{type(e).__name__}: {e}")
+                continue
+            except openai.RateLimitError as e:
+                if e.code == "insufficient_quota":
+                    key.disable(f"{type(e).__name__}: {e}")
+                else:
+                    key.cool_down(get_retry_after(e.response.headers))
+                continue
+
+            response = raw_response.parse()
+            with self._lock:
+                key.update_limits(raw_response.headers)
+
+            def record(usage: Any, key: ApiKey = key) -> None:
+                with self._lock:
+                    if usage is None:
+                        key.record(tokens, 0.0)
+                    else:
+                        key.record(
+                            usage.total_tokens, 0.0 if cost is None else cost(usage)
+                        )
+
+            if kwargs.get("stream", False):
+                return RecordedStream(response, record, estimate_usage)
+            record(getattr(response, "usage", None))
+            return response
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        """Return the requests, tokens and spend of each key and why it is disabled."""
+        return [key.get_stats() for key in self._keys]
+
+
+class RecordedStream:
+    def __init__(
+        self,
+        stream: Iterable[Any],
+        record: Callable[[Any], None],
+        estimate_usage: Optional[Callable[[str], Any]] = None,
+    ) -> None:
+        """The chunks of the streamed chat completion `stream`, whose usage is passed
+        to `record` once the stream is exhausted or closed.
+
+        The usage is the one of the last chunk (requested with the `include_usage`
+        stream option), which is not received when the stream is cancelled early. The
+        usage is then the one returned by `estimate_usage` for the text received so
+        far, or None without it.
+        """
+        self._stream = stream
+        self._record = record
+        self._estimate_usage = estimate_usage
+        self._text = ""
+        self._usage = None
+        self._closed = False
+
+    def __iter__(self) -> Iterator[Any]:
+        for chunk in self._stream:
+            if getattr(chunk, "usage", None) is not None:
+                self._usage = chunk.usage
+            if (len(chunk.choices) > 0) and chunk.choices[0].delta.content:
+                self._text += chunk.choices[0].delta.content
+            yield chunk
+        self.close()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+        usage = self._usage
+        if (usage is None) and (self._estimate_usage is not None):
+            usage = self._estimate_usage(self._text)
+        self._record(usage)
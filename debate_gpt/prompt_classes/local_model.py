@@ -0,0 +1,290 @@
+import copy
+from typing import Any, Optional
+
+LABELS = ["Pro", "Con", "Tie"]
+
+# context window used when the model configuration does not define one
+DEFAULT_CONTEXT_WINDOW = 4096
+
+_models = {}
+
+
+def merge_messages(messages: list[dict[str, str]]) -> list[dict[str, str]]:
+    """Return `messages` with consecutive messages of the same role joined into one,
+    as the chat templates of most open-weights models require alternating roles.
+    """
+    merged = []
+    for message in messages:
+        if merged and (merged[-1]["role"] == message["role"]):
+            merged[-1] = {
+                "role": message["role"],
+                "content": merged[-1]["content"] + "\n" + message["content"],
+            }
+        else:
+            merged.append(dict(message))
+    return merged
+
+
+def get_common_prefix_length(sequences: list[list[int]]) -> int:
+    """Return the length of the longest prefix shared by all `sequences`, leaving at
+    least one token in each sequence.
+    """
+    length = min(len(sequence) for sequence in sequences) - 1
+    first = sequences[0]
+    for sequence in sequences[1:]:
+        i = 0
+        while (i < length) and (sequence[i] == first[i]):
+            i += 1
+        length = i
+    return max(length, 0)
+
+
+class LocalModel:
+    def __init__(
+        self, model: str, max_batch_size: int = 8, num_threads: Optional[int] = None
+    ) -> None:
+        """An open-weights chat model (e.g. Qwen/Qwen2.5-0.5B-Instruct) run on CPU
+        with `transformers`, used by `PromptBase` when the source is "local".
+
+        Messages are prompted in batches of up to `max_batch_size`. The tokens
+        shared by the beginning of all the messages (e.g. the debate prompted to every
+        voter) are run through the model once and their KV-cache is reused for every
+        message, both to generate answers (see `generate`) and to score labels (see
+        `score`).
+        """
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "The local source requires torch and transformers "
+                "(pip install torch transformers)."
+            ) from e
+
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        self._torch = torch
+        self._name = model
+        self._max_batch_size = max_batch_size
+
+        self._tokenizer = AutoTokenizer.from_pretrained(model)
+        self._tokenizer.padding_side = "left"
+        if self._tokenizer.pad_token is None:
+            self._tokenizer.pad_token = self._tokenizer.eos_token
+
+        self._model = AutoModelForCausalLM.from_pretrained(
+            model, torch_dtype=torch.float32
+        )
+        self._model.eval()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def context_window(self) -> int:
+        return getattr(
+            self._model.config, "max_position_embeddings", DEFAULT_CONTEXT_WINDOW
+        )
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+    def render(self, messages: list[dict[str, str]]) -> str:
+        """Return `messages` in the chat format of the model, ending with the start of
+        the assistant's answer.
+        """
+        return self._tokenizer.apply_chat_template(
+            merge_messages(messages), tokenize=False, add_generation_prompt=True
+        )
+
+    def get_batches(self, items: list[Any]) -> list[list[Any]]:
+        """Return `items` split in order into batches of at most the batch size."""
+        batches = []
+        for start in range(0, len(items), self._max_batch_size):
+            end = start + self._max_batch_size
+            batches.append(items[start:end])
+        return batches
+
+    def encode(self, messages: list[list[dict[str, str]]]) -> list[list[int]]:
+        """Return the tokens of each of `messages` in the chat format of the model."""
+        return [
+            self._tokenizer.encode(self.render(message), add_special_tokens=False)
+            for message in messages
+        ]
+
+    def get_prefix_cache(self, prefix: list[int]):
+        """Return the KV-cache of the tokens `prefix`, or None if it is empty."""
+        if len(prefix) == 0:
+            return None
+        return self._model(self._torch.tensor([prefix]), use_cache=True).past_key_values
+
+    def get_eos_ids(self) -> set[int]:
+        """Return the tokens ending the answer of the model."""
+        eos_ids = self._model.generation_config.eos_token_id
+        if eos_ids is None:
+            eos_ids = self._tokenizer.eos_token_id
+        if isinstance(eos_ids, int):
+            eos_ids = [eos_ids]
+        return set(eos_ids)
+
+    def generate(
+        self, messages: list[list[dict[str, str]]], max_tokens: Optional[int] = 5
+    ) -> list[str]:
+        """Return the greedy answer of the model to each of `messages`, of at most
+        `max_tokens` tokens.
+
+        As in `score`, the longest prefix shared by all `messages` is run once and
+        its KV-cache is reused to answer each message, so that e.g. the debate is
+        only processed once for all its voters.
+        """
+        sequences = self.encode(messages)
+        prefix_length = get_common_prefix_length(sequences)
+        if max_tokens is None:
+            max_tokens = self.context_window - max(len(s) for s in sequences)
+
+        responses = []
+        with self._torch.no_grad():
+            past_key_values = self.get_prefix_cache(sequences[0][:prefix_length])
+            for batch in self.get_batches(sequences):
+                responses += self._generate_batch(
+                    [sequence[prefix_length:] for sequence in batch],
+                    prefix_length,
+                    past_key_values,
+                    max_tokens,
+                )
+        return [response.strip() for response in responses]
+
+    def _generate_batch(
+        self,
+        suffixes: list[list[int]],
+        prefix_length: int,
+        past_key_values,
+        max_tokens: int,
+    ) -> list[str]:
+        """Return the greedy answers to the `suffixes` following the prefix of
+        `prefix_length` tokens whose KV-cache is `past_key_values`.
+        """
+        torch = self._torch
+        batch_size = len(suffixes)
+        width = max(len(suffix) for suffix in suffixes)
+
+        # padded on the left, between the prefix and the suffix, with the padding
+        # masked out and left out of the positions
+        input_ids = torch.full((batch_size, width), self._tokenizer.pad_token_id)
+        suffix_mask = torch.zeros((batch_size, width), dtype=torch.long)
+        for i, suffix in enumerate(suffixes):
+            start = width - len(suffix)
+            input_ids[i, start:] = torch.tensor(suffix)
+            suffix_mask[i, start:] = 1
+        attention_mask = torch.cat(
+            [torch.ones((batch_size, prefix_length), dtype=torch.long), suffix_mask],
+            dim=1,
+        )
+
+        cache = None
+        if past_key_values is not None:
+            cache = self._expand_cache(past_key_values, batch_size)
+
+        eos_ids = self.get_eos_ids()
+        tokens = [[] for _ in suffixes]
+        finished = [False] * batch_size
+        for _ in range(max_tokens):
+            # the positions of the new tokens, counting only the tokens attended to
+            positions = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+            position_ids = positions[:, -input_ids.shape[1]:]
+            outputs = self._model(
+                input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=cache,
+                use_cache=True,
+            )
+            cache = outputs.past_key_values
+            next_ids = outputs.logits[:, -1].argmax(dim=-1)
+            for i, token_id in enumerate(next_ids.tolist()):
+                if finished[i]:
+                    continue
+                if token_id in eos_ids:
+                    finished[i] = True
+                else:
+                    tokens[i].append(token_id)
+            if all(finished):
+                break
+
+            input_ids = next_ids[:, None]
+            attention_mask = torch.cat(
+                [attention_mask, torch.ones((batch_size, 1), dtype=torch.long)], dim=1
+            )
+        return self._tokenizer.batch_decode(tokens, skip_special_tokens=True)
+
+    def get_label_ids(self, labels: list[str]) -> list[int]:
+        """Return the first token of each of `labels`, which must all differ."""
+        label_ids = [
+            self._tokenizer.encode(label, add_special_tokens=False)[0]
+            for label in labels
+        ]
+        if len(set(label_ids)) != len(labels):
+            raise ValueError(f"The labels {labels} share their first token.")
+        return label_ids
+
+    def _expand_cache(self, past_key_values, batch_size: int):
+        """Return a copy of the KV-cache of one sequence repeated `batch_size` times."""
+        if hasattr(past_key_values, "batch_repeat_interleave"):
+            past_key_values = copy.deepcopy(past_key_values)
+            past_key_values.batch_repeat_interleave(batch_size)
+            return past_key_values
+        return tuple(
+            tuple(tensor.expand(batch_size, *tensor.shape[1:]) for tensor in layer)
+            for layer in past_key_values
+        )
+
+    def score(
+        self, messages: list[list[dict[str, str]]], labels: list[str] = LABELS
+    ) -> list[dict[str, float]]:
+        """Return the log-probability of the model answering each of `labels` to each
+        of `messages`, as the log-probability of the first token of the label.
+
+        The longest prefix shared by all `messages` is run once and its KV-cache is
+        reused for the rest of each message, so that e.g. the debate is only
+        processed once for all its voters.
+        """
+        label_ids = self.get_label_ids(labels)
+        sequences = self.encode(messages)
+        prefix_length = get_common_prefix_length(sequences)
+
+        with self._torch.no_grad():
+            past_key_values = self.get_prefix_cache(sequences[0][:prefix_length])
+
+            scores = []
+            for batch in self.get_batches(sequences):
+                suffixes = [sequence[prefix_length:] for sequence in batch]
+                lengths = [len(suffix) for suffix in suffixes]
+                # padded on the right: the causal mask keeps the padding out of the
+                # last token of each suffix, whose logits are read
+                input_ids = self._torch.full(
+                    (len(batch), max(lengths)), self._tokenizer.pad_token_id
+                )
+                for i, (suffix, length) in enumerate(zip(suffixes, lengths)):
+                    input_ids[i, :length] = self._torch.tensor(suffix)
+
+                cache = None
+                if past_key_values is not None:
+                    cache = self._expand_cache(past_key_values, len(batch))
+                logits = self._model(
+                    input_ids, past_key_values=cache, use_cache=cache is not None
+                ).logits
+                last = logits[self._torch.arange(len(batch)), [n - 1 for n in lengths]]
+                logprobs = self._torch.log_softmax(last.float(), dim=-1)[:, label_ids]
+                scores += [dict(zip(labels, row)) for row in logprobs.tolist()]
+        return scores
+
+
+def get_local_model(model: str, **kwargs) -> LocalModel:
+    """Return the local model `model`, loading it the first time it is requested so
+    that it is shared by every task (see `LocalModel` for `kwargs`).
+    """
+    if model not in _models:
+        _models[model] = LocalModel(model, **kwargs)
+    return _models[model]
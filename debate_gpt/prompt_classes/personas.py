@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# increase when the persona texts change to invalidate the cached tables
+PERSONAS_VERSION = 1
+
+PERSONA_COLUMNS = ["user_info", "demographics_role_text", "big_issues_role_text"]
+
+
+def _join(texts: np.ndarray, parts: np.ndarray, mask: np.ndarray, sep: str):
+    """Return `texts` with `parts` appended with `sep` where `mask` is True."""
+    joined = np.where(texts == "", parts, texts + sep + parts)
+    return np.where(mask, joined, texts)
+
+
+def _get_values(users_df: pd.DataFrame, column: str) -> tuple[np.ndarray, np.ndarray]:
+    """Return the values of `column` as strings and whether each value is present."""
+    values = users_df[column].astype(object)
+    present = values.notna().to_numpy()
+    return values.where(present, "").astype(str).to_numpy(dtype=object), present
+
+
+def render_user_info(
+    users_df: pd.DataFrame,
+    demographic_columns: Optional[list[str]],
+    big_issue_columns: Optional[list[str]],
+) -> np.ndarray:
+    """Return the demographics and big issue stances of every user in `users_df` in
+    the format of `PromptBase.get_user_info`: one "Label: Value" line per column.
+    """
+    texts = np.full(len(users_df), "", dtype=object)
+    for column in (demographic_columns or []) + (big_issue_columns or []):
+        values, present = _get_values(users_df, column)
+        label = column.replace("_", " ").title() + ": "
+        texts = _join(texts, label + values, present, "\n")
+    return texts
+
+
+def render_demographics_role_text(
+    users_df: pd.DataFrame,
+    demographic_columns: Optional[list[str]],
+    demographic_map: Optional[dict[str, str]],
+) -> np.ndarray:
+    """Return the demographics role text of every user in `users_df` as in
+    `PromptBase.create_demographics_role_text`.
+    """
+    texts = np.full(len(users_df), "", dtype=object)
+    if (demographic_columns is None) or (demographic_map is None):
+        return texts
+
+    for column in demographic_columns:
+        values, present = _get_values(users_df, column)
+        lowered = pd.Series(values).str.lower().to_numpy(dtype=object)
+        sentences = demographic_map[column] + lowered + ". "
+        texts = np.where(present & (values != ""), texts + sentences, texts)
+    return texts
+
+
+def render_big_issues_role_text(
+    users_df: pd.DataFrame, big_issue_columns: Optional[list[str]]
+) -> np.ndarray:
+    """Return the big issues role text of every user in `users_df` as in
+    `PromptBase.create_big_issues_role_text`.
+    """
+    texts = np.full(len(users_df), "", dtype=object)
+    if big_issue_columns is None:
+        return texts
+
+    stances = {
+        "Pro": "You are for the following issues: ",
+        "Con": "You are against the following issues: ",
+        "Und": "You are undecided about the following issues: ",
+    }
+    issues = {stance: np.full(len(users_df), "", dtype=object) for stance in stances}
+    for column in big_issue_columns:
+        values, _ = _get_values(users_df, column)
+        name = column.replace("_", " ").title()
+        for stance in stances:
+            issues[stance] = _join(issues[stance], name, values == stance, ", ")
+
+    for stance, prefix in stances.items():
+        texts = np.where(
+            issues[stance] != "", texts + prefix + issues[stance] + ". ", texts
+        )
+    return texts
+
+
+def get_personas_key(
+    users_df: pd.DataFrame,
+    demographic_columns: Optional[list[str]],
+    big_issue_columns: Optional[list[str]],
+    demographic_map: Optional[dict[str, str]],
+) -> str:
+    """Return a key identifying the persona texts of the columns of `users_df` used
+    with this configuration.
+    """
+    config = {
+        "version": PERSONAS_VERSION,
+        "demographic_columns": demographic_columns,
+        "big_issue_columns": big_issue_columns,
+        "demographic_map": demographic_map,
+    }
+    sha = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+    columns = (demographic_columns or []) + (big_issue_columns or [])
+    users_hash = pd.util.hash_pandas_object(
+        users_df[columns].astype(object), index=True
+    )
+    sha.update(users_hash.to_numpy().tobytes())
+    return sha.hexdigest()[:16]
+
+
+class Personas:
+    def __init__(
+        self,
+        users_df: pd.DataFrame,
+        demographic_columns: Optional[list[str]],
+        big_issue_columns: Optional[list[str]],
+        demographic_map: Optional[dict[str, str]],
+        path_to_cache: Optional[str] = None,
+    ) -> None:
+        """The persona texts of every user in `users_df` used to prompt the models:
+        the "Label: Value" user info and the demographics and big issues role texts.
+
+        The texts of all users are rendered at once for the given columns and map. If
+        `path_to_cache` is given, they are cached there as a Parquet file keyed by the
+        configuration and the users' data, and read back on the next run.
+        """
+        path_to_file = None
+        if path_to_cache is not None:
+            key = get_personas_key(
+                users_df, demographic_columns, big_issue_columns, demographic_map
+            )
+            path_to_file = os.path.join(path_to_cache, f"personas.{key}.parquet")
+
+        if (path_to_file is not None) and os.path.isfile(path_to_file):
+            personas_df = pd.read_parquet(path_to_file)
+        else:
+            personas_df = pd.DataFrame(
+                {
+                    "user_info": render_user_info(
+                        users_df, demographic_columns, big_issue_columns
+                    ),
+                    "demographics_role_text": render_demographics_role_text(
+                        users_df, demographic_columns, demographic_map
+                    ),
+                    "big_issues_role_text": render_big_issues_role_text(
+                        users_df, big_issue_columns
+                    ),
+                },
+                index=users_df.index,
+            )
+            if path_to_file is not None:
+                os.makedirs(path_to_cache, exist_ok=True)
+                personas_df.to_parquet(path_to_file)
+
+        self._texts = {
+            column: dict(zip(personas_df.index, personas_df[column]))
+            for column in PERSONA_COLUMNS
+        }
+
+    def get_user_info(self, voter_id: str) -> str:
+        return self._texts["user_info"][voter_id]
+
+    def get_demographics_role_text(self, voter_id: str) -> str:
+        return self._texts["demographics_role_text"][voter_id]
+
+    def get_big_issues_role_text(self, voter_id: str) -> str:
+        return self._texts["big_issues_role_text"][voter_id]
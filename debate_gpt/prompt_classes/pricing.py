@@ -0,0 +1,55 @@
+from typing import Any
+
+
+def calculate_cost_input(model: str, num_tokens: int) -> float:
+    """Return the cost of inputting `num_tokens` into `model`. This should be updated
+    regularly according to https://openai.com/pricing. As new models are released,
+    their pricing information should be added to this function.
+
+    Last update: Nov 29, 2023.
+    """
+    if (model == "gpt-3.5-turbo-1106") | (model == "gpt-3.5-turbo"):
+        # gpt-3.5-turbo currently points to gpt-3.5-turbo-0613. Will point to
+        # gpt-3.5-turbo-1106 starting Dec 11, 2023
+        cost = (num_tokens * 0.001) / 1000
+    elif model == "gpt-4":
+        cost = (num_tokens * 0.03) / 1000
+    elif model == "gpt-4-32k":
+        cost = (num_tokens * 0.06) / 1000
+    else:
+        raise ValueError(f"Model {model} cost unknown.")
+
+    return cost
+
+
+def calculate_cost_output(model: str, num_tokens: int) -> float:
+    """Return the cost of outputting `num_tokens` from `model`. This should be updated
+    regularly according to https://openai.com/pricing. As new models are released,
+    their pricing information should be added to this function.
+
+    Last update: Nov 29, 2023.
+    """
+    if (model == "gpt-3.5-turbo-1106") | (model == "gpt-3.5-turbo"):
+        # gpt-3.5-turbo currently points to gpt-3.5-turbo-0613. Will point to
+        # gpt-3.5-turbo-1106 starting Dec 11, 2023
+        cost = (num_tokens * 0.002) / 1000
+    elif model == "gpt-4":
+        cost = (num_tokens * 0.06) / 1000
+    elif model == "gpt-4-32k":
+        cost = (num_tokens * 0.12) / 1000
+    else:
+        raise ValueError(f"Model {model} cost unknown.")
+
+    return cost
+
+
+def calculate_cost_usage(model: str, usage: Any) -> float:
+    """Return the cost of the `usage` of a chat completion of `model`, or 0 if the
+    cost of the model is unknown.
+    """
+    try:
+        return calculate_cost_input(model, usage.prompt_tokens) + calculate_cost_output(
+            model, usage.completion_tokens
+        )
+    except ValueError:
+        return 0.0
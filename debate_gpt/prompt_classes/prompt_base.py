@@ -3,15 +3,30 @@ import json
 import os
 import time
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Any, Optional
 
-import openai
 import pandas as pd
-import tiktoken
 import tqdm
 
+from debate_gpt.data_processing.debate_data.rounds_store import RoundsStore
+from debate_gpt.prompt_classes import pricing
+from debate_gpt.prompt_classes.cascade import Cascade
+from debate_gpt.prompt_classes.data_context import DataContext
+from debate_gpt.prompt_classes.key_pool import KeyPool
+from debate_gpt.prompt_classes.local_model import LocalModel, get_local_model
+from debate_gpt.prompt_classes.personas import Personas
+from debate_gpt.prompt_classes.streaming import consume_stream
+from debate_gpt.prompt_classes.tokenizer import (
+    TOKENS_PER_MESSAGE,
+    TOKENS_PER_REPLY,
+    get_encoding,
+)
+
 
 class PromptBase(ABC):
+    # whether the task puts the debate into its messages
+    needs_debate = True
+
     def __init__(
         self,
         propositions_df: pd.DataFrame,
@@ -27,6 +42,13 @@ class PromptBase(ABC):
         timeout: int = 120,
         source: str = "openai",
         model: str = "gpt-3.5-turbo-1106",
+        rounds_store: Optional[RoundsStore] = None,
+        personas: Optional[Personas] = None,
+        data_context: Optional[DataContext] = None,
+        scoring: bool = False,
+        streaming: bool = False,
+        cascade: Optional[Cascade] = None,
+        key_pool: Optional[KeyPool] = None,
     ) -> None:
         """This is the abstract base class for all prompting of OpenAI models for the
         debate-gpt project.
@@ -35,39 +57,82 @@ class PromptBase(ABC):
         `debates_df`, `rounds_df`, `votes_df`, and `users_df` are all pandas dataframes
         containing the data related to this project. `debates_df` contains all debate
         meta data including: debate_id, start_date, pro_user_id, con_user_id, and
-        category.
+        category. If `rounds_store` is given, the text of the debates is read from it
+        instead of `rounds_df`, which may then be None. `personas` holds the persona
+        texts of the users rendered for the user columns below. If None, they are
+        rendered from `users_df` the first time they are needed. If `data_context` is
+        given, the data and its indexes are taken from it and shared with the other
+        tasks using it, and the dataframes above are ignored.
 
         OpenAI model parameters:
         `model` defines the OpenAI model to be used and can be one of the options found
         here: https://platform.openai.com/docs/models. `context_window` should be the
-        corresponding context window found on the same page.
+        corresponding context window found on the same page. The OpenAI requests are
+        sent with the keys of `key_pool`, or if None, of the environment (see
+        `KeyPool.from_env`), each request using the key with the most headroom.
+
+        Local models:
+        If `source` is "local", `model` is the name or path of an open-weights chat
+        model run on CPU with `transformers` (see `LocalModel`), and the voters of a
+        debate are prompted in batches. If `scoring` is True, the local model is not
+        asked to generate an answer. Instead, the log-probabilities of answering
+        "Pro", "Con" and "Tie" are recorded, and the most likely label is used as
+        the response.
+
+        Streaming:
+        If `streaming` is True, the responses are streamed and the request is
+        cancelled as soon as the final answer (e.g. "Answer: Pro.") has been received,
+        so that reasoning tasks do not pay for the text generated after it. The
+        time to the first token and to the answer are recorded with each response.
+
+        Cascade:
+        If `cascade` is given, each message is first sent to its cheap model, and
+        only sent to `model` if the cheap model's confidence in its answer is below
+        the cascade's threshold. The answer of the cheap model, its confidence and
+        whether the message was escalated are recorded with each response.
         """
 
         # set dataframes
-        self._propositions_df = propositions_df
-        self._debates_df = debates_df
-        self._rounds_df = rounds_df
-        self._votes_df = votes_df
-        self._users_df = users_df
+        if data_context is None:
+            data_context = DataContext(
+                propositions_df=propositions_df,
+                debates_df=debates_df,
+                votes_df=votes_df,
+                users_df=users_df,
+                rounds_df=rounds_df,
+                rounds_store=rounds_store,
+            )
+        self._data_context = data_context
 
         # set model info
         self._source = source
         self._model = model
+        self._local_model = None
+        self._scoring = scoring
+        if scoring and (source != "local"):
+            raise ValueError("Scoring is only available with the local source.")
+        self._streaming = streaming
+        if streaming and (source == "local"):
+            raise ValueError("Streaming is not available with the local source.")
+        self._cascade = cascade
+        if (cascade is not None) and (source == "local"):
+            raise ValueError("The cascade is not available with the local source.")
         self._context_window = self.get_model_context_window()
         self._timeout = timeout
 
-        try:
-            self._encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            self._encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        # the encoding is loaded by the first token count (see `get_encoding`)
+        self._encoding = None
 
         self._max_gpt_response_tokens = max_gpt_response_tokens
 
-        # set api key
+        # set api keys
+        self._client = None
+        self._key_pool = None
         if source == "openai":
-            openai.api_key = os.environ["OPENAI_API_KEY"]
-            self._client = openai.OpenAI()
-        else:
+            self._key_pool = key_pool if key_pool is not None else KeyPool.from_env()
+        elif source != "local":
+            import openai
+
             self._client = openai.OpenAI(
                 api_key="anything",
                 base_url="http://iccluster039.iccluster.epfl.ch:7736",
@@ -80,26 +145,55 @@ class PromptBase(ABC):
         self._demographic_map = demographic_map
         if self._demographic_map is not None:
             assert self._demographic_columns is not None
+        self._personas = personas
+
+    @property
+    def data_context(self) -> DataContext:
+        return self._data_context
 
     @property
     def votes_df(self):
-        return self._votes_df
+        return self.data_context.votes_df
 
     @property
     def users_df(self):
-        return self._users_df
+        return self.data_context.users_df
 
     @property
     def rounds_df(self):
-        return self._rounds_df
+        return self.data_context.rounds_df
+
+    @property
+    def rounds_store(self):
+        return self.data_context.rounds_store
+
+    @property
+    def personas(self) -> Personas:
+        if self._personas is None:
+            self._personas = self.data_context.get_personas(
+                self._demographic_columns,
+                self._big_issue_columns,
+                self._demographic_map,
+            )
+        return self._personas
 
     @property
     def debates_df(self):
-        return self._debates_df
+        return self.data_context.debates_df
 
     @property
     def propositions_df(self):
-        return self._propositions_df
+        return self.data_context.propositions_df
+
+    @property
+    def cascade(self) -> Optional[Cascade]:
+        return self._cascade
+
+    @property
+    def local_model(self) -> LocalModel:
+        if self._local_model is None:
+            self._local_model = get_local_model(self._model)
+        return self._local_model
 
     @property
     def context_window(self):
@@ -138,7 +232,8 @@ class PromptBase(ABC):
                 self.save_results_to_file(results, path_to_file)
                 results = []
 
-            time.sleep(0.5)
+            if self._source != "local":
+                time.sleep(0.5)
 
         self.save_results_to_file(results, path_to_file)
 
@@ -153,24 +248,25 @@ class PromptBase(ABC):
         """Return results from prompting the model for debate with id `debate_id` with
         no user personalization."""
         results = []
-        debate, length = self.get_debate(debate_id=debate_id)
+        debate, length = self.get_task_debate(debate_id)
 
         message = self.create_gpt_message(debate, debate_id)
+        result = self.create_debate_result(debate_id, length, message)
+
+        if self._source == "local":
+            result.update(self.prompt_local([message], self.max_gpt_response_tokens)[0])
+            results.append(result)
+            return results
+
         response = None
         while response is None:
             try:
-                response = self.prompt(message, self.max_gpt_response_tokens)
+                response = self.get_response(message)
             except Exception as e:
                 print(e)
 
-        results.append(
-            {
-                "debate_id": str(debate_id),
-                "debate_length": length,
-                "message": message,
-                "gpt_response": response.choices[0].message.content,
-            }
-        )
+        result.update(response)
+        results.append(result)
 
         return results
 
@@ -179,39 +275,29 @@ class PromptBase(ABC):
         voter level personalization.
         """
         results = []
-        debate, length = self.get_debate(debate_id=debate_id)
-        voter_ids = list(self.votes_df[self.votes_df.debate_id == debate_id].voter_id)
+        debate, length = self.get_task_debate(debate_id)
+        voter_ids = self.data_context.get_voter_ids(debate_id)
+
+        if self._source == "local":
+            return self.get_local_voter_debate_results(
+                debate, debate_id, length, voter_ids
+            )
 
         while len(voter_ids) != 0:
             flag = False
             for i, voter_id in enumerate(voter_ids):
                 message = self.create_gpt_message(debate, debate_id, voter_id)
-
                 if message is None:
                     continue
 
                 try:
-                    response = self.prompt(message, self.max_gpt_response_tokens)
+                    result = self.get_voter_result(debate_id, voter_id, length, message)
                 except Exception as e:
                     print(e)
                     flag = True
                     break
 
-                results.append(
-                    {
-                        "debate_id": str(debate_id),
-                        "voter_id": voter_id,
-                        "debate_length": length,
-                        "message": message,
-                        "gpt_response": response.choices[0].message.content,
-                        "agreed_before": self.get_column_vote(
-                            voter_id, debate_id, "agreed_before"
-                        ),
-                        "agreed_after": self.get_column_vote(
-                            voter_id, debate_id, "agreed_after"
-                        ),
-                    }
-                )
+                results.append(result)
 
             if not flag:
                 i += 1
@@ -219,13 +305,117 @@ class PromptBase(ABC):
 
         return results
 
+    def get_voter_result(
+        self, debate_id: int, voter_id: str, length: str, message: Any
+    ) -> dict[str, Any]:
+        """Return the result of prompting the model with `message`, the message of
+        `create_gpt_message` for user `voter_id` and debate with id `debate_id`, where
+        `length` is as in `get_task_debate`.
+        """
+        if self._source == "local":
+            response = self.prompt_local([message], self.max_gpt_response_tokens)[0]
+        else:
+            response = self.get_response(message)
+
+        result = self.create_voter_result(debate_id, voter_id, length, message)
+        result.update(response)
+        return result
+
+    def get_local_voter_debate_results(
+        self, debate: Optional[str], debate_id: int, length: str, voter_ids: list[str]
+    ) -> list[dict[str, Any]]:
+        """Return results from prompting the local model for debate with id
+        `debate_id` with voter level personalization, with the voters `voter_ids`
+        prompted in batches.
+        """
+        results = []
+        for voter_id in voter_ids:
+            message = self.create_gpt_message(debate, debate_id, voter_id)
+            if message is None:
+                continue
+            results.append(
+                self.create_voter_result(debate_id, voter_id, length, message)
+            )
+
+        if len(results) == 0:
+            return results
+
+        answers = self.prompt_local(
+            [result["message"] for result in results], self.max_gpt_response_tokens
+        )
+        for result, answer in zip(results, answers):
+            result.update(answer)
+        return results
+
+    def get_requests(self, debate_id: int) -> list[dict[str, Any]]:
+        """Return the results of debate with id `debate_id` without the responses of
+        the model, one per message to prompt (with voter level personalization, one
+        per voter with a message).
+        """
+        debate, length = self.get_task_debate(debate_id)
+        if not self._voter_results:
+            message = self.create_gpt_message(debate, debate_id)
+            return [self.create_debate_result(debate_id, length, message)]
+
+        requests = []
+        for voter_id in self.data_context.get_voter_ids(debate_id):
+            message = self.create_gpt_message(debate, debate_id, voter_id)
+            if message is not None:
+                requests.append(
+                    self.create_voter_result(debate_id, voter_id, length, message)
+                )
+        return requests
+
+    @staticmethod
+    def create_debate_result(
+        debate_id: int, length: str, message: list[dict[str, str]]
+    ) -> dict[str, Any]:
+        """Return the result of prompting `message` for debate `debate_id`, without
+        the response of the model.
+        """
+        return {
+            "debate_id": str(debate_id),
+            "debate_length": length,
+            "message": message,
+        }
+
+    def create_voter_result(
+        self, debate_id: int, voter_id: str, length: str, message: list[dict[str, str]]
+    ) -> dict[str, Any]:
+        """Return the result of prompting `message` for user `voter_id` and debate
+        `debate_id`, without the response of the model.
+        """
+        return {
+            "debate_id": str(debate_id),
+            "voter_id": voter_id,
+            "debate_length": length,
+            "message": message,
+            "agreed_before": self.get_column_vote(voter_id, debate_id, "agreed_before"),
+            "agreed_after": self.get_column_vote(voter_id, debate_id, "agreed_after"),
+        }
+
     def get_proposition(self, debate_id: str) -> str:
         """Return the proposition associated with the debate with id `debate_id`."""
-        return (
-            self.propositions_df[self.propositions_df.debate_id == debate_id]
-            .proposition.values[0]
-            .capitalize()
-        )
+        return self.data_context.get_proposition(debate_id)
+
+    def get_debate_rounds(self, debate_id: int) -> list[tuple[int, str, str]]:
+        """Return a (round, side, text) tuple for each argument in the debate with id
+        `debate_id` in the order they were made.
+        """
+        if self.rounds_store is not None:
+            return self.rounds_store.get_debate_rounds(debate_id)
+
+        debate_df = self.rounds_df[self.rounds_df.debate_id == debate_id]
+        return list(zip(debate_df["round"], debate_df.side, debate_df.text))
+
+    def get_task_debate(self, debate_id: int) -> tuple[Optional[str], str]:
+        """Return the debate with id `debate_id` and its length as in `get_debate` if
+        the task puts the debate into its messages. Otherwise the debate is neither
+        read nor assembled and (None, "full") is returned.
+        """
+        if not self.needs_debate:
+            return None, "full"
+        return self.get_debate(debate_id)
 
     def get_debate(self, debate_id: int) -> str:
         """Return the debate with id `debate_id`.
@@ -243,22 +433,20 @@ class PromptBase(ABC):
         }
         """
         rounds = {}
-        debate_df = self.rounds_df[self.rounds_df.debate_id == debate_id]
-
-        for _, row in debate_df.iterrows():
-            round_key = f"Round {row['round']}"
+        for round_number, side, text in self.get_debate_rounds(debate_id):
+            round_key = f"Round {round_number}"
             if round_key in rounds.keys():
                 old_dict = rounds[round_key]
-                old_dict[row.side] = row.text
+                old_dict[side] = text
                 rounds[round_key] = old_dict
             else:
-                rounds[round_key] = {row.side: row.text}
+                rounds[round_key] = {side: text}
 
         debate = str(json.dumps(rounds))
         if self.count_tokens(debate) < self.max_debate_tokens:
             return debate, "full"
 
-        rounds_number = row["round"]
+        rounds_number = round_number
 
         while self.count_tokens(debate) >= self.max_debate_tokens:
             try:
@@ -274,65 +462,22 @@ class PromptBase(ABC):
         """Return either 'Pro', 'Con' or 'Tie' indicating how user `voter_id` voted on
         debate `debate_id` for `column`.
         """
-        row = self.votes_df[
-            (self.votes_df.debate_id == debate_id)
-            & (self.votes_df.voter_id == voter_id)
-        ]
-        return row[column].values[0]
+        return self.data_context.get_vote(voter_id, debate_id, column)
 
     def create_demographics_role_text(self, voter_id: str) -> str:
         """Craft system role text for demographic information for user `voter_id`."""
-        message = ""
         if self._demographic_columns is None:
-            return message
-
-        user = self.users_df.loc[voter_id]
-        for demographic in self._demographic_columns:
-            if user[demographic]:
-                message += (
-                    self._demographic_map[demographic]
-                    + user[demographic].lower()
-                    + ". "
-                )
-
-        return message
+            return ""
+        return self.personas.get_demographics_role_text(voter_id)
 
     def create_big_issues_role_text(self, voter_id: str) -> str:
         """Craft a system role text for big issues for user `voter_id`."""
-        message = ""
         if self._big_issue_columns is None:
-            return message
-        pro_issues = []
-        con_issues = []
-        undecided_issues = []
-
-        for big_issue in self._big_issue_columns:
-            big_issue_name = big_issue.replace("_", " ").title()
-            if self.users_df.loc[voter_id][big_issue] == "Pro":
-                pro_issues.append(big_issue_name)
-            elif self.users_df.loc[voter_id][big_issue] == "Con":
-                con_issues.append(big_issue_name)
-            elif self.users_df.loc[voter_id][big_issue] == "Und":
-                undecided_issues.append(big_issue_name)
-
-        if len(pro_issues) > 0:
-            message += f"You are for the following issues: {', '.join(pro_issues)}. "
-        if len(con_issues) > 0:
-            message += (
-                f"You are against the following issues: {', '.join(con_issues)}. "
-            )
-        if len(undecided_issues) > 0:
-            message += "You are undecided about the following issues: "
-            message += f"{', '.join(undecided_issues)}. "
-
-        return message
+            return ""
+        return self.personas.get_big_issues_role_text(voter_id)
 
     def create_date_cutoff_role_text(self, debate_id) -> str:
-        date = (
-            self.debates_df[self.debates_df.debate_id == debate_id]
-            .iloc[0]
-            .at["start_date"]
-        )
+        date = self.data_context.get_start_date(debate_id)
         date = date.replace("\\", "")
         date = datetime.datetime.strptime(date, "%m/%d/%Y")
         date = date.strftime("%B %d, %Y")
@@ -358,23 +503,7 @@ class PromptBase(ABC):
         """Return a string containing all the demographic information of user `voter_id`
         in the following format: Label: Value, Label: Value
         """
-        voter_info = self.users_df.loc[voter_id][self._demographic_columns]
-        voter_info = voter_info[~voter_info.isna()]
-        voter_info = [
-            col.replace("_", " ").title() + ": " + voter_info[col]
-            for col in voter_info.index
-        ]
-
-        if self._big_issue_columns:
-            info = self.users_df.loc[voter_id][self._big_issue_columns]
-            info = info[~info.isna()]
-            info = [
-                col.replace("_", " ").title() + ": " + info[col]
-                for col in info.index
-            ]
-            voter_info += info
-
-        return "\n".join(voter_info)
+        return self.personas.get_user_info(voter_id)
 
     def _calculate_max_role_tokens(self) -> int:
         message = ""
@@ -384,7 +513,7 @@ class PromptBase(ABC):
                 max_count = 0
                 max_value = None
                 for value in possible_values:
-                    if value is None:
+                    if pd.isna(value):
                         continue
                     token_count = self.count_tokens(value)
                     if token_count > max_count:
@@ -415,7 +544,7 @@ class PromptBase(ABC):
             max_count = 0
             max_value = None
             for column_value in possible_column_values:
-                if column_value is None:
+                if pd.isna(column_value):
                     continue
                 token_count = self.count_tokens(column_value)
                 if token_count > max_count:
@@ -453,6 +582,43 @@ class PromptBase(ABC):
             )
         return {"role": role, "content": message}
 
+    def get_response(self, message: list[dict[str, str]]) -> dict[str, Any]:
+        """Prompt the model with `message` and return the response to record with the
+        result: the answer of the model (gpt_response) and, when streaming, the
+        timings of `consume_stream`.
+
+        With a cascade, the cheap model is prompted first and its response is used if
+        its confidence reaches the threshold. Otherwise the message is escalated to
+        the model. The cheap model's response is recorded in both cases.
+        """
+        if self._cascade is None:
+            return self.get_model_response(message)
+
+        response = self.get_cascade_response(message)
+        if not response["escalated"]:
+            return response
+        return {**self.get_model_response(message), **response}
+
+    def get_cascade_response(self, message: list[dict[str, str]]) -> dict[str, Any]:
+        """Prompt the cheap model of the cascade with `message` and return its
+        response, whether the message is escalated to the model and, if it is not,
+        the cheap model's response as the answer (gpt_response).
+        """
+        response = self._cascade.get_response(message, self.max_gpt_response_tokens)
+        response["escalated"] = response["cascade_confidence"] < self._cascade.threshold
+        if not response["escalated"]:
+            response["gpt_response"] = response["cascade_response"]
+        return response
+
+    def get_model_response(self, message: list[dict[str, str]]) -> dict[str, Any]:
+        """Prompt the model with `message` and return the response as in
+        `get_response`, without the cascade.
+        """
+        if self._streaming:
+            return self.prompt_streaming(message, self.max_gpt_response_tokens)
+        response = self.prompt(message, self.max_gpt_response_tokens)
+        return {"gpt_response": response.choices[0].message.content}
+
     def prompt(self, messages, max_tokens: int = 5):
         if self._source == "openai":
             return self.prompt_chat_gpt(messages, max_tokens)
@@ -461,27 +627,99 @@ class PromptBase(ABC):
         else:
             ValueError(f"Source {self._source} unknown.")
 
+    def prompt_local(
+        self, messages: list[list[dict[str, str]]], max_tokens: Optional[int] = 5
+    ) -> list[dict[str, Any]]:
+        """Prompt the local model with each of `messages` in batches and return the
+        response to each: the generated answer, or in scoring mode the most likely
+        label along with the log-probability of each label.
+        """
+        if self._scoring:
+            return [
+                {"gpt_response": max(scores, key=scores.get), "label_logprobs": scores}
+                for scores in self.local_model.score(messages)
+            ]
+        return [
+            {"gpt_response": response}
+            for response in self.local_model.generate(messages, max_tokens)
+        ]
+
+    def prompt_streaming(
+        self, messages: list[dict[str, str]], max_tokens: Optional[int] = 5
+    ) -> dict[str, Any]:
+        """Stream the response of the model to `messages` until its final answer and
+        return it as in `consume_stream`.
+        """
+        start = time.perf_counter()
+        stream = self.create_completion(messages, max_tokens, stream=True)
+        return consume_stream(stream, start)
+
     def prompt_open_source_model(
         self, messages: list[str], max_tokens: Optional[int] = 5
     ):
-        return self._client.chat.completions.create(
-            model=self._model, messages=messages, max_tokens=max_tokens
-        )
+        return self.create_completion(messages, max_tokens)
 
     def prompt_chat_gpt(self, messages: list[str], max_tokens: Optional[int] = 5):
         """Prompt the OpenAI model and return the chat completions object."""
-        return openai.chat.completions.create(
+        return self.create_completion(messages, max_tokens)
+
+    def create_completion(
+        self, messages: list[dict[str, str]], max_tokens: Optional[int], **kwargs
+    ):
+        """Create a chat completion of `messages` with the client of the source, or
+        with the key pool for OpenAI, counting the request against the limits and
+        spend of the key it is sent with. The usage of a streamed response cancelled
+        before its end is estimated from the tokens of the prompt and of the text
+        received.
+        """
+        if self._key_pool is None:
+            return self._client.chat.completions.create(
+                model=self._model, messages=messages, max_tokens=max_tokens, **kwargs
+            )
+
+        from openai.types import CompletionUsage
+
+        prompt_tokens = self.count_message_tokens(messages)
+        if kwargs.get("stream", False):
+            kwargs["stream_options"] = {"include_usage": True}
+
+        def estimate_usage(text: str) -> CompletionUsage:
+            completion_tokens = self.count_tokens(text)
+            return CompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            )
+
+        return self._key_pool.create(
+            tokens=prompt_tokens + (max_tokens or 0),
+            cost=self.calculate_cost_usage,
+            estimate_usage=estimate_usage,
             model=self._model,
             messages=messages,
             max_tokens=max_tokens,
+            **kwargs,
         )
 
     def count_tokens(self, message: str) -> int:
         """Return the number of tokens in `message` according to the encoding for the
         OpenAI model being used.
         """
+        if self._source == "local":
+            return self.local_model.count_tokens(message)
+        if self._encoding is None:
+            self._encoding = get_encoding(self._model)
         return len(self._encoding.encode(message))
 
+    def count_message_tokens(self, messages: list[dict[str, str]]) -> int:
+        """Return the number of tokens of the prompt `messages` as counted by the
+        OpenAI rate limits, without the tokens of the response.
+        """
+        return TOKENS_PER_REPLY + sum(
+            TOKENS_PER_MESSAGE + self.count_tokens(message["content"])
+            for message in messages
+        )
+
     def get_model_context_window(self) -> int:
         """Return the context window of the model in use. These can be found at
         https://platform.openai.com/docs/models and should be updated regularly should
@@ -489,6 +727,8 @@ class PromptBase(ABC):
 
         Last update: Nov 29, 2023.
         """
+        if self._source == "local":
+            return self.local_model.context_window
         if self._model == "gpt-3.5-turbo-1106":
             return 16385
         elif (
@@ -508,41 +748,19 @@ class PromptBase(ABC):
             raise ValueError(f"Context window unknown for model {self._model}.")
 
     def calculate_cost_input(self, num_tokens: int) -> float:
-        """Return the cost of inputting `num_tokens` into the model. This should be
-        updated regularly according to https://openai.com/pricing. As new models are
-        released, their pricing information should be added to this function.
-
-        Last update: Nov 29, 2023.
+        """Return the cost of inputting `num_tokens` into the model (see
+        `pricing.calculate_cost_input`).
         """
-        if (self._model == "gpt-3.5-turbo-1106") | (self._model == "gpt-3.5-turbo"):
-            # gpt-3.5-turbo currently points to gpt-3.5-turbo-0613. Will point to
-            # gpt-3.5-turbo-1106 starting Dec 11, 2023
-            cost = (num_tokens * 0.001) / 1000
-        elif self._model == "gpt-4":
-            cost = (num_tokens * 0.03) / 1000
-        elif self._model == "gpt-4-32k":
-            cost = (num_tokens * 0.06) / 1000
-        else:
-            raise ValueError(f"Model {self._model} cost unknown.")
+        return pricing.calculate_cost_input(self._model, num_tokens)
 
-        return cost
+    def calculate_cost_usage(self, usage) -> float:
+        """Return the cost of the `usage` of a chat completion, or 0 if the cost of
+        the model is unknown.
+        """
+        return pricing.calculate_cost_usage(self._model, usage)
 
     def calculate_cost_output(self, num_tokens: int) -> float:
-        """Return the cost of outputting `num_tokens` from the model. This should be
-        updated regularly according to https://openai.com/pricing. As new models are
-        released, their pricing information should be added to this function.
-
-        Last update: Nov 29, 2023.
+        """Return the cost of outputting `num_tokens` from the model (see
+        `pricing.calculate_cost_output`).
         """
-        if (self._model == "gpt-3.5-turbo-1106") | (self._model == "gpt-3.5-turbo"):
-            # gpt-3.5-turbo currently points to gpt-3.5-turbo-0613. Will point to
-            # gpt-3.5-turbo-1106 starting Dec 11, 2023
-            cost = (num_tokens * 0.002) / 1000
-        elif self._model == "gpt-4":
-            cost = (num_tokens * 0.06) / 1000
-        elif self._model == "gpt-4-32k":
-            cost = (num_tokens * 0.12) / 1000
-        else:
-            raise ValueError(f"Model {self._model} cost unknown.")
-
-        return cost
+        return pricing.calculate_cost_output(self._model, num_tokens)
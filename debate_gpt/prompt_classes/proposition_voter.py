@@ -3,10 +3,17 @@ from typing import Optional
 import numpy as np
 import pandas as pd
 
+from debate_gpt.data_processing.debate_data.rounds_store import RoundsStore
+from debate_gpt.prompt_classes.cascade import Cascade
+from debate_gpt.prompt_classes.data_context import DataContext
+from debate_gpt.prompt_classes.key_pool import KeyPool
+from debate_gpt.prompt_classes.personas import Personas
 from debate_gpt.prompt_classes.prompt_base import PromptBase
 
 
 class PropositionVoter(PromptBase):
+    needs_debate = False
+
     def __init__(
         self,
         task_config: dict[str, str],
@@ -21,6 +28,13 @@ class PropositionVoter(PromptBase):
         max_gpt_response_tokens: Optional[int] = 2,
         source: str = "openai",
         model: str = "gpt-3.5-turbo",
+        rounds_store: Optional[RoundsStore] = None,
+        personas: Optional[Personas] = None,
+        data_context: Optional[DataContext] = None,
+        scoring: bool = False,
+        streaming: bool = False,
+        cascade: Optional[Cascade] = None,
+        key_pool: Optional[KeyPool] = None,
     ) -> None:
         super().__init__(
             propositions_df=propositions_df,
@@ -35,6 +49,13 @@ class PropositionVoter(PromptBase):
             max_gpt_response_tokens=max_gpt_response_tokens,
             source=source,
             model=model,
+            rounds_store=rounds_store,
+            personas=personas,
+            data_context=data_context,
+            scoring=scoring,
+            streaming=streaming,
+            cascade=cascade,
+            key_pool=key_pool,
         )
 
         self._task_config = task_config
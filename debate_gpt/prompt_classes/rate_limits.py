@@ -0,0 +1,35 @@
+import time
+
+
+class TokenBucket:
+    def __init__(self, limit_per_minute: float) -> None:
+        """A bucket of `limit_per_minute` units (requests or tokens), refilled
+        continuously over a minute, as the rate limits of the OpenAI API.
+        """
+        self._capacity = limit_per_minute
+        self._rate = limit_per_minute / 60
+        self._level = limit_per_minute
+        self._last = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        return self._capacity
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self._capacity, self._level + (now - self._last) * self._rate)
+        self._last = now
+
+    def get_wait(self, amount: float) -> float:
+        """Return the seconds to wait before `amount` units are available."""
+        self._refill()
+        return max(min(amount, self._capacity) - self._level, 0) / self._rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self._level -= min(amount, self._capacity)
+
+    def get_headroom(self, amount: float = 0) -> float:
+        """Return the share of the capacity left after `amount` units."""
+        self._refill()
+        return (self._level - amount) / self._capacity
@@ -0,0 +1,193 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Optional
+
+import tqdm
+
+from debate_gpt.prompt_classes.prompt_base import PromptBase
+from debate_gpt.prompt_classes.rate_limits import TokenBucket
+
+
+class TokenScheduler:
+    def __init__(
+        self,
+        task: PromptBase,
+        rpm: int,
+        tpm: int,
+        num_workers: int = 8,
+        max_open_debates: int = 20,
+    ) -> None:
+        """Send the requests of `task` concurrently from `num_workers` threads within
+        a budget of `rpm` requests and `tpm` tokens per minute.
+
+        Each request is sized by the tokens of its message and of the longest
+        response. With a cascade, the cheap model is prompted first and the request
+        is only sent again to the model if it is escalated, each call being counted
+        against the limits when it is sent. The requests of up to `max_open_debates`
+        debates are pending at once, and the next request is chosen so that the
+        average size of the requests sent stays close to `tpm` / `rpm`: large
+        requests when the requests limit binds first and small ones when the tokens
+        limit does, so that neither limit is left idle. Among those, the requests of
+        the debates with the fewest requests left go first, so that debates are
+        completed and saved early.
+        """
+        self._task = task
+        self._rpm = rpm
+        self._tpm = tpm
+        self._requests_bucket = TokenBucket(rpm)
+        self._tokens_bucket = TokenBucket(tpm)
+        self._num_workers = num_workers
+        self._max_open_debates = max_open_debates
+
+        self._num_requests = 0
+        self._num_tokens = 0
+
+    def is_cascade_call(self, request: dict[str, Any]) -> bool:
+        """Return whether the next call for `request` prompts the cheap model of the
+        cascade, i.e. whether the cheap model was not prompted yet.
+        """
+        return (self._task.cascade is not None) and ("escalated" not in request)
+
+    def size_call(
+        self, message_tokens: int, request: dict[str, Any]
+    ) -> tuple[int, int]:
+        """Return the requests and tokens of the next call for `request`, whose
+        message has `message_tokens` tokens, counted by the limits.
+        """
+        max_tokens = self._task.max_gpt_response_tokens or 0
+        if self.is_cascade_call(request):
+            cascade = self._task.cascade
+            if cascade.source == "local":
+                return 0, 0
+            return 1, message_tokens + max_tokens * cascade.num_samples
+        return 1, message_tokens + max_tokens
+
+    def send(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Send the next call for `request` and return its response."""
+        if self.is_cascade_call(request):
+            return self._task.get_cascade_response(request["message"])
+        return self._task.get_model_response(request["message"])
+
+    def open_debate(self, debate_id: int) -> dict[str, Any]:
+        requests = self._task.get_requests(debate_id)
+        return {
+            "pending": [
+                (self._task.count_message_tokens(request["message"]), request)
+                for request in requests
+            ],
+            "num_in_flight": 0,
+            "results": [],
+        }
+
+    def select_request(
+        self, debates: dict[int, dict[str, Any]]
+    ) -> Optional[tuple[int, int]]:
+        """Return the debate id and pending index of the next request to send (None
+        if no request is pending).
+        """
+        # large requests are wanted while the average request is smaller than
+        # tpm / rpm, i.e. while the requests limit would be reached first
+        want_large = self._num_tokens * self._rpm <= self._tpm * self._num_requests
+        target = self._tpm / self._rpm
+
+        best = None
+        for debate_id, debate in debates.items():
+            num_left = len(debate["pending"]) + debate["num_in_flight"]
+            for i, (message_tokens, request) in enumerate(debate["pending"]):
+                _, tokens = self.size_call(message_tokens, request)
+                key = (
+                    (tokens >= target) != want_large,
+                    num_left,
+                    -tokens if want_large else tokens,
+                )
+                if (best is None) or (key < best[0]):
+                    best = (key, debate_id, i)
+
+        if best is None:
+            return None
+        return best[1], best[2]
+
+    def get_wait(self, num_requests: int, tokens: int) -> float:
+        """Return the seconds to wait before `num_requests` requests of `tokens`
+        tokens can be sent.
+        """
+        return max(
+            self._requests_bucket.get_wait(num_requests),
+            self._tokens_bucket.get_wait(tokens),
+        )
+
+    def run(self, debate_ids: list[int], path_to_file: str) -> None:
+        """Get the results of prompting the model for all debates in `debate_ids` and
+        save them in `path_to_file` (see `PromptBase.get_batch_results`). The results
+        of a debate are saved once all its requests are answered. Failed requests
+        are sent again.
+        """
+        queue = list(reversed(debate_ids))
+        debates = {}
+        in_flight = {}
+        results = []
+        progress = tqdm.tqdm(total=len(debate_ids))
+
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            while queue or debates:
+                while queue and (len(debates) < self._max_open_debates):
+                    debate_id = queue.pop()
+                    debate = self.open_debate(debate_id)
+                    if len(debate["pending"]) == 0:
+                        progress.update(1)
+                    else:
+                        debates[debate_id] = debate
+
+                timeout = None
+                while len(in_flight) < self._num_workers:
+                    selected = self.select_request(debates)
+                    if selected is None:
+                        break
+                    debate_id, i = selected
+                    message_tokens, request = debates[debate_id]["pending"][i]
+                    num_requests, tokens = self.size_call(message_tokens, request)
+                    if self.get_wait(num_requests, tokens) > 0:
+                        # wait for the budget or for a response, whichever is first
+                        timeout = self.get_wait(num_requests, tokens)
+                        break
+
+                    del debates[debate_id]["pending"][i]
+                    debates[debate_id]["num_in_flight"] += 1
+                    self._requests_bucket.consume(num_requests)
+                    self._tokens_bucket.consume(tokens)
+                    self._num_requests += num_requests
+                    self._num_tokens += tokens
+                    future = executor.submit(self.send, request)
+                    in_flight[future] = (debate_id, message_tokens, request)
+
+                if len(in_flight) == 0:
+                    time.sleep(timeout or 0)
+                    continue
+
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    debate_id, message_tokens, request = in_flight.pop(future)
+                    debate = debates[debate_id]
+                    debate["num_in_flight"] -= 1
+                    try:
+                        request.update(future.result())
+                    except Exception as e:
+                        print(e)
+                        debate["pending"].append((message_tokens, request))
+                        continue
+
+                    if request.get("escalated") and ("gpt_response" not in request):
+                        # escalated by the cascade, the model is prompted next
+                        debate["pending"].append((message_tokens, request))
+                        continue
+                    debate["results"].append(request)
+                    if (len(debate["pending"]) == 0) and (debate["num_in_flight"] == 0):
+                        results += debates.pop(debate_id)["results"]
+                        progress.update(1)
+
+                if len(results) >= 50:
+                    self._task.save_results_to_file(results, path_to_file)
+                    results = []
+
+        progress.close()
+        self._task.save_results_to_file(results, path_to_file)
@@ -0,0 +1,173 @@
+import math
+import time
+from statistics import NormalDist
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+import tqdm
+
+from debate_gpt.prompt_classes.cascade import extract_label
+from debate_gpt.prompt_classes.prompt_base import PromptBase
+
+
+def get_stratified_order(
+    votes_df: pd.DataFrame, debate_ids: list[int], rng: np.random.Generator
+) -> list[tuple[int, str]]:
+    """Return the (debate_id, voter_id) items of the debates `debate_ids` in a random
+    order stratified by debate.
+
+    The voters of each debate are shuffled and the debates are visited round-robin in
+    a random order, so that any prefix of the order spreads its items as evenly as
+    possible over the debates.
+    """
+    items = votes_df.loc[
+        votes_df.debate_id.isin(debate_ids), ["debate_id", "voter_id"]
+    ].drop_duplicates()
+    items = items.iloc[rng.permutation(len(items))]
+
+    debates = items.debate_id.unique()
+    debate_ranks = pd.Series(rng.permutation(len(debates)), index=debates)
+    items = items.assign(
+        voter_rank=items.groupby("debate_id", sort=False).cumcount().to_numpy(),
+        debate_rank=debate_ranks[items.debate_id].to_numpy(),
+    ).sort_values(["voter_rank", "debate_rank"], kind="stable")
+    return list(zip(items.debate_id.tolist(), items.voter_id.tolist()))
+
+
+class SequentialAccuracy:
+    def __init__(self, confidence: float = 0.95) -> None:
+        """Streaming accuracy of answers clustered by debate, with a normal
+        `confidence` interval whose standard error accounts for the correlation of
+        the answers within a debate (a cluster-robust ratio estimator).
+
+        The sums needed by the standard error are updated with each answer, so the
+        interval is available in constant time after every item.
+        """
+        self._z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self._num_items = 0
+        self._num_correct = 0
+        self._debate_counts = {}
+
+        # sums over the debates of correct^2, correct * items and items^2
+        self._sum_correct_squared = 0
+        self._sum_correct_items = 0
+        self._sum_items_squared = 0
+
+    @property
+    def num_items(self) -> int:
+        return self._num_items
+
+    @property
+    def num_debates(self) -> int:
+        return len(self._debate_counts)
+
+    @property
+    def accuracy(self) -> float:
+        """Return the accuracy (in %) of the answers so far."""
+        if self._num_items == 0:
+            return math.nan
+        return 100 * self._num_correct / self._num_items
+
+    def update(self, debate_id: int, correct: bool) -> None:
+        """Add an answer to debate `debate_id`."""
+        num_correct, num_items = self._debate_counts.get(debate_id, (0, 0))
+        self._sum_correct_squared += 2 * num_correct * correct + correct
+        self._sum_correct_items += num_correct + correct * (num_items + 1)
+        self._sum_items_squared += 2 * num_items + 1
+
+        self._debate_counts[debate_id] = (num_correct + correct, num_items + 1)
+        self._num_correct += correct
+        self._num_items += 1
+
+    def get_standard_error(self) -> float:
+        """Return the standard error (in %) of the accuracy."""
+        num_debates = self.num_debates
+        if num_debates < 2:
+            return math.inf
+        p = self._num_correct / self._num_items
+        residuals = (
+            self._sum_correct_squared
+            - 2 * p * self._sum_correct_items
+            + p**2 * self._sum_items_squared
+        )
+        variance = num_debates / (num_debates - 1) * residuals / self._num_items**2
+        return 100 * math.sqrt(max(variance, 0))
+
+    def get_confidence_interval(self) -> tuple[float, float]:
+        """Return the confidence interval (in %) of the accuracy."""
+        margin = self._z * self.get_standard_error()
+        return self.accuracy - margin, self.accuracy + margin
+
+
+def run_sequential_evaluation(
+    task: PromptBase,
+    debate_ids: list[int],
+    truth_column: str,
+    path_to_file: str,
+    width: float = 4,
+    confidence: float = 0.95,
+    min_items: int = 100,
+    max_items: Optional[int] = None,
+    seed=None,
+) -> dict[str, Any]:
+    """Prompt `task` for the voters of `debate_ids` in the order of
+    `get_stratified_order` until the `confidence` interval of its accuracy against
+    `truth_column` of the votes (e.g. agreed_before) is at most `width` points wide.
+
+    At least `min_items` and at most `max_items` (all if None) voters are prompted.
+    The results are appended to `path_to_file` as in `PromptBase.get_batch_results`,
+    with the extracted answer (see `extract_label`) of each response.
+
+    :returns: the accuracy, its confidence interval, the number of voters and debates
+        prompted and whether the target width was reached
+    """
+    order = get_stratified_order(task.votes_df, debate_ids, np.random.default_rng(seed))
+    if max_items is not None:
+        order = order[:max_items]
+
+    estimate = SequentialAccuracy(confidence)
+    debates = {}
+    results = []
+    reached = False
+    progress = tqdm.tqdm(order)
+    for debate_id, voter_id in progress:
+        if debate_id not in debates:
+            debates[debate_id] = task.get_task_debate(debate_id)
+        debate, length = debates[debate_id]
+
+        message = task.create_gpt_message(debate, debate_id, voter_id)
+        if message is None:
+            continue
+
+        # only the request is retried, errors building the message are raised
+        while True:
+            try:
+                result = task.get_voter_result(debate_id, voter_id, length, message)
+                break
+            except Exception as e:
+                print(e)
+                time.sleep(0.5)
+
+        result["answer"] = extract_label(result["gpt_response"]) or "Other"
+        estimate.update(debate_id, result["answer"] == result[truth_column])
+        results.append(result)
+        if len(results) >= 50:
+            task.save_results_to_file(results, path_to_file)
+            results = []
+
+        lower, upper = estimate.get_confidence_interval()
+        progress.set_postfix(accuracy=f"{estimate.accuracy:.1f}", width=upper - lower)
+        if (estimate.num_items >= min_items) and (upper - lower <= width):
+            reached = True
+            break
+
+    task.save_results_to_file(results, path_to_file)
+    lower, upper = estimate.get_confidence_interval()
+    return {
+        "accuracy": estimate.accuracy,
+        "confidence_interval": (lower, upper),
+        "num_voters": estimate.num_items,
+        "num_debates": estimate.num_debates,
+        "reached_width": reached,
+    }
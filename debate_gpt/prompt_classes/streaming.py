@@ -0,0 +1,97 @@
+import re
+import time
+from typing import Any, Iterable, Optional
+
+# the final answer of the reasoning tasks, in their two formats: the "Answer:"
+# sentence of "Reasoning: ... Answer: Pro." and the answer of the object
+# "{'reasoning': '...', 'answer': 'Pro'}". An answer mentioned within the reasoning
+# does not start a sentence, and the answer is only complete once its sentence, line
+# or key-value pair ends after the label
+ANSWER_PATTERN = re.compile(
+    r"(?:(?:^|[.!?\n])\s*answer:\s*['\"]?|['\"]answer['\"]\s*:\s*['\"])"
+    r"(pro|con|tie)(?:['\"]?\s*[.!\n]|['\"]\s*[,}])",
+    re.IGNORECASE,
+)
+
+# appended to a complete response, whose answer may end with the label
+END_OF_RESPONSE = "\n"
+
+# number of characters searched again when new text arrives, so that an answer split
+# across chunks is found without searching the whole response each time
+LOOKBACK = 64
+
+
+class AnswerDetector:
+    def __init__(self) -> None:
+        """Incrementally search a streamed response for its final answer."""
+        self._text = ""
+        self._answer = None
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def answer(self) -> Optional[str]:
+        return self._answer
+
+    def feed(self, delta: str) -> Optional[str]:
+        """Append `delta` to the response and return its answer ("Pro", "Con" or
+        "Tie") once found, None before.
+        """
+        start = max(len(self._text) - LOOKBACK, 0)
+        self._text += delta
+        if self._answer is None:
+            match = ANSWER_PATTERN.search(self._text, start)
+            if match is not None:
+                self._answer = match.group(1).title()
+        return self._answer
+
+    def finish(self) -> Optional[str]:
+        """Return the answer of the complete response, which may end with the label."""
+        if self._answer is None:
+            start = max(len(self._text) - LOOKBACK, 0)
+            match = ANSWER_PATTERN.search(self._text + END_OF_RESPONSE, start)
+            if match is not None:
+                self._answer = match.group(1).title()
+        return self._answer
+
+
+def consume_stream(stream: Iterable[Any], start: float) -> dict[str, Any]:
+    """Read the chat completion chunks of `stream` until the final answer is found,
+    then close the stream to cancel the rest of the response.
+
+    :returns: the response received so far, whether it was stopped early and the
+        seconds from `start` (a `time.perf_counter` value) to its first token and to
+        its answer (None if not received)
+    """
+    detector = AnswerDetector()
+    time_to_first_token = None
+    time_to_answer = None
+    stopped_early = False
+    try:
+        for chunk in stream:
+            if len(chunk.choices) == 0:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            if detector.feed(delta) is not None:
+                time_to_answer = time.perf_counter() - start
+                stopped_early = True
+                break
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+
+    if (not stopped_early) and (detector.finish() is not None):
+        time_to_answer = time.perf_counter() - start
+
+    return {
+        "gpt_response": detector.text,
+        "stopped_early": stopped_early,
+        "time_to_first_token": time_to_first_token,
+        "time_to_answer": time_to_answer,
+    }
@@ -0,0 +1,69 @@
+import os
+from typing import Any, Optional
+
+# tiktoken reads and writes its BPE files in this directory unless TIKTOKEN_CACHE_DIR
+# is set, so that a cache warmed with `prewarm_tokenizers` works without network
+DEFAULT_CACHE_DIR = "data/processing/cache/tiktoken"
+FALLBACK_MODEL = "gpt-3.5-turbo"
+
+# tokens added by the chat format to each message and to prime the reply, see
+# https://github.com/openai/openai-cookbook (How to count tokens with tiktoken)
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+_encodings = {}
+
+
+def set_cache_dir(path_to_cache: Optional[str] = None) -> str:
+    """Set the directory of the tokenizer files to `path_to_cache`, or to the
+    TIKTOKEN_CACHE_DIR environment variable (`DEFAULT_CACHE_DIR` if unset) if None,
+    and return it.
+    """
+    if path_to_cache is not None:
+        os.environ["TIKTOKEN_CACHE_DIR"] = path_to_cache
+    else:
+        os.environ.setdefault("TIKTOKEN_CACHE_DIR", DEFAULT_CACHE_DIR)
+    return os.environ["TIKTOKEN_CACHE_DIR"]
+
+
+def get_encoding(model: str) -> Any:
+    """Return the tiktoken encoding of `model` (of `FALLBACK_MODEL` for models unknown
+    to tiktoken, e.g. llama).
+
+    tiktoken is only imported and the encoding only loaded the first time the
+    encoding of a model is requested, and is then shared by every caller.
+    """
+    if model not in _encodings:
+        set_cache_dir()
+        import tiktoken
+
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.encoding_for_model(FALLBACK_MODEL)
+    return _encodings[model]
+
+
+def count_message_tokens(messages: list[dict[str, str]], model: str) -> int:
+    """Return the number of tokens of the prompt `messages` to `model` as counted by
+    the OpenAI rate limits, without the tokens of the response.
+    """
+    encoding = get_encoding(model)
+    return TOKENS_PER_REPLY + sum(
+        TOKENS_PER_MESSAGE + len(encoding.encode(message["content"]))
+        for message in messages
+    )
+
+
+def prewarm_tokenizers(models: list[str], path_to_cache: Optional[str] = None) -> str:
+    """Download the tokenizer files of `models` into `path_to_cache` (see
+    `set_cache_dir`) and return the directory.
+
+    The directory can then be copied to machines without network access, where the
+    encodings are read from it.
+    """
+    path_to_cache = set_cache_dir(path_to_cache)
+    os.makedirs(path_to_cache, exist_ok=True)
+    for model in models:
+        get_encoding(model)
+    return path_to_cache
@@ -1,38 +1,20 @@
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator, Optional
 
 import numpy as np
 import pandas as pd
+import scipy.sparse
 import scipy.stats
+from joblib import Parallel, delayed
 from scipy.stats import t
+from sklearn.base import clone
 from sklearn.metrics import confusion_matrix
+from sklearn.model_selection import KFold
 
 warnings.filterwarnings("ignore")
 
 
-def get_train_test(
-    train_index,
-    test_index,
-    debate_ids,
-    df_dummies,
-    output: str = "agreed_before",
-):
-
-    train_set = debate_ids[train_index]
-    test_set = debate_ids[test_index]
-    features = [
-        col for col in df_dummies if col not in ["debate_id", "voter_id", output]
-    ]
-    df_train = df_dummies[df_dummies.debate_id.isin(train_set)]
-    df_test = df_dummies[df_dummies.debate_id.isin(test_set)]
-    X_train = pd.get_dummies(df_train[features])
-    X_test = pd.get_dummies(df_test[features])
-
-    y_train = df_train[output]
-    y_test = df_test[output]
-
-    return X_train, y_train, X_test, y_test
-
-
 def get_metrics(scores):
     sample_mean = np.mean(scores)
     sample_std = np.std(scores, ddof=1)  # using ddof=1 for sample standard deviation
@@ -52,6 +34,125 @@ def get_metrics(scores):
     return round(sample_mean * 100, 2), confidence_interval
 
 
+def encode_features(
+    df: pd.DataFrame, output: str = "agreed_before"
+) -> tuple[scipy.sparse.csr_matrix, np.ndarray, list[str]]:
+    """Return the features of `df` one-hot encoded once into a sparse matrix, the
+    outputs and the names of the columns of the matrix.
+
+    Every column except debate_id, voter_id and `output` is a feature, with the
+    categorical (and string) columns one-hot encoded like `pd.get_dummies`. The
+    categories are taken from the whole of `df`, so every fold shares the same
+    columns.
+    """
+    features = [col for col in df if col not in ["debate_id", "voter_id", output]]
+    num_samples = len(df)
+
+    matrices = []
+    names = []
+    for feature in features:
+        column = df[feature]
+        if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+            values = column.to_numpy(dtype=float)[:, None]
+            matrices.append(scipy.sparse.csr_matrix(values))
+            names.append(feature)
+            continue
+
+        codes, categories = pd.factorize(column, sort=True)
+        rows = np.flatnonzero(codes >= 0)
+        matrices.append(
+            scipy.sparse.csr_matrix(
+                (np.ones(len(rows)), (rows, codes[rows])),
+                shape=(num_samples, len(categories)),
+            )
+        )
+        names += [f"{feature}_{category}" for category in categories]
+
+    X = scipy.sparse.hstack(matrices, format="csr")
+    return X, df[output].to_numpy(), names
+
+
+def get_group_folds(
+    groups: np.ndarray, n_splits: int = 20
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Return the train and test row indices of each fold of a `KFold` over the
+    unique `groups` (e.g. debate ids), in order of appearance, so that all the rows
+    of a group are in the same fold.
+    """
+    group_codes, unique_groups = pd.factorize(groups)
+    folds = []
+    for _, test_groups in KFold(n_splits=n_splits).split(unique_groups):
+        test = np.isin(group_codes, test_groups)
+        folds.append((np.flatnonzero(~test), np.flatnonzero(test)))
+    return folds
+
+
+def _fit_score(classifier, X, y, train_index, test_index) -> float:
+    classifier.fit(X[train_index], y[train_index])
+    return classifier.score(X[test_index], y[test_index])
+
+
+def cross_validate(
+    classifiers: dict[str, Any],
+    dfs: list[pd.DataFrame],
+    output: str = "agreed_before",
+    n_splits: int = 20,
+    num_workers: int = 1,
+) -> dict[str, tuple[float, tuple[float, float]]]:
+    """Return the mean accuracy and its confidence interval (see `get_metrics`) of
+    each of the sklearn `classifiers` over the folds of every dataframe in `dfs`.
+
+    Each dataframe is encoded once with `encode_features` and split into `n_splits`
+    folds grouped by debate_id with `get_group_folds`. The classifiers are trained on
+    all the folds in parallel by `num_workers` joblib workers.
+    """
+    data = []
+    for df in dfs:
+        X, y, _ = encode_features(df, output)
+        data.append((X, y, get_group_folds(df.debate_id.to_numpy(), n_splits)))
+
+    jobs = [
+        (name, X, y, train_index, test_index)
+        for name in classifiers
+        for X, y, folds in data
+        for train_index, test_index in folds
+    ]
+    scores = Parallel(n_jobs=num_workers)(
+        delayed(_fit_score)(clone(classifiers[name]), X, y, train_index, test_index)
+        for name, X, y, train_index, test_index in jobs
+    )
+
+    return {
+        name: get_metrics(
+            [score for (job_name, *_), score in zip(jobs, scores) if job_name == name]
+        )
+        for name in classifiers
+    }
+
+
+def factorize_labels(df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """Return the labels in `df` encoded as integer codes and the array of labels.
+
+    Entry i, j of the codes is the index in the array of labels of the label in row i,
+    column j of `df`, or -1 if that entry is missing.
+    """
+    codes, labels = pd.factorize(df.to_numpy().ravel())
+    return codes.reshape(df.shape), np.asarray(labels)
+
+
+def get_label_counts(codes: np.ndarray, num_labels: int) -> np.ndarray:
+    """Return the number of times each label appears in each row of `codes`, ignoring
+    missing labels.
+    """
+    rows = np.repeat(np.arange(codes.shape[0]), codes.shape[1])
+    codes = codes.ravel()
+    valid = codes >= 0
+    return np.bincount(
+        rows[valid] * num_labels + codes[valid],
+        minlength=(rows.max(initial=-1) + 1) * num_labels,
+    ).reshape(-1, num_labels)
+
+
 def calculate_fleiss_kappa(
     df: pd.DataFrame, alpha: float = 0.05
 ) -> tuple[float, float, float]:
@@ -75,10 +176,10 @@ def calculate_fleiss_kappa(
     num_raters = len(df.columns)
     num_samples = len(df)
 
-    # create new dataframe called `value_counts` where each row contains a sample and
-    # each column represents one label. Entry i,j contains number of raters labeling
-    # sample i with label j.
-    value_counts = df.apply(pd.Series.value_counts, axis=1).fillna(0)
+    # entry i,j of `value_counts` contains number of raters labeling sample i with
+    # label j
+    codes, labels = factorize_labels(df)
+    value_counts = get_label_counts(codes, len(labels))
     sample_proportions = ((value_counts**2).sum(axis=1) - num_raters) / (
         num_raters * (num_raters - 1)
     )
@@ -111,6 +212,26 @@ def calculate_fleiss_kappa(
     return fleiss_kappa, fleiss_kappa_lb, fleiss_kappa_ub
 
 
+def _cohens_kappa(observed_agreement, expected_agreement, num_samples, alpha):
+    """Return Cohen's kappa with the bounds of its (1-`alpha`)% confidence interval
+    from the observed and expected agreement (floats or arrays).
+    """
+    cohens_kappa = (observed_agreement - expected_agreement) / (1 - expected_agreement)
+
+    # calculate confidence interval
+    z_critical = scipy.stats.norm.ppf(1 - alpha / 2)
+
+    standard_error = np.sqrt(
+        (observed_agreement * (1 - observed_agreement))
+        / (((1 - expected_agreement) ** 2) * num_samples)
+    )
+
+    cohens_kappa_lb = cohens_kappa - z_critical * standard_error
+    cohens_kappa_ub = cohens_kappa + z_critical * standard_error
+
+    return cohens_kappa, cohens_kappa_lb, cohens_kappa_ub
+
+
 def calculate_cohens_kappa(
     df: pd.DataFrame, alpha: float = 0.05
 ) -> tuple[float, float, float]:
@@ -135,46 +256,147 @@ def calculate_cohens_kappa(
 
     num_samples = len(df)
 
-    possible_labels = pd.unique(df.values.ravel("K"))
-    num_labels = len(possible_labels)
-
-    observed_proportions = np.zeros((num_labels, num_labels))
-    expected_probabilities = np.zeros((num_labels, num_labels))
-    for i in range(num_labels):
-        for j in range(num_labels):
-            observed_proportions[i, j] = len(
-                df[
-                    (df[df.columns[0]] == possible_labels[i])
-                    & (df[df.columns[1]] == possible_labels[j])
-                ]
-            )
-            expected_probabilities[i, j] = (
-                (len(df[df[df.columns[0]] == possible_labels[i]]))
-            ) * (len(df[df[df.columns[1]] == possible_labels[j]]))
+    codes, labels = factorize_labels(df)
+    num_labels = len(labels)
 
+    # confusion matrix of the samples labeled by both raters
+    both = (codes >= 0).all(axis=1)
+    observed_proportions = np.bincount(
+        codes[both, 0] * num_labels + codes[both, 1], minlength=num_labels**2
+    ).reshape(num_labels, num_labels)
     observed_proportions = observed_proportions / num_samples
-    expected_probabilities = expected_probabilities / num_samples**2
 
-    # calculate cohens kappa
+    # proportion of the samples given each label by each rater
+    label_proportions = get_label_counts(codes.T, num_labels) / num_samples
+
     observed_agreement = observed_proportions.diagonal().sum()
-    expected_agreement = np.sum(
-        expected_probabilities.sum(axis=1) * expected_probabilities.sum(axis=0)
+    expected_agreement = np.sum(label_proportions[0] * label_proportions[1]) * np.prod(
+        label_proportions.sum(axis=1)
     )
 
-    cohens_kappa = (observed_agreement - expected_agreement) / (1 - expected_agreement)
+    return _cohens_kappa(observed_agreement, expected_agreement, num_samples, alpha)
 
-    # calculate confidence interval
-    z_critical = scipy.stats.norm.ppf(1 - alpha / 2)
 
-    standard_error = np.sqrt(
-        (observed_agreement * (1 - observed_agreement))
-        / (((1 - expected_agreement) ** 2) * num_samples)
+def calculate_pairwise_cohens_kappa(
+    df: pd.DataFrame, alpha: float = 0.05
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Calculate Cohen's kappa and the 1-`alpha`% confidence interval for every pair
+    of raters in `df`, as given by `calculate_cohens_kappa` on their two columns.
+
+    Each row in `df` should represent one sample to be labeled and each column one
+    rater (or model).
+
+    :returns: a dataframe of the Cohen's kappa value of each pair of raters
+              a dataframe of the lower bound of the Cohen's kappa value for the CI
+              a dataframe of the upper bound of the Cohen's kappa value for the CI
+    """
+    num_samples = len(df)
+
+    codes, labels = factorize_labels(df)
+    num_labels = len(labels)
+
+    # one_hot[i, j, k] is True if rater j gave label k to sample i
+    one_hot = codes[:, :, None] == np.arange(num_labels)
+    one_hot = one_hot.reshape(num_samples, -1).astype(float)
+    label_proportions = get_label_counts(codes.T, num_labels) / num_samples
+
+    # agreement[a, b] is the proportion of samples given the same label by a and b
+    agreement = (one_hot.T @ one_hot).reshape(
+        len(df.columns), num_labels, len(df.columns), num_labels
     )
+    observed_agreement = np.trace(agreement, axis1=1, axis2=3) / num_samples
 
-    cohens_kappa_lb = cohens_kappa - z_critical * standard_error
-    cohens_lappa_ub = cohens_kappa + z_critical * standard_error
+    rater_proportions = label_proportions.sum(axis=1)
+    expected_agreement = (label_proportions @ label_proportions.T) * np.outer(
+        rater_proportions, rater_proportions
+    )
+
+    return tuple(
+        pd.DataFrame(values, index=df.columns, columns=df.columns)
+        for values in _cohens_kappa(
+            observed_agreement, expected_agreement, num_samples, alpha
+        )
+    )
+
+
+LABELS = ["Pro", "Con", "Tie"]
+
+
+def get_resampling_weights(
+    num_bootstraps: int,
+    num_samples: int,
+    rng: np.random.Generator,
+    clusters: Optional[np.ndarray] = None,
+    strata: Optional[np.ndarray] = None,
+    block_size: int = 100,
+) -> Iterator[np.ndarray]:
+    """Yield the bootstrap replicates of `num_samples` samples in blocks of at most
+    `block_size` replicates.
+
+    Each block is a matrix where entry i, j is the number of times sample j is drawn
+    in replicate i. If `clusters` (e.g. the debate id of each sample) is given, whole
+    clusters are resampled instead of samples. If `strata` (e.g. the ground truth of
+    each sample) is given, the samples, or clusters, of each stratum are resampled
+    separately so that every replicate keeps the size of each stratum.
+    """
+    if clusters is None:
+        unit_codes = np.arange(num_samples)
+    else:
+        unit_codes, _ = pd.factorize(clusters)
+    num_units = unit_codes.max(initial=-1) + 1
+
+    if strata is None:
+        groups = [np.arange(num_units)]
+    else:
+        # the stratum of a cluster is the stratum of its samples
+        unit_strata = np.zeros(num_units, dtype=np.int64)
+        unit_strata[unit_codes] = pd.factorize(strata)[0]
+        groups = [np.flatnonzero(unit_strata == s) for s in np.unique(unit_strata)]
+
+    for start in range(0, num_bootstraps, block_size):
+        size = min(block_size, num_bootstraps - start)
+        draws = np.concatenate(
+            [
+                group[rng.integers(0, len(group), (size, len(group)))]
+                for group in groups
+            ],
+            axis=1,
+        )
+        counts = np.bincount(
+            (np.arange(size)[:, None] * num_units + draws).ravel(),
+            minlength=size * num_units,
+        ).reshape(size, num_units)
+        yield counts[:, unit_codes]
+
+
+def get_bootstrap_statistics(
+    true_codes: np.ndarray, predict_codes: np.ndarray, weights: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the accuracy, recall and precision (in %) of the predictions in each
+    bootstrap replicate of `weights` (see `get_resampling_weights`).
+
+    `true_codes` and `predict_codes` are the indices in `LABELS` of the labels of
+    each sample, or -1 for any other label. Every sample is counted, so predictions
+    that are not in `LABELS` are wrong.
+
+    :returns: an array of the accuracy of each replicate
+              an array of the recall of each label (column) in each replicate (row)
+              an array of the precision of each label (column) in each replicate (row)
+    """
+    num_labels = len(LABELS)
+    true_one_hot = (true_codes[:, None] == np.arange(num_labels)).astype(float)
+    predict_one_hot = (predict_codes[:, None] == np.arange(num_labels)).astype(float)
+
+    # one matrix product for the true positives, true and predicted labels
+    counts = weights @ np.concatenate(
+        [true_one_hot * predict_one_hot, true_one_hot, predict_one_hot], axis=1
+    )
+    true_positives, num_true, num_predicted = np.split(counts, 3, axis=1)
 
-    return cohens_kappa, cohens_kappa_lb, cohens_lappa_ub
+    accuracy = true_positives.sum(axis=1) / weights.sum(axis=1) * 100
+    recall = true_positives / num_true * 100
+    precision = true_positives / num_predicted * 100
+    return accuracy, recall, precision
 
 
 def get_bootstrap(
@@ -182,7 +404,19 @@ def get_bootstrap(
     true_column: str = "ground_truth",
     predict_column: str = "processed_gpt_response",
     num_bootstraps: int = 1000,
+    percentiles: tuple[float, ...] = (2.5, 97.5),
+    seed=None,
+    stratify: Optional[str] = None,
+    cluster: Optional[str] = None,
+    block_size: int = 100,
 ):
+    """Return the accuracy, recall and precision of the predictions in `df` together
+    with the `percentiles` of the accuracy over `num_bootstraps` bootstrap replicates.
+
+    The replicates are drawn with a random generator seeded with `seed`. They are
+    stratified by the `stratify` column and resample the clusters of the `cluster`
+    column (e.g. debate_id) if given (see `get_resampling_weights`).
+    """
     sample_size = len(df)
     cm = confusion_matrix(
         df[true_column], df[predict_column], labels=["Pro", "Con", "Tie"]
@@ -192,16 +426,55 @@ def get_bootstrap(
     precisions = (cm.diagonal() / cm.sum(axis=0) * 100).round(2)
     accuracy = 100 * (cm.diagonal().sum() / cm.sum())
 
-    statistics = []
-    for _ in range(num_bootstraps):
-        sample = df.sample(sample_size, replace=True)
-        cm = confusion_matrix(sample[true_column], sample[predict_column])
-        acc = cm.diagonal().sum() / cm.sum() * 100
-        statistics.append(acc)
+    label_dtype = pd.CategoricalDtype(LABELS)
+    true_codes = df[true_column].astype(label_dtype).cat.codes.to_numpy()
+    predict_codes = df[predict_column].astype(label_dtype).cat.codes.to_numpy()
+
+    rng = np.random.default_rng(seed)
+    weights = get_resampling_weights(
+        num_bootstraps,
+        sample_size,
+        rng,
+        clusters=None if cluster is None else df[cluster].to_numpy(),
+        strata=None if stratify is None else df[stratify].to_numpy(),
+        block_size=block_size,
+    )
+    statistics = np.concatenate(
+        [
+            get_bootstrap_statistics(true_codes, predict_codes, block)[0]
+            for block in weights
+        ]
+    )
+    # the "higher" method gives sorted(statistics)[25] and [975] for 1000 replicates
+    confidence_interval = np.percentile(statistics, percentiles, method="higher")
 
     return (
         round(accuracy, 2),
         recalls,
         precisions,
-        (round(sorted(statistics)[25], 2), round(sorted(statistics)[975], 2)),
+        tuple(round(float(bound), 2) for bound in confidence_interval),
     )
+
+
+def get_bootstraps(
+    dfs: dict[Any, pd.DataFrame], num_workers: int = 1, seed=None, **kwargs
+) -> dict[Any, tuple]:
+    """Return `get_bootstrap` of each dataframe in `dfs` (e.g. one per model and
+    dataset), computed by `num_workers` processes.
+
+    Every dataframe gets its own random generator spawned from `seed`, so the results
+    do not depend on `num_workers`. `kwargs` are passed to `get_bootstrap`.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(dfs))
+    if num_workers <= 1:
+        return {
+            key: get_bootstrap(df, seed=cell_seed, **kwargs)
+            for (key, df), cell_seed in zip(dfs.items(), seeds)
+        }
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            key: executor.submit(get_bootstrap, df, seed=cell_seed, **kwargs)
+            for (key, df), cell_seed in zip(dfs.items(), seeds)
+        }
+        return {key: future.result() for key, future in futures.items()}
@@ -1,8 +1,7 @@
+import argparse
 import sys
 import warnings
 
-import pandas as pd
-
 sys.path.append(".")
 
 from debate_gpt.data_processing.debate_data.filter_data import (  # noqa: E402
@@ -11,43 +10,78 @@ from debate_gpt.data_processing.debate_data.filter_data import (  # noqa: E402
     filter_by_votes,
     filter_votes_by_users,
 )
+from debate_gpt.data_processing.storage import load_df, save_df  # noqa: E402
 
 warnings.filterwarnings("ignore")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--percentage", type=float, default=25)
+    parser.add_argument("--min_tokens", type=int, default=300)
+    parser.add_argument("--min_num_votes", type=int, default=3)
+    parser.add_argument("--min_num_flipped_votes", type=int, default=0)
+    parser.add_argument("--min_num_demographics", type=int, default=5)
+
+    args = parser.parse_args()
+    return args
+
+
 def main():
-    debates_df = pd.read_json("data/processing/processed_data/debates_df.json")
+    args = parse_args()
+
+    debates_df = load_df("data/processing/processed_data/debates_df.parquet")
     debates_df = debates_df.set_index("debate_id")
 
     # Filter debates by rounds
-    rounds_df = pd.read_json("data/processing/processed_data/rounds_df.json")
-    debates_df = filter_by_rounds(rounds_df, debates_df, percentage=25, min_tokens=300)
+    rounds_df = load_df(
+        "data/processing/processed_data/rounds_df.parquet",
+        columns=["debate_id", "side", "token_count"],
+    )
+    debates_df = filter_by_rounds(
+        rounds_df,
+        debates_df,
+        percentage=args.percentage,
+        min_tokens=args.min_tokens,
+    )
 
     # Filter debates by votes
-    votes_df = pd.read_json("data/processing/processed_data/votes_df.json")
+    votes_df = load_df("data/processing/processed_data/votes_df.parquet")
     debates_df = filter_by_votes(
-        votes_df, debates_df, min_num_votes=3, min_num_flipped_votes=0
+        votes_df,
+        debates_df,
+        min_num_votes=args.min_num_votes,
+        min_num_flipped_votes=args.min_num_flipped_votes,
     )
 
     # Filter votes by users
-    users_df = pd.read_json("data/processing/processed_data/users_df.json")
+    users_df = load_df(
+        "data/processing/processed_data/users_df.parquet",
+        columns=["num_big_issues", "num_demographics", "number_participated"],
+    )
     votes_df = filter_votes_by_users(
         users_df=users_df,
         votes_df=votes_df,
         debates_df=debates_df,
-        min_num_demographics=5,
+        min_num_demographics=args.min_num_demographics,
     )
-    votes_df.to_json(
-        "data/processing/filtered_data/votes_filtered_df.json", orient="records"
+    save_df(
+        votes_df,
+        "data/processing/filtered_data/votes_filtered_df.parquet",
+        json_export=True,
+        json_orient="records",
     )
 
     debates_df = debates_df.reset_index()
-    debates_df.to_json(
-        "data/processing/filtered_data/debates_filtered_df.json", orient="records"
+    save_df(
+        debates_df,
+        "data/processing/filtered_data/debates_filtered_df.parquet",
+        json_export=True,
+        json_orient="records",
     )
 
     # Create dataframe with propositions
-    propositions_df = pd.read_json("data/processing/filtered_data/propositions.json")
+    propositions_df = load_df("data/processing/filtered_data/propositions.json")
     propositions_df = propositions_df[
         (propositions_df.proposition != "drop")
         & (propositions_df.proposition != "skip")
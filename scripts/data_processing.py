@@ -19,6 +19,10 @@ from debate_gpt.data_processing.debate_data.create_users_df import (  # noqa: E4
 from debate_gpt.data_processing.debate_data.create_votes_df import (  # noqa: E402
     create_votes_df,
 )
+from debate_gpt.data_processing.debate_data.rounds_store import (  # noqa: E402
+    write_rounds_store,
+)
+from debate_gpt.data_processing.storage import save_df  # noqa: E402
 
 warnings.filterwarnings("ignore")
 
@@ -48,18 +52,23 @@ def main():
         PATH_TO_RAW_USERS_DATA, demographic_columns, user_activity_columns
     )
     debates_df = create_debates_df(PATH_TO_RAW_DEBATES_DATA)
-    votes_df = create_votes_df(debates_df)
+    votes_df = create_votes_df(debates_df, user_ids=users_df.index)
     rounds_df = create_rounds_df(debates_df)
     comments_df = create_comments_df(debates_df)
     debates_df = debates_df[
         ["debate_id", "start_date", "pro_user_id", "con_user_id", "title", "category"]
     ]
 
-    users_df.to_json("data/processing/processed_data/users_df.json")
-    votes_df.to_json("data/processing/processed_data/votes_df.json")
-    comments_df.to_json("data/processing/processed_data/comments_df.json")
-    rounds_df.to_json("data/processing/processed_data/rounds_df.json")
-    debates_df.to_json("data/processing/processed_data/debates_df.json")
+    save_df(users_df, "data/processing/processed_data/users_df.parquet", True)
+    save_df(votes_df, "data/processing/processed_data/votes_df.parquet", True)
+    save_df(comments_df, "data/processing/processed_data/comments_df.parquet", True)
+    save_df(rounds_df, "data/processing/processed_data/rounds_df.parquet", True)
+    write_rounds_store(
+        rounds_df,
+        "data/processing/processed_data/rounds_text.bin",
+        "data/processing/processed_data/rounds_index.parquet",
+    )
+    save_df(debates_df, "data/processing/processed_data/debates_df.parquet", True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+import argparse
+import sys
+import warnings
+
+sys.path.append(".")
+
+from debate_gpt.data_processing.debate_data.filter_data import (  # noqa: E402
+    compute_filter_statistics,
+    sweep_filters,
+)
+from debate_gpt.data_processing.storage import load_df  # noqa: E402
+
+warnings.filterwarnings("ignore")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--percentage", type=float, nargs="+", default=[25])
+    parser.add_argument("--min_tokens", type=int, nargs="+", default=[300])
+    parser.add_argument("--min_num_votes", type=int, nargs="+", default=[3])
+    parser.add_argument("--min_num_flipped_votes", type=int, nargs="+", default=[0])
+    parser.add_argument("--min_num_demographics", type=int, nargs="+", default=[5])
+    parser.add_argument(
+        "--path_to_file", default="data/processing/filtered_data/filter_sweep.csv"
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    debates_df = load_df(
+        "data/processing/processed_data/debates_df.parquet", columns=["debate_id"]
+    ).set_index("debate_id")
+    rounds_df = load_df(
+        "data/processing/processed_data/rounds_df.parquet",
+        columns=["debate_id", "side", "token_count"],
+    )
+    votes_df = load_df(
+        "data/processing/processed_data/votes_df.parquet",
+        columns=["debate_id", "voter_id", "agreed_before", "agreed_after", "flipped"],
+    )
+    users_df = load_df(
+        "data/processing/processed_data/users_df.parquet",
+        columns=["num_demographics"],
+    )
+
+    debate_stats, vote_stats = compute_filter_statistics(
+        rounds_df, votes_df, users_df, debates_df
+    )
+    results = sweep_filters(
+        debate_stats,
+        vote_stats,
+        percentages=args.percentage,
+        min_tokens=args.min_tokens,
+        min_num_votes=args.min_num_votes,
+        min_num_flipped_votes=args.min_num_flipped_votes,
+        min_num_demographics=args.min_num_demographics,
+    )
+
+    print(results.to_string(index=False))
+    results.to_csv(args.path_to_file, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,37 @@
 import argparse
 import glob
-import json
+import os
 import sys
+from typing import Iterable, Optional
 
 import pandas as pd
 
 sys.path.append(".")
 from debate_gpt.data_processing.llm_data.process_results import (  # noqa: E402
-    create_df,
-    extract_answer,
-    get_overlap_sets,
-    majority_vote,
-    process_crowdsourcing_data,
-    to_stance,
+    aggregate_labels,
+    apply_review_queue,
+    to_stances,
+    write_review_queue,
 )
+from debate_gpt.data_processing.llm_data.datasets import (  # noqa: E402
+    write_datasets,
+)
+from debate_gpt.data_processing.llm_data.tidy_session import (  # noqa: E402
+    TidySession,
+)
+from debate_gpt.data_processing.storage import load_df  # noqa: E402
 
-
-def prepare_crowd(files: list[str]):
-    df = pd.concat([pd.read_csv(file) for file in files]).reset_index(drop=True)
-    df = process_crowdsourcing_data(df)
-    df = df.groupby(["debate_id", "voter_id"]).sample(1).reset_index(drop=True)
-    df["model"] = "MTurk"
-
-    return df
+# columns of the LLM outputs read to prepare the tidy results
+TIDY_COLUMNS = [
+    "model",
+    "debate_id",
+    "voter_id",
+    "gpt_response",
+    "processed_gpt_response",
+    "ambiguous",
+    "big_issues",
+    "reasoning",
+]
 
 
 def prepare_ground_truth(
@@ -33,111 +42,115 @@ def prepare_ground_truth(
     truth_df = votes_df[columns]
 
     if question == "q1":
-        truth_df = (
-            truth_df.groupby("debate_id")
-            .apply(lambda x: majority_vote(x, truth_column))
-            .reset_index(name=truth_column)
-        )
+        truth_df = aggregate_labels(truth_df, [truth_column])
 
     truth_df = truth_df.rename(columns={truth_column: "ground_truth"})
     return truth_df
 
 
 def prepare_dataframe(
-    files: list[str],
+    outputs_dfs: Iterable[pd.DataFrame],
     votes_df: pd.DataFrame,
     crowd_df: pd.DataFrame,
     question: str,
     truth_column: str,
     issues: bool = False,
+    path_to_review_queue: Optional[str] = None,
 ) -> pd.DataFrame:
-
+    """Return the tidy results of `question` from the LLM outputs `outputs_dfs` (e.g.
+    one dataframe per output file, see `TidySession.iter_outputs`) and the
+    crowdsourcing answers for the same debates, with the ground truth
+    `truth_column` of the votes.
+
+    Each output dataframe is reduced to the tidy columns as soon as it is read, so
+    only the reduced results of all outputs are held in memory.
+    """
     ground_truth_df = prepare_ground_truth(votes_df, question, truth_column)
 
-    df = create_df(files, issues)
-
-    df["processed_gpt_response"] = df.apply(lambda x: extract_answer(x), axis=1)
-
     id_cols = ["debate_id", "voter_id"]
     if question == "q1":
         id_cols = ["debate_id"]
 
-    crowd_df = crowd_df[["debate_id", "voter_id", "model", question]].rename(
-        columns={question: "processed_gpt_response"}
-    )
-
-    debate_ids = list(df.debate_id.unique())
-    df = pd.concat([df, crowd_df[crowd_df.debate_id.isin(debate_ids)]])
-    df = df.merge(ground_truth_df, on=id_cols)
-
     columns = (
         ["model"] + id_cols + ["gpt_response", "processed_gpt_response", "ground_truth"]
     )
     if issues:
         columns += ["big_issues", "reasoning"]
-    df = df[columns]
-
-    return df
-
-
-def prepare_datasets(q1_files, q2_files, q3_files, issues_files):
-
-    q1_df = create_df(q1_files)
-    q2_df = create_df(q2_files)
-    q3_df = create_df(q3_files)
-
-    datasets = {}
-    for debate_length in list(q1_df.debate_length.unique()):
-        q1_temp = q1_df[q1_df.debate_length == debate_length]
-        q2_temp = q2_df[q2_df.debate_length == debate_length]
-        q3_temp = q3_df[q3_df.debate_length == debate_length]
-        debate_set = get_overlap_sets([q1_temp, q2_temp, q3_temp])
-        datasets[debate_length.title()] = debate_set
-
-    datasets["All"] = get_overlap_sets([q1_df, q2_df, q3_df])
 
-    for file in issues_files:
-        props = pd.read_json(file)
-        debate_ids = list(props.debate_id.unique())
-        name = file.split("/")[-1].split("_props")[0]
-        if "_" in name:
-            name = name.replace("_", " ")
-        name = name.title()
-        datasets[name] = list(map(int, debate_ids))
+    dfs = []
+    ambiguous_dfs = []
+    debate_ids = set()
+    for df in outputs_dfs:
+        if path_to_review_queue is not None:
+            ambiguous_dfs.append(df[df.ambiguous])
+            # answers only come from the reviewed entries, so applying the queue
+            # before adding the new ambiguous responses gives the same answers
+            df = apply_review_queue(df, path_to_review_queue)
+        debate_ids.update(df.debate_id.unique())
+        dfs.append(df.merge(ground_truth_df, on=id_cols)[columns])
+
+    if path_to_review_queue is not None and len(ambiguous_dfs) > 0:
+        write_review_queue(pd.concat(ambiguous_dfs), path_to_review_queue)
 
-    return datasets
+    crowd_df = crowd_df[["debate_id", "voter_id", "model", question]].rename(
+        columns={question: "processed_gpt_response"}
+    )
+    crowd_df = crowd_df[crowd_df.debate_id.isin(debate_ids)]
+    dfs.append(crowd_df.merge(ground_truth_df, on=id_cols).reindex(columns=columns))
 
+    return pd.concat(dfs).reset_index(drop=True)
 
-def prepare_regression_dataframes(votes_df, users_df, debates_df, stance_df):
 
-    debate_ids = list(stance_df.debate_id.unique())
-    df = votes_df[votes_df.debate_id.isin(debate_ids)][
+def prepare_regression_dataframes(
+    votes_df: pd.DataFrame,
+    users_df: pd.DataFrame,
+    debates_df: pd.DataFrame,
+    stance_dfs: dict[str, pd.DataFrame],
+) -> dict[str, pd.DataFrame]:
+    """Return the regression dataframe of each of the `stance_dfs` (by name).
+
+    The votes are joined with the user demographics and the start dates of the
+    debates once for all the debates of `stance_dfs`, and the age is then normalized
+    separately for each regression dataframe.
+    """
+    debate_ids = pd.concat([df.debate_id for df in stance_dfs.values()]).unique()
+    votes_df = votes_df[votes_df.debate_id.isin(debate_ids)][
         ["debate_id", "voter_id", "agreed_before"]
     ]
 
-    # merge df with user demographics
+    # merge votes with user demographics
     users_df = users_df.reset_index().rename(columns={"index": "voter_id"})
-    df = df.merge(users_df, on="voter_id")
-
-    # merge with debates df to add start date for age calculation
-    debates_df["start_date"] = pd.to_datetime(debates_df["start_date"])
-    df = df.merge(debates_df[["debate_id", "start_date"]], on="debate_id")
+    votes_df = votes_df.merge(users_df, on="voter_id")
+
+    # merge with debates to add start date for age calculation
+    start_dates = pd.DataFrame(
+        {
+            "debate_id": debates_df.debate_id,
+            "start_date": pd.to_datetime(debates_df.start_date),
+        }
+    )
+    votes_df = votes_df.merge(start_dates, on="debate_id")
+    votes_df["birthday"] = pd.to_datetime(votes_df.birthday)
+    ages = (votes_df.start_date - votes_df.birthday) / pd.Timedelta("365 days")
 
-    # age calculation
-    df["birthday"] = pd.to_datetime(df.birthday)
-    df["age"] = (df.start_date - df.birthday) / pd.Timedelta("365 days")
-    df["age"] = (df.age.max() - df.age) / (df.age.max() - df.age.min())
-    df["age"] = df.age.fillna(df.age.mean())
+    regression_dfs = {}
+    for name, stance_df in stance_dfs.items():
+        mask = votes_df.debate_id.isin(stance_df.debate_id)
+        df = votes_df[mask].copy()
 
-    df = df.merge(stance_df, on="debate_id")
+        # age normalization
+        age = ages[mask]
+        df["age"] = (age.max() - age) / (age.max() - age.min())
+        df["age"] = df.age.fillna(df.age.mean())
 
-    df["agreed_before"] = df.apply(lambda x: to_stance(x, "agreed_before"), axis=1)
-    df["stance"] = df.apply(lambda x: to_stance(x, "stance"), axis=1)
-    df["agreed_before"] = df.agreed_before * df.stance
+        df = df.merge(stance_df, on="debate_id")
+        df["agreed_before"] = to_stances(df.agreed_before) * to_stances(df.stance)
 
-    df = df.drop(columns=["start_date", "proposition", "stance", "birthday"])
+        regression_dfs[name] = df.drop(
+            columns=["start_date", "proposition", "stance", "birthday"]
+        )
 
-    return df
+    return regression_dfs
 
 
 def main():
@@ -150,60 +163,95 @@ def main():
     parser.add_argument("--prepare_datasets", default="false")
     parser.add_argument("--prepare_regression_df", default="false")
     parser.add_argument("--path_to_files", default="data/tidy/llm_outputs")
+    parser.add_argument(
+        "--path_to_review_queue",
+        default="data/processing/review_queue",
+        help="Folder of the CSV files with the responses to review manually.",
+    )
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
 
     args = parser.parse_args()
+    os.makedirs(args.path_to_review_queue, exist_ok=True)
 
-    votes_df = pd.read_json("data/processing/processed_data/votes_df.json")
-    crowd_df = prepare_crowd(glob.glob("data/processing/crowdsourcing/output/*.csv"))
+    session = TidySession(num_workers=args.num_workers)
 
     if args.prepare_q1 == "true":
-        files = glob.glob("data/processing/llm_outputs/q1/*.json")
         df = prepare_dataframe(
-            files, votes_df, crowd_df, "q1", "more_convincing_arguments"
+            session.iter_outputs("q1", columns=TIDY_COLUMNS),
+            session.votes_df,
+            session.crowd_df,
+            "q1",
+            "more_convincing_arguments",
+            path_to_review_queue=args.path_to_review_queue + "/q1.csv",
         )
         df.to_json(args.path_to_files + "/q1.json")
 
     if args.prepare_q2 == "true":
-        files = glob.glob("data/processing/llm_outputs/q2/*.json")
-        df = prepare_dataframe(files, votes_df, crowd_df, "q2", "agreed_before")
+        df = prepare_dataframe(
+            session.iter_outputs("q2", columns=TIDY_COLUMNS),
+            session.votes_df,
+            session.crowd_df,
+            "q2",
+            "agreed_before",
+            path_to_review_queue=args.path_to_review_queue + "/q2.csv",
+        )
         df.to_json(args.path_to_files + "/q2.json")
 
     if args.prepare_q3 == "true":
-        files = glob.glob("data/processing/llm_outputs/q3/*.json")
-        df = prepare_dataframe(files, votes_df, crowd_df, "q3", "agreed_after")
+        df = prepare_dataframe(
+            session.iter_outputs("q3", columns=TIDY_COLUMNS),
+            session.votes_df,
+            session.crowd_df,
+            "q3",
+            "agreed_after",
+            path_to_review_queue=args.path_to_review_queue + "/q3.csv",
+        )
         df.to_json(args.path_to_files + "/q3.json")
 
     if args.prepare_binary == "true":
-        files = glob.glob("data/processing/llm_outputs/binary/*.json")
-        df = prepare_dataframe(files, votes_df, crowd_df, "q2", "agreed_before")
+        df = prepare_dataframe(
+            session.iter_outputs("binary", columns=TIDY_COLUMNS),
+            session.votes_df,
+            session.crowd_df,
+            "q2",
+            "agreed_before",
+            path_to_review_queue=args.path_to_review_queue + "/binary.csv",
+        )
         df.to_json(args.path_to_files + "/binary.json")
 
     if args.prepare_issues == "true":
-        files = glob.glob("data/processing/llm_outputs/issues/*.json")
-        df = prepare_dataframe(files, votes_df, crowd_df, "q2", "agreed_before", True)
+        df = prepare_dataframe(
+            session.iter_outputs("issues", issues=True, columns=TIDY_COLUMNS),
+            session.votes_df,
+            session.crowd_df,
+            "q2",
+            "agreed_before",
+            issues=True,
+            path_to_review_queue=args.path_to_review_queue + "/issues.csv",
+        )
         df.to_json(args.path_to_files + "/issues.json")
 
     if args.prepare_datasets == "true":
-        datasets = prepare_datasets(
-            glob.glob("data/processing/llm_outputs/q1/*.json"),
-            glob.glob("data/processing/llm_outputs/q2/*.json"),
-            glob.glob("data/processing/llm_outputs/q3/*.json"),
+        write_datasets(
+            session,
             glob.glob("data/processing/propositions/*_props.json"),
+            "data/tidy/datasets.json",
         )
 
-        with open("data/tidy/datasets.json", "w") as f:
-            json.dump(datasets, f)
-
     if args.prepare_regression_df == "true":
-        users_df = pd.read_json("data/processing/processed_data/users_df.json")
-        debates_df = pd.read_json("data/processing/processed_data/debates_df.json")
-        stances = glob.glob("data/processing/propositions/*_props*")
-        for stance in stances:
-            name = stance.split("/")[-1].split("_props")[0]
-            stance_df = pd.read_json(stance)
-            df = prepare_regression_dataframes(
-                votes_df, users_df, debates_df, stance_df
-            )
+        users_df = load_df("data/processing/processed_data/users_df.parquet")
+        debates_df = load_df(
+            "data/processing/processed_data/debates_df.parquet",
+            columns=["debate_id", "start_date"],
+        )
+        stance_dfs = {
+            stance.split("/")[-1].split("_props")[0]: pd.read_json(stance)
+            for stance in glob.glob("data/processing/propositions/*_props*")
+        }
+        regression_dfs = prepare_regression_dataframes(
+            session.votes_df, users_df, debates_df, stance_dfs
+        )
+        for name, df in regression_dfs.items():
             df.to_json(args.path_to_files + "/" + name + ".json")
 
 
@@ -0,0 +1,28 @@
+import argparse
+import sys
+
+sys.path.append(".")
+from debate_gpt.prompt_classes.tokenizer import prewarm_tokenizers  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["gpt-3.5-turbo-1106", "gpt-3.5-turbo", "gpt-4", "gpt-4-32k"],
+        help="The models whose tokenizer files are downloaded.",
+    )
+    parser.add_argument(
+        "--path_to_cache",
+        default=None,
+        help="Defaults to TIKTOKEN_CACHE_DIR or data/processing/cache/tiktoken.",
+    )
+    args = parser.parse_args()
+
+    path_to_cache = prewarm_tokenizers(args.models, args.path_to_cache)
+    print(f"Tokenizer files of {', '.join(args.models)} saved in {path_to_cache}.")
+
+
+if __name__ == "__main__":
+    main()
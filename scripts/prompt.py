@@ -2,20 +2,23 @@ import argparse
 import json
 import os
 import sys
+import time
 import warnings
+from typing import TYPE_CHECKING, Any, Optional
 
-import pandas as pd
+# the heavy modules (pandas, openai, tiktoken) are imported in the functions using
+# them, so that parsing the arguments does not wait for them
+STARTUP = time.perf_counter()
 
 sys.path.append(".")
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-from debate_gpt.prompt_classes.debate_demographics import (  # noqa: E402, E501
-    DebateDemographics,
-)
-from debate_gpt.prompt_classes.proposition_voter import (  # noqa: E402, E501
-    PropositionVoter,
-)
-from debate_gpt.prompt_classes.who_won import WhoWon  # noqa: E402
+    from debate_gpt.prompt_classes.cascade import Cascade
+    from debate_gpt.prompt_classes.data_context import DataContext
+    from debate_gpt.prompt_classes.key_pool import KeyPool
+    from debate_gpt.prompt_classes.prompt_base import PromptBase
 
 warnings.filterwarnings("ignore")
 
@@ -26,7 +29,10 @@ def parse_args():
         "--source",
         default="openai",
         type=str,
-        help="Should be either 'openai' or 'opensource'.",
+        help=(
+            "Should be either 'openai', 'open' (an OpenAI-compatible server) or "
+            "'local' (an open-weights model run on CPU with transformers)."
+        ),
     )
 
     parser.add_argument(
@@ -53,40 +59,202 @@ def parse_args():
     parser.add_argument("--big_issues", type=str, default="false")
     parser.add_argument("--binary", type=str, default="false")
     parser.add_argument("--path_to_file", type=str)
+    parser.add_argument(
+        "--scoring",
+        type=str,
+        default="false",
+        help=(
+            "If true, record the log-probabilities of 'Pro', 'Con' and 'Tie' instead "
+            "of generating an answer. Only with the local source."
+        ),
+    )
+    parser.add_argument(
+        "--streaming",
+        type=str,
+        default="false",
+        help=(
+            "If true, stream the responses and stop each one as soon as its final "
+            "answer is received."
+        ),
+    )
+    parser.add_argument(
+        "--cascade_model",
+        type=str,
+        default=None,
+        help=(
+            "If given, this cheaper model answers first and only the answers it is "
+            "unsure about are sent to --model."
+        ),
+    )
+    parser.add_argument(
+        "--cascade_source",
+        type=str,
+        default="openai",
+        help="Should be either 'openai' or 'local'.",
+    )
+    parser.add_argument(
+        "--cascade_samples",
+        type=int,
+        default=1,
+        help=(
+            "If more than 1, the confidence of the cascade model is the agreement "
+            "between this many samples instead of the probability of its answer."
+        ),
+    )
+    parser.add_argument(
+        "--confidence_threshold",
+        type=float,
+        default=0.9,
+        help="Answers of the cascade model below this confidence are escalated.",
+    )
+    parser.add_argument(
+        "--evaluate",
+        type=str,
+        default="false",
+        help=(
+            "If true, prompt the voters of q2 or q3 in a random order stratified by "
+            "debate until the confidence interval of the accuracy is --ci_width wide."
+        ),
+    )
+    parser.add_argument(
+        "--ci_width",
+        type=float,
+        default=4,
+        help="Width in accuracy points of the interval stopping the evaluation.",
+    )
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument(
+        "--min_voters",
+        type=int,
+        default=100,
+        help="Number of voters prompted before the evaluation may stop.",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=None,
+        help=(
+            "If given with --tpm, the requests are sent concurrently within this "
+            "many requests per minute."
+        ),
+    )
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        default=None,
+        help="The tokens per minute of the concurrent requests (see --rpm).",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=8,
+        help="Number of requests sent at once with --rpm and --tpm.",
+    )
+    parser.add_argument(
+        "--path_to_keys",
+        type=str,
+        default=None,
+        help=(
+            "JSON file listing the OpenAI API keys to send the requests with, each "
+            "with its api_key (or api_key_env), organization, rpm, tpm and budget. "
+            "Defaults to OPENAI_API_KEYS (comma-separated) or OPENAI_API_KEY."
+        ),
+    )
+    parser.add_argument(
+        "--dry_run",
+        type=str,
+        default="false",
+        help="If true, only load the data and report the debates left to prompt.",
+    )
+    parser.add_argument(
+        "--profile_startup",
+        type=str,
+        default="false",
+        help="If true, report the time spent in each step before prompting.",
+    )
 
     args = parser.parse_args()
     return args
 
 
+def run_task(
+    task: "PromptBase",
+    debate_ids: list[int],
+    path_to_file: str,
+    truth_column: Optional[str] = None,
+    evaluation: Optional[dict[str, Any]] = None,
+    scheduling: Optional[dict[str, Any]] = None,
+):
+    """Prompt `task` for all the debates in `debate_ids`, or if `evaluation` is given,
+    for a sample of their voters as in `run_sequential_evaluation` with the keyword
+    arguments `evaluation`. If `scheduling` is given, the requests of all the debates
+    are sent concurrently by a `TokenScheduler` with the keyword arguments
+    `scheduling`.
+    """
+    if (evaluation is None) and (scheduling is not None):
+        from debate_gpt.prompt_classes.scheduler import TokenScheduler
+
+        TokenScheduler(task, **scheduling).run(debate_ids, path_to_file)
+        return
+
+    if evaluation is None:
+        task.get_batch_results(debate_ids, path_to_file)
+        return
+
+    from debate_gpt.prompt_classes.sequential_evaluation import (
+        run_sequential_evaluation,
+    )
+
+    summary = run_sequential_evaluation(
+        task, debate_ids, truth_column, path_to_file, **evaluation
+    )
+    lower, upper = summary["confidence_interval"]
+    print(
+        f"Accuracy: {summary['accuracy']:.2f} [{lower:.2f}, {upper:.2f}] over "
+        f"{summary['num_voters']} voters of {summary['num_debates']} debates"
+    )
+    if not summary["reached_width"]:
+        print("The voters ran out before the interval reached the requested width.")
+
+
 def who_won(
     task_config,
-    debates_df: pd.DataFrame,
-    rounds_df: pd.DataFrame,
-    votes_df: pd.DataFrame,
-    users_df: pd.DataFrame,
+    data_context: "DataContext",
     source: str,
     model: str,
     debate_ids: list[int],
     path_to_file: str,
+    scoring: str = "false",
+    streaming: str = "false",
+    cascade: Optional["Cascade"] = None,
+    key_pool: Optional["KeyPool"] = None,
+    scheduling: Optional[dict[str, Any]] = None,
 ):
+    from debate_gpt.prompt_classes.who_won import WhoWon
+
     task = WhoWon(
         task_config=task_config["WhoWon"],
-        debates_df=debates_df,
-        rounds_df=rounds_df,
-        votes_df=votes_df,
-        users_df=users_df,
+        debates_df=data_context.debates_df,
+        rounds_df=None,
+        votes_df=data_context.votes_df,
+        users_df=data_context.users_df,
         source=source,
         model=model,
+        data_context=data_context,
+        scoring=scoring == "true",
+        streaming=streaming == "true",
+        cascade=cascade,
+        key_pool=key_pool,
     )
-    task.get_batch_results(
-        debate_ids=debate_ids,
-        path_to_file=path_to_file,
-    )
+    run_task(task, debate_ids, path_to_file, scheduling=scheduling)
 
 
 def get_remaining_debates(
-    debate_ids: list[int], path_to_file: str, question: str, votes_df: pd.DataFrame
+    debate_ids: list[int], path_to_file: str, question: str, votes_df: "pd.DataFrame"
 ):
+    import pandas as pd
+
     if question == "q1":
         if os.path.isfile(path_to_file):
             with open(path_to_file) as f:
@@ -101,7 +269,7 @@ def get_remaining_debates(
             with open(path_to_file) as f:
                 full_set = set(
                     votes_df[votes_df.debate_id.isin(debate_ids)]
-                    .groupby(["debate_id", "voter_id"])
+                    .groupby(["debate_id", "voter_id"], observed=True)
                     .groups.keys()
                 )
                 partial_set = set(
@@ -120,16 +288,20 @@ def proposition_voter(
     binary: str,
     reasoning: str,
     big_issues: str,
-    propositions_df: pd.DataFrame,
-    debates_df: pd.DataFrame,
-    rounds_df: pd.DataFrame,
-    votes_df: pd.DataFrame,
-    users_df: pd.DataFrame,
+    data_context: "DataContext",
     source: str,
     model: str,
     debate_ids: list[int],
     path_to_file: str,
+    scoring: str = "false",
+    streaming: str = "false",
+    cascade: Optional["Cascade"] = None,
+    key_pool: Optional["KeyPool"] = None,
+    evaluation: Optional[dict[str, Any]] = None,
+    scheduling: Optional[dict[str, Any]] = None,
 ):
+    from debate_gpt.prompt_classes.proposition_voter import PropositionVoter
+
     if binary == "true":
         reason_config = task_config["PropositionVoterBinary"]
     elif reasoning == "true":
@@ -144,93 +316,204 @@ def proposition_voter(
 
     task = PropositionVoter(
         task_config=reason_config,
-        propositions_df=propositions_df,
-        debates_df=debates_df,
-        rounds_df=rounds_df,
-        votes_df=votes_df,
-        users_df=users_df,
+        propositions_df=data_context.propositions_df,
+        debates_df=data_context.debates_df,
+        rounds_df=None,
+        votes_df=data_context.votes_df,
+        users_df=data_context.users_df,
         big_issue_columns=big_issues_config,
         demographic_columns=task_config["demographic_columns"],
         demographic_map=task_config["demographics_map"],
         max_gpt_response_tokens=500,
         source=source,
         model=model,
+        data_context=data_context,
+        scoring=scoring == "true",
+        streaming=streaming == "true",
+        cascade=cascade,
+        key_pool=key_pool,
     )
 
-    task.get_batch_results(debate_ids, path_to_file)
+    run_task(task, debate_ids, path_to_file, "agreed_before", evaluation, scheduling)
 
 
 def debate_demographics(
     task_config,
-    debates_df: pd.DataFrame,
-    rounds_df: pd.DataFrame,
-    votes_df: pd.DataFrame,
-    users_df: pd.DataFrame,
+    data_context: "DataContext",
     source: str,
     model: str,
     debate_ids: list[int],
     path_to_file: str,
+    scoring: str = "false",
+    streaming: str = "false",
+    cascade: Optional["Cascade"] = None,
+    key_pool: Optional["KeyPool"] = None,
+    evaluation: Optional[dict[str, Any]] = None,
+    scheduling: Optional[dict[str, Any]] = None,
 ):
+    from debate_gpt.prompt_classes.debate_demographics import DebateDemographics
+
     task = DebateDemographics(
         task_config=task_config["DebateDemographics"],
-        debates_df=debates_df,
-        rounds_df=rounds_df,
-        votes_df=votes_df,
-        users_df=users_df,
+        debates_df=data_context.debates_df,
+        rounds_df=None,
+        votes_df=data_context.votes_df,
+        users_df=data_context.users_df,
         demographic_columns=task_config["demographic_columns"],
         source=source,
         model=model,
+        data_context=data_context,
+        scoring=scoring == "true",
+        streaming=streaming == "true",
+        cascade=cascade,
+        key_pool=key_pool,
     )
-    task.get_batch_results(
-        debate_ids=debate_ids,
-        path_to_file=path_to_file,
-    )
+    run_task(task, debate_ids, path_to_file, "agreed_after", evaluation, scheduling)
+
+
+def print_startup_report(timings: list[tuple[str, float]]) -> None:
+    """Print the time spent in each startup step of `timings`, a list of (step,
+    time at the end of the step) pairs.
+    """
+    previous = STARTUP
+    for step, end in timings:
+        print(f"{step:<20}{end - previous:8.3f}s")
+        previous = end
+    print(f"{'total':<20}{previous - STARTUP:8.3f}s")
 
 
 def main():
     args = parse_args()
+    timings = [("parse arguments", time.perf_counter())]
+
+    from debate_gpt.prompt_classes.data_context import load_data_context
+
+    timings.append(("import modules", time.perf_counter()))
 
     with open("config/task_configs.json") as f:
         task_config = json.load(f)
 
-    users_df = pd.read_json(task_config["path_to_users"])
-    votes_df = pd.read_json(task_config["path_to_votes"])
+    votes_filters = None
     if args.binary == "true":
-        votes_df = votes_df[votes_df.agreed_before != "Tie"]
-    debates_df = pd.read_json(task_config["path_to_debates"])
-    rounds_df = pd.read_json(task_config["path_to_rounds"])
+        votes_filters = [("agreed_before", "!=", "Tie")]
 
     if args.debates == "full":
-        propositions_df = pd.read_json(task_config["path_to_propositions"])
+        path_to_propositions = task_config["path_to_propositions"]
     elif args.debates == "abortion":
-        propositions_df = pd.read_json(task_config["path_to_abortion_props"])
+        path_to_propositions = task_config["path_to_abortion_props"]
     elif args.debates == "gay":
-        propositions_df = pd.read_json(task_config["path_to_gay_props"])
+        path_to_propositions = task_config["path_to_gay_props"]
     elif args.debates == "capital":
-        propositions_df = pd.read_json(task_config["path_to_capital_props"])
+        path_to_propositions = task_config["path_to_capital_props"]
     elif args.debates == "issues":
-        propositions_df = pd.read_json(task_config["path_to_issues_props"])
-
-    debate_ids = list(propositions_df.debate_id.unique())
-
-    if args.question != "q2_prompts":
+        path_to_propositions = task_config["path_to_issues_props"]
+
+    with load_data_context(
+        task_config, path_to_propositions, votes_filters
+    ) as data_context:
+        timings.append(("load data", time.perf_counter()))
+        prompt_question(args, task_config, data_context, timings)
+
+
+def prompt_question(
+    args: argparse.Namespace,
+    task_config: dict[str, Any],
+    data_context: "DataContext",
+    timings: list[tuple[str, float]],
+) -> None:
+    """Prompt the model for the question of `args` with the data of `data_context`."""
+    from debate_gpt.prompt_classes.tokenizer import get_encoding
+
+    votes_df = data_context.votes_df
+
+    debate_ids = list(data_context.propositions_df.debate_id.unique())
+
+    evaluation = None
+    if args.evaluate == "true":
+        if args.question not in ["q2", "q3"]:
+            raise ValueError("The evaluation is only available for q2 and q3.")
+        evaluation = {
+            "width": args.ci_width,
+            "confidence": args.confidence,
+            "min_items": args.min_voters,
+            "seed": args.seed,
+        }
+
+    # the evaluation samples the voters of every debate
+    if (args.question != "q2_prompts") and (evaluation is None):
         debate_ids = get_remaining_debates(
             debate_ids, args.path_to_file, args.question, votes_df
         )
+    timings.append(("remaining debates", time.perf_counter()))
+
+    if args.profile_startup == "true":
+        # only q1 and q3 count tokens, but the tokenizer is timed for every question
+        try:
+            get_encoding(args.model)
+        except Exception as e:
+            print(f"Tokenizer unavailable: {e}")
+        timings.append(("load tokenizer", time.perf_counter()))
+        print_startup_report(timings)
+
+    if args.dry_run == "true":
+        print(f"{len(debate_ids)} debates left to prompt for {args.question}.")
+        return
+
+    scheduling = None
+    if (args.rpm is None) != (args.tpm is None):
+        raise ValueError("The scheduler needs both --rpm and --tpm.")
+    if args.rpm is not None:
+        if args.source == "local":
+            raise ValueError("The local source is not rate limited, omit --rpm.")
+        if evaluation is not None:
+            raise ValueError(
+                "The evaluation prompts one voter at a time, omit --rpm and --tpm."
+            )
+        scheduling = {
+            "rpm": args.rpm,
+            "tpm": args.tpm,
+            "num_workers": args.num_workers,
+        }
+
+    # a single pool counts the limits and spend of the model and of the cascade
+    key_pool = None
+    if (args.source == "openai") or (
+        (args.cascade_model is not None) and (args.cascade_source == "openai")
+    ):
+        from debate_gpt.prompt_classes.key_pool import KeyPool
+
+        if args.path_to_keys is not None:
+            key_pool = KeyPool.from_file(args.path_to_keys)
+        else:
+            key_pool = KeyPool.from_env()
+
+    cascade = None
+    if args.cascade_model is not None:
+        from debate_gpt.prompt_classes.cascade import Cascade
+
+        cascade = Cascade(
+            model=args.cascade_model,
+            source=args.cascade_source,
+            threshold=args.confidence_threshold,
+            num_samples=args.cascade_samples,
+            key_pool=key_pool,
+        )
 
     # Q1: Can LLMs judge the quality of arguments (compared to humans)?
 
     if args.question == "q1":
         who_won(
             task_config=task_config,
-            debates_df=debates_df,
-            rounds_df=rounds_df,
-            votes_df=votes_df,
-            users_df=users_df,
+            data_context=data_context,
             source=args.source,
             model=args.model,
             debate_ids=debate_ids,
             path_to_file=args.path_to_file,
+            scoring=args.scoring,
+            streaming=args.streaming,
+            cascade=cascade,
+            key_pool=key_pool,
+            scheduling=scheduling,
         )
 
     # Q2: Can LLMs judge how a person’s demographics and beliefs affect their stance on
@@ -242,15 +525,17 @@ def main():
             binary=args.binary,
             reasoning=args.reasoning,
             big_issues=args.big_issues,
-            propositions_df=propositions_df,
-            debates_df=debates_df,
-            rounds_df=rounds_df,
-            votes_df=votes_df,
-            users_df=users_df,
+            data_context=data_context,
             source=args.source,
             model=args.model,
             debate_ids=debate_ids,
             path_to_file=args.path_to_file,
+            scoring=args.scoring,
+            streaming=args.streaming,
+            cascade=cascade,
+            key_pool=key_pool,
+            evaluation=evaluation,
+            scheduling=scheduling,
         )
 
     if args.question == "q2_prompts":
@@ -272,31 +557,39 @@ def main():
                     binary=args.binary,
                     reasoning=reasoning,
                     big_issues=big_issues,
-                    propositions_df=propositions_df,
-                    debates_df=debates_df,
-                    rounds_df=rounds_df,
-                    votes_df=votes_df,
-                    users_df=users_df,
+                    data_context=data_context,
                     source=args.source,
                     model=args.model,
                     debate_ids=debate_ids_new,
                     path_to_file=path_to_file,
+                    scoring=args.scoring,
+                    streaming=args.streaming,
+                    cascade=cascade,
+                    key_pool=key_pool,
+                    scheduling=scheduling,
                 )
 
     # Q3: Do demographics and beliefs improve LLM judging quality?
     if args.question == "q3":
         debate_demographics(
             task_config=task_config,
-            debates_df=debates_df,
-            rounds_df=rounds_df,
-            votes_df=votes_df,
-            users_df=users_df,
+            data_context=data_context,
             source=args.source,
             model=args.model,
             debate_ids=debate_ids,
             path_to_file=args.path_to_file,
+            scoring=args.scoring,
+            streaming=args.streaming,
+            cascade=cascade,
+            key_pool=key_pool,
+            evaluation=evaluation,
+            scheduling=scheduling,
         )
 
+    if key_pool is not None:
+        for stats in key_pool.get_stats():
+            print(stats)
+
 
 if __name__ == "__main__":
     main()
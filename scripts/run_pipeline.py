@@ -0,0 +1,59 @@
+import argparse
+import json
+import sys
+
+sys.path.append(".")
+
+from debate_gpt.pipeline.runner import PipelineRunner  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path_to_config", default="config/pipeline_config.json")
+    parser.add_argument(
+        "--stages",
+        nargs="*",
+        help="The stages to bring up to date (all stages by default).",
+    )
+    parser.add_argument(
+        "--force", nargs="*", default=[], help="Stages to rerun even if up to date."
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="Override a stage parameter, e.g. filtering.min_tokens=400.",
+    )
+    parser.add_argument("--dry_run", type=str, default="false")
+
+    args = parser.parse_args()
+    return args
+
+
+def set_params(pipeline_config, params: list[str]) -> None:
+    """Override the params in `pipeline_config` with the `params` of the form
+    stage.param=value.
+    """
+    for param in params:
+        key, value = param.split("=", 1)
+        stage, name = key.split(".", 1)
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            pass
+        pipeline_config["stages"][stage].setdefault("params", {})[name] = value
+
+
+def main():
+    args = parse_args()
+
+    with open(args.path_to_config) as f:
+        pipeline_config = json.load(f)
+    set_params(pipeline_config, args.param)
+
+    runner = PipelineRunner(pipeline_config)
+    runner.run(stages=args.stages, force=args.force, dry_run=(args.dry_run == "true"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
 import json
 import os
+import sys
 
 import pandas as pd
 import tqdm
 
+sys.path.append(".")
+
+from debate_gpt.data_processing.debate_data.rounds_store import (  # noqa: E402
+    RoundsStore,
+    open_rounds_store,
+)
+from debate_gpt.data_processing.storage import load_df  # noqa: E402
+
 
 def save_results_to_file(results: list[dict[str, str]], path_to_file: str) -> None:
     """Save `results` into `path_to_file`.
@@ -21,14 +30,14 @@ def save_results_to_file(results: list[dict[str, str]], path_to_file: str) -> No
         json.dump(results, f)
 
 
-def get_debate_text(debate_id: int, rounds_df: pd.DataFrame) -> str:
-    """Returns the text of debate with id 'debate_id' which is stored in multiple rows
-    in 'rounds_df'."""
+def get_debate_text(debate_id: int, rounds_store: RoundsStore) -> str:
+    """Returns the text of debate with id 'debate_id' which is stored in multiple
+    rounds in 'rounds_store'."""
     # retrieve all the rounds of the debate
-    debate_rounds = rounds_df[rounds_df.debate_id == debate_id]
+    debate_rounds = rounds_store.get_debate_rounds(debate_id)
     debate_text = ""  # initialize debate text
-    for _, round in debate_rounds.iterrows():
-        debate_text += round.side + ": " + round.text + "\n\n"
+    for _, side, text in debate_rounds:
+        debate_text += side + ": " + text + "\n\n"
 
     return debate_text
 
@@ -54,10 +63,10 @@ def update_ids(debate_ids: list[int], path_to_file: str) -> list[int]:
 def write_proposition(
     debate_id: int,
     debates_df: pd.DataFrame,
-    rounds_df: pd.DataFrame,
+    rounds_store: RoundsStore,
     path_to_file: str,
 ):
-    debate = get_debate_text(debate_id, rounds_df)
+    debate = get_debate_text(debate_id, rounds_store)
     print(f"DEBATE {debate_id}")
     print(
         f"Debate Title: {debates_df[debates_df.debate_id == debate_id].iloc[0].at['title']}\n"  # noqa: E501
@@ -71,27 +80,34 @@ def write_proposition(
 def write_propositions(
     debate_ids: list[int],
     debates_df: pd.DataFrame,
-    rounds_df: pd.DataFrame,
+    rounds_store: RoundsStore,
     path_to_file: str,
 ) -> None:
     """Write the proposition corresponding to each debate id in the 'debate_ids' list in
     'path_to_file'.
 
     For each debate in the list of 'debate_ids', the debate itself is printed for the
-    user from the rounds contained in 'rounds_df'. Then, the user input is the
+    user from the rounds contained in 'rounds_store'. Then, the user input is the
     proposition
     that is written to 'path_to_file'."""
     for debate_id in tqdm.tqdm(debate_ids):
-        write_proposition(debate_id, debates_df, rounds_df, path_to_file)
+        write_proposition(debate_id, debates_df, rounds_store, path_to_file)
 
 
 def main():
-    debates_df = pd.read_json("data/filtered_data/debates_filtered_df.json")
-    rounds_df = pd.read_json("data/processed_data/rounds_df.json")
+    debates_df = load_df(
+        "data/filtered_data/debates_filtered_df.parquet",
+        columns=["debate_id", "title", "category"],
+    )
     debate_ids = list(debates_df[debates_df.category == "Politics"].debate_id)
     path_to_file = "data/raw_data/propositions.json"
     debate_ids = update_ids(debate_ids, path_to_file)
-    write_propositions(debate_ids, debates_df, rounds_df, path_to_file)
+    with open_rounds_store(
+        "data/processed_data/rounds_text.bin",
+        "data/processed_data/rounds_index.parquet",
+        "data/processed_data/rounds_df.parquet",
+    ) as rounds_store:
+        write_propositions(debate_ids, debates_df, rounds_store, path_to_file)
 
 
 if __name__ == "__main__":